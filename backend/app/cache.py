@@ -0,0 +1,245 @@
+"""Report result cache with range-aware invalidation.
+
+A cache entry holds every computed row of one report query (all pages), so
+page clicks on the same query are served without touching Mongo. Keys embed
+the entry's tags -- platform, account and date range -- which lets
+:meth:`ReportCache.invalidate` drop exactly the entries a write overlaps,
+for any backend that can list its keys.
+
+Backends: an in-process LRU/TTL store (default) or Redis when
+``REPORT_CACHE_URL`` is set (requires the optional ``redis`` package).
+
+Cache misses go through :class:`SingleFlight`: concurrent identical queries
+share one computation instead of each scanning Mongo. Every invalidation
+bumps :attr:`ReportCache.generation`; a computation that started before a
+write is neither joined by later requests nor stored.
+
+Environment: ``REPORT_CACHE_TTL`` seconds (default 300, 0 disables),
+``REPORT_CACHE_SIZE`` max entries for the in-process store (default 128).
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .normalize import norm_label
+
+
+KEY_PREFIX = "report"
+ALL = "*"
+
+
+def _tag(v: Optional[str]) -> str:
+    return norm_label(v).replace("|", "/")
+
+
+class MemoryBackend:
+    """In-process LRU store with per-entry expiry."""
+
+    def __init__(self, max_entries: int = 128) -> None:
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    async def keys(self) -> List[str]:
+        return list(self._data.keys())
+
+    def size(self) -> int:
+        return len(self._data)
+
+
+class RedisBackend:
+    """Shared store for multiple workers; values are JSON, expiry and eviction are Redis's."""
+
+    def __init__(self, url: str) -> None:
+        try:
+            import redis.asyncio as redis  # 可选依赖
+        except ImportError as exc:  # pragma: no cover - 取决于部署环境
+            raise RuntimeError("REPORT_CACHE_URL requires the 'redis' package") from exc
+        self._redis = redis.from_url(url)
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[Any]:
+        raw = await self._redis.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        await self._redis.set(key, json.dumps(value, ensure_ascii=False, default=str), ex=max(int(ttl), 1))
+
+    async def delete(self, key: str) -> None:
+        await self._redis.delete(key)
+
+    async def keys(self) -> List[str]:
+        return [k.decode() if isinstance(k, bytes) else k async for k in self._redis.scan_iter(match=f"{KEY_PREFIX}|*")]
+
+    def size(self) -> int:
+        return -1
+
+
+class ReportCache:
+    def __init__(self, backend: Any, ttl: float) -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # 每次写入失效后加一；计算开始与结束时不一致说明结果可能已过时
+        self.generation = 0
+        self.invalidated_at: Optional[float] = None  # time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    @staticmethod
+    def make_key(
+        platform: Optional[str],
+        account: Optional[str],
+        start_d: date,
+        end_d: date,
+        **params: Any,
+    ) -> str:
+        """``report|platform|account|start|end|digest``: tags first, other parameters hashed."""
+        digest = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:16]
+        plat = _tag(platform) or ALL
+        acc = _tag(account) or ALL
+        return "|".join([KEY_PREFIX, plat, acc, start_d.isoformat(), end_d.isoformat(), digest])
+
+    def invalidated_within(self, seconds: float) -> bool:
+        """本进程最近 ``seconds`` 秒内是否有写入失效。"""
+        return self.invalidated_at is not None and time.monotonic() - self.invalidated_at < seconds
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = await self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def put(self, key: str, value: Dict[str, Any]) -> None:
+        await self.backend.set(key, value, self.ttl)
+
+    async def invalidate(
+        self,
+        platform: Optional[str] = None,
+        account: Optional[str] = None,
+        start_d: Optional[date] = None,
+        end_d: Optional[date] = None,
+    ) -> int:
+        """Drop entries whose platform/account/date range overlaps the written data."""
+        self.generation += 1
+        self.invalidated_at = time.monotonic()
+        plat = _tag(platform)
+        acc = _tag(account)
+        dropped = 0
+        for key in await self.backend.keys():
+            parts = key.split("|")
+            if len(parts) != 6:
+                continue
+            _prefix, k_plat, k_acc, k_start, k_end, _digest = parts
+            if plat and k_plat not in (ALL, plat):
+                continue
+            if acc and k_acc not in (ALL, acc):
+                continue
+            if end_d is not None and k_start > end_d.isoformat():
+                continue
+            if start_d is not None and k_end < start_d.isoformat():
+                continue
+            await self.backend.delete(key)
+            dropped += 1
+        self.invalidations += dropped
+        return dropped
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "backend": type(self.backend).__name__,
+            "ttl": self.ttl,
+            "size": self.backend.size(),
+            "max_entries": getattr(self.backend, "max_entries", None),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.backend.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one in-flight computation (per process).
+
+    The computation runs as its own task, so a caller going away does not
+    cancel it for the others waiting on it.
+    """
+
+    def __init__(self) -> None:
+        self._calls: Dict[str, "asyncio.Task[Any]"] = {}
+        self.leaders = 0
+        self.shared = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        return await asyncio.shield(self.start(key, fn))
+
+    def start(self, key: str, fn: Callable[[], Awaitable[Any]]) -> "asyncio.Task[Any]":
+        """Join or start the computation for ``key`` without waiting for it (registered immediately)."""
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.shared += 1
+        return task
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._calls
+
+    def _done(self, key: str, task: "asyncio.Task[Any]") -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # 等待方都已离开时也不报 "exception was never retrieved"
+
+    def stats(self) -> Dict[str, Any]:
+        return {"in_flight": len(self._calls), "leaders": self.leaders, "shared": self.shared}
+
+
+def build_report_cache() -> ReportCache:
+    ttl = float(os.getenv("REPORT_CACHE_TTL", "300"))
+    url = os.getenv("REPORT_CACHE_URL")
+    backend: Any = RedisBackend(url) if url else MemoryBackend(int(os.getenv("REPORT_CACHE_SIZE", "128")))
+    return ReportCache(backend, ttl)
+
+
+report_cache = build_report_cache()
+report_flights = SingleFlight()
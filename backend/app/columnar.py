@@ -0,0 +1,214 @@
+"""Columnar (NumPy) row engine, an alternative to the per-record Python builder.
+
+All records of a batch of products are flattened into arrays -- a product
+code, a day offset and one float64 array per metric -- and bucketed with the
+day->bucket lookup precomputed by :class:`app.periods.PeriodSpec`. Day mode
+keeps the last record per cell (as the Python builder's assignment does);
+cumulative modes sum with ``np.bincount``, which accumulates in record order
+exactly like ``+=``, and take inventory from the latest day of the bucket.
+Rounding is applied with Python's ``round`` on the final values so the output
+matches the Python engine value for value.
+
+Select with ``REPORT_ENGINE=columnar`` or ``engine=columnar`` on /api/report.
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .compare import compare_block
+from .periods import PeriodSpec
+from .rolling import summary_from_sums
+
+
+# 与 DayMetrics 同名的可累加/可赋值指标
+INT_FIELDS: Tuple[str, ...] = ("total_sales_qty", "ad_sales_qty", "natural_sales_qty", "inventory")
+FLOAT_FIELDS: Tuple[str, ...] = ("avg_price", "sales_amount", "goods_cost", "sales_cost", "ad_spend", "payout")
+SUM_FIELDS: Tuple[str, ...] = tuple(f for f in INT_FIELDS + FLOAT_FIELDS if f not in ("inventory", "avg_price"))
+
+
+def latest_records(group: np.ndarray, day: np.ndarray) -> np.ndarray:
+    """Index of the latest record (by ``day``, ties: last in record order) per distinct ``group``, by group."""
+    if len(group) == 0:
+        return np.empty(0, dtype=np.int64)
+    order = np.lexsort((np.arange(len(group)), day, group))
+    sorted_group = group[order]
+    last = np.empty(len(order), dtype=bool)
+    last[:-1] = sorted_group[1:] != sorted_group[:-1]
+    last[-1] = True
+    return order[last]
+
+
+def _ratio(num: np.ndarray, den: np.ndarray) -> np.ndarray:
+    out = np.zeros_like(num)
+    np.divide(num, den, out=out, where=den > 0)
+    return out
+
+
+def _aggregate(
+    spec: PeriodSpec,
+    gid: np.ndarray,
+    day_ord: np.ndarray,
+    cols: Dict[str, np.ndarray],
+    n_groups: int,
+) -> Tuple[List[List[Dict[str, Any]]], List[Dict[str, Any]]]:
+    """(cells per group, summary per group) of one spec over the flattened records."""
+    buckets = spec.buckets
+    cumulative = spec.cumulative
+    nb = len(buckets)
+    span = spec.span
+    lookup = np.asarray(spec.lookup, dtype=np.int64)
+
+    off = day_ord - spec.start.toordinal()
+    in_span = (off >= 0) & (off < span)
+    bucket = np.full(len(off), -1, dtype=np.int64)
+    bucket[in_span] = lookup[off[in_span]]
+    valid = bucket >= 0
+    cell = (gid * nb + bucket)[valid]
+    n_cells = n_groups * nb
+    vals = {f: c[valid] for f, c in cols.items()}
+
+    out: Dict[str, np.ndarray] = {}
+    # 日列：同一天多条取后到的；周/月等：库存取桶内最后一天
+    last_idx = latest_records(cell, day_ord[valid])
+    last_cells = cell[last_idx]
+    if cumulative:
+        for f in SUM_FIELDS:
+            out[f] = np.bincount(cell, weights=vals[f], minlength=n_cells)
+        out["inventory"] = np.zeros(n_cells)
+        out["inventory"][last_cells] = vals["inventory"][last_idx]
+        out["avg_price"] = _ratio(out["sales_amount"], out["total_sales_qty"])
+    else:
+        for f in INT_FIELDS + FLOAT_FIELDS:
+            arr = np.zeros(n_cells)
+            arr[last_cells] = vals[f][last_idx]
+            out[f] = arr
+    profit = out["sales_amount"] - out["goods_cost"] - out["sales_cost"] - out["ad_spend"]
+    ad_ratio = _ratio(out["ad_spend"], out["sales_amount"])
+
+    # 汇总：按行顺序累加（cumsum 与 Python sum 的累加顺序一致）
+    shaped = {f: out[f].reshape(n_groups, nb)[:, spec.summary_from:] for f in ("total_sales_qty", "sales_amount", "ad_sales_qty", "ad_spend")}
+    sums = {f: (np.cumsum(v, axis=1)[:, -1] if v.shape[1] else np.zeros(n_groups)) for f, v in shaped.items()}
+
+    cells = {f: out[f].tolist() for f in out}
+    profit_l = profit.tolist()
+    ad_ratio_l = ad_ratio.tolist()
+    sum_l = {f: v.tolist() for f, v in sums.items()}
+
+    all_cells: List[List[Dict[str, Any]]] = []
+    summaries: List[Dict[str, Any]] = []
+    for gi in range(n_groups):
+        days: List[Dict[str, Any]] = []
+        for bi, (_s, _e, label) in enumerate(buckets):
+            c = gi * nb + bi
+            days.append(
+                {
+                    "date": label,
+                    "total_sales_qty": int(cells["total_sales_qty"][c]),
+                    "ad_sales_qty": int(cells["ad_sales_qty"][c]),
+                    "natural_sales_qty": int(cells["natural_sales_qty"][c]),
+                    "avg_price": round(cells["avg_price"][c], 2) if cumulative else cells["avg_price"][c],
+                    "goods_cost": cells["goods_cost"][c],
+                    "sales_cost": cells["sales_cost"][c],
+                    "ad_spend": cells["ad_spend"][c],
+                    "sales_amount": cells["sales_amount"][c],
+                    "payout": cells["payout"][c],
+                    "profit": round(profit_l[c], 2),
+                    "inventory": int(cells["inventory"][c]),
+                    "ad_ratio": round(ad_ratio_l[c], 4),
+                }
+            )
+        all_cells.append(days)
+        summaries.append(
+            summary_from_sums(
+                int(sum_l["total_sales_qty"][gi]),
+                sum_l["sales_amount"][gi],
+                int(sum_l["ad_sales_qty"][gi]),
+                sum_l["ad_spend"][gi],
+            )
+        )
+    return all_cells, summaries
+
+
+RECORD_FIELDS: Tuple[str, ...] = INT_FIELDS + FLOAT_FIELDS
+
+
+def pack_records(groups: Sequence[Tuple[tuple, List[Dict[str, Any]]]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Flatten the records of ``groups`` into ``(gid, day ordinal, values)`` arrays.
+
+    ``values`` is ``len(RECORD_FIELDS) x n_records`` float64, one contiguous
+    row per field; ids and ordinals are int32. Compact enough to hand to a
+    worker process instead of the record dicts.
+    """
+    gid_list: List[int] = []
+    ord_list: List[int] = []
+    flat: List[Dict[str, Any]] = []
+    for gi, (_key, records) in enumerate(groups):
+        for rec in records:
+            gid_list.append(gi)
+            ord_list.append(rec["day"].toordinal())
+            flat.append(rec)
+    values = np.empty((len(RECORD_FIELDS), len(flat)), dtype=np.float64)
+    for i, f in enumerate(RECORD_FIELDS):
+        values[i] = [r[f] for r in flat]
+    return np.asarray(gid_list, dtype=np.int32), np.asarray(ord_list, dtype=np.int32), values
+
+
+def rows_from_arrays(
+    spec: PeriodSpec,
+    keys: Sequence[tuple],
+    gid: np.ndarray,
+    day_ord: np.ndarray,
+    values: np.ndarray,
+    cmp: Optional[PeriodSpec] = None,
+) -> List[Dict[str, Any]]:
+    """Rows for ``keys`` from arrays laid out as by :func:`pack_records`."""
+    n_groups = len(keys)
+    if n_groups == 0:
+        return []
+    gid = gid.astype(np.int64)
+    day_ord = day_ord.astype(np.int64)
+    cols = {f: values[i] for i, f in enumerate(RECORD_FIELDS)}
+
+    cells, summaries = _aggregate(spec, gid, day_ord, cols, n_groups)
+    if cmp is not None:
+        cmp_cells, cmp_summaries = _aggregate(cmp, gid, day_ord, cols, n_groups)
+
+    rows: List[Dict[str, Any]] = []
+    for gi, key in enumerate(keys):
+        ozon_id, name_cn, category, sku, platform, account = key
+        row = {
+            "category": category or None,
+            "name_cn": name_cn or None,
+            "sku": sku or None,
+            "ozon_id": ozon_id or None,
+            "platform": platform or None,
+            "account": account or None,
+            "summary_12d": summaries[gi],
+            "days": cells[gi],
+        }
+        if cmp is not None:
+            row["compare"] = compare_block(cells[gi], cmp_cells[gi], summaries[gi], cmp_summaries[gi])
+        rows.append(row)
+    return rows
+
+
+def build_rows(
+    spec: PeriodSpec,
+    groups: Sequence[Tuple[tuple, List[Dict[str, Any]]]],
+    cmp: Optional[PeriodSpec] = None,
+) -> List[Dict[str, Any]]:
+    """Build one row per group, as a plain dict in the ``ReportRow`` shape.
+
+    Non-cumulative specs (day columns): last record per day wins and avg_price
+    is taken as-is. Cumulative specs: metrics are summed and avg_price is
+    sales_amount / total_sales_qty. The summary covers ``spec.summary_from`` on.
+    With ``cmp`` the same flattened arrays are also bucketed into the
+    comparison columns (see app.compare).
+    """
+    if not groups:
+        return []
+    # 展平为列；日期用序数，报表列与对比列各自换算偏移
+    gid, day_ord, values = pack_records(groups)
+    return rows_from_arrays(spec, [key for key, _records in groups], gid, day_ord, values, cmp)
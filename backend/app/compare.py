@@ -0,0 +1,111 @@
+"""Period-over-period comparison for /api/report (``compare=prev|yoy``).
+
+Every report column gets a comparison column of the same granularity:
+
+- ``prev``: the column one bucket earlier (previous day / ISO week / month /
+  quarter / window);
+- ``yoy``: the same column a year earlier -- calendar months and quarters,
+  364 days (52 weeks, same weekday) for day, week and window columns.
+
+Both ranges are read in one query (one date range when they touch, an
+``$or`` of two otherwise) and each product's records are bucketed into the
+report and comparison columns in the same pass. Rows gain a ``compare``
+block with the comparison cells and summary, the absolute change per metric
+and the relative change (``None`` when the comparison value is 0).
+"""
+from __future__ import annotations
+
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .periods import PeriodSpec
+from .serialize import CELL_METRICS, SUMMARY_FIELDS
+
+
+COMPARE_MODES: Tuple[str, ...] = ("prev", "yoy")
+COMPARE_PATTERN = "^(" + "|".join(COMPARE_MODES) + ")$"
+
+YOY_DAYS = 364
+# 比例类字段的差值保留 4 位小数，其余浮点 2 位
+_RATIO_FIELDS = frozenset(("ad_ratio", "ad_sales_ratio"))
+
+
+def _year_back(d: date) -> date:
+    try:
+        return d.replace(year=d.year - 1)
+    except ValueError:  # 2 月 29 日
+        return d.replace(year=d.year - 1, day=28)
+
+
+def comparison_spec(spec: PeriodSpec, compare: str) -> PeriodSpec:
+    """Columns to compare ``spec`` against, one per report column."""
+    n = len(spec)
+    last_start = spec.buckets[-1][0]
+    g = spec.granularity
+    if compare == "prev":
+        if g == "day":
+            one = timedelta(days=1)
+            return PeriodSpec.days(spec.start - one, spec.end - one, spec.summary_days or n)
+        if g == "week":
+            return PeriodSpec.weeks(last_start - timedelta(days=7), n)
+        if g == "month":
+            return PeriodSpec.months(last_start - timedelta(days=1), n)
+        if g == "quarter":
+            return PeriodSpec.quarters(last_start - timedelta(days=1), n)
+        size = (spec.buckets[-1][1] - last_start).days + 1
+        return PeriodSpec.windows(spec.end - timedelta(days=size), n, size)
+    if g == "month":
+        return PeriodSpec.months(_year_back(last_start), n)
+    if g == "quarter":
+        return PeriodSpec.quarters(_year_back(last_start), n)
+    shift = timedelta(days=YOY_DAYS)
+    if g == "day":
+        return PeriodSpec.days(spec.start - shift, spec.end - shift, spec.summary_days or n)
+    if g == "week":
+        return PeriodSpec.weeks(last_start - shift, n)
+    size = (spec.buckets[-1][1] - last_start).days + 1
+    return PeriodSpec.windows(spec.end - shift, n, size)
+
+
+def merge_ranges(ranges: Sequence[Tuple[date, date]]) -> List[Tuple[date, date]]:
+    """Sorted date ranges with overlapping or adjacent ones merged."""
+    merged: List[Tuple[date, date]] = []
+    for s, e in sorted(ranges):
+        if merged and s <= merged[-1][1] + timedelta(days=1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], e))
+        else:
+            merged.append((s, e))
+    return merged
+
+
+def _delta(field: str, cur: Any, prev: Any) -> Any:
+    d = cur - prev
+    if isinstance(d, int):
+        return d
+    return round(d, 4 if field in _RATIO_FIELDS else 2)
+
+
+def _pct(cur: Any, prev: Any) -> Optional[float]:
+    return round((cur - prev) / abs(prev), 4) if prev else None
+
+
+def compare_block(
+    cells: Sequence[Dict[str, Any]],
+    cmp_cells: List[Dict[str, Any]],
+    summary: Dict[str, Any],
+    cmp_summary: Dict[str, Any],
+) -> Dict[str, Any]:
+    """The ``compare`` entry of a row from its report and comparison cells/summaries."""
+    delta: List[Dict[str, Any]] = []
+    pct: List[Dict[str, Optional[float]]] = []
+    for cur, prev in zip(cells, cmp_cells):
+        delta.append({f: _delta(f, cur[f], prev[f]) for f in CELL_METRICS})
+        pct.append({f: _pct(cur[f], prev[f]) for f in CELL_METRICS})
+    return {
+        "days": cmp_cells,
+        "delta": delta,
+        "pct": pct,
+        "summary_12d": cmp_summary,
+        "summary_delta": {f: _delta(f, summary[f], cmp_summary[f]) for f in SUMMARY_FIELDS},
+        "summary_pct": {f: _pct(summary[f], cmp_summary[f]) for f in SUMMARY_FIELDS},
+    }
@@ -0,0 +1,101 @@
+"""Date normalization for raw documents and query parameters.
+
+Raw imports store the day as a BSON Date or as a string in a handful of
+shapes: ``YYYY-MM-DD``, ``YYYY/MM/DD``, unpadded ``YYYY/M/D`` / ``YYYY-M-D``,
+optionally followed by a ``THH:MM[:SS]`` (or space-separated) time. Strings
+are parsed by hand -- no strptime attempts and exceptions per format -- and
+memoized by raw value, since a dataset only holds a few hundred distinct days.
+
+Documents whose date is missing or unparseable are still skipped by the
+report, but they are counted in :data:`date_stats` (with recent samples) so
+bad imports show up instead of silently shrinking totals.
+"""
+from __future__ import annotations
+
+import threading
+from collections import deque
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Any, Deque, Dict, Optional
+
+
+MEMO_SIZE = 4096
+
+
+def _is_time(s: str) -> bool:
+    parts = s.split(":")
+    if not 2 <= len(parts) <= 3:
+        return False
+    sec = parts[-1].split(".", 1)[0] if len(parts) == 3 else parts[-1]
+    return all(p.isdigit() and len(p) <= 2 for p in parts[:2]) and sec.isdigit() and len(sec) <= 2
+
+
+@lru_cache(maxsize=MEMO_SIZE)
+def parse_date(value: str) -> Optional[date]:
+    """Parse one of the known date shapes; None if the value matches none of them."""
+    s = value.strip()
+    for time_sep in ("T", " "):
+        if time_sep in s:
+            s, t = s.split(time_sep, 1)
+            if not _is_time(t.strip()):
+                return None
+            break
+    sep = "-" if "-" in s else "/"
+    parts = s.split(sep)
+    if len(parts) != 3:
+        return None
+    y, m, d = parts
+    if not (len(y) == 4 and y.isdigit() and 1 <= len(m) <= 2 and m.isdigit() and 1 <= len(d) <= 2 and d.isdigit()):
+        return None
+    try:
+        return date(int(y), int(m), int(d))
+    except ValueError:  # 如 2025-02-30
+        return None
+
+
+class DateStats:
+    """Counters for document dates the report had to skip."""
+
+    def __init__(self, max_samples: int = 20) -> None:
+        self._lock = threading.Lock()
+        self.undated = 0
+        self.unparseable = 0
+        self.samples: Deque[str] = deque(maxlen=max_samples)
+
+    def record_undated(self) -> None:
+        with self._lock:
+            self.undated += 1
+
+    def record_unparseable(self, value: Any) -> None:
+        with self._lock:
+            self.unparseable += 1
+            self.samples.append(repr(value)[:80])
+
+    def snapshot(self) -> Dict[str, Any]:
+        memo = parse_date.cache_info()
+        return {
+            "undated": self.undated,
+            "unparseable": self.unparseable,
+            "samples": list(self.samples),
+            "memo_hits": memo.hits,
+            "memo_misses": memo.misses,
+            "memo_size": memo.currsize,
+        }
+
+
+date_stats = DateStats()
+
+
+def to_day(value: Any) -> Optional[date]:
+    """Calendar day of a raw date value (BSON Date, date or string); counts failures."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if value is None:
+        date_stats.record_undated()
+        return None
+    d = parse_date(value if isinstance(value, str) else str(value))
+    if d is None:
+        date_stats.record_unparseable(value)
+    return d
@@ -1,20 +1,204 @@
+import importlib.util
 import os
-from typing import Optional
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
 
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase, AsyncIOMotorCollection
+from pymongo import ReadPreference
+from pymongo.monitoring import ConnectionPoolListener
 
 
 _client: Optional[AsyncIOMotorClient] = None
 
+# 连接池/超时：环境变量 -> MongoClient 参数；未设置的保持驱动默认值
+_INT_OPTIONS: Dict[str, str] = {
+    "MONGO_MAX_POOL_SIZE": "maxPoolSize",
+    "MONGO_MIN_POOL_SIZE": "minPoolSize",
+    "MONGO_MAX_IDLE_MS": "maxIdleTimeMS",
+    "MONGO_MAX_CONNECTING": "maxConnecting",
+    "MONGO_CONNECT_TIMEOUT_MS": "connectTimeoutMS",
+    "MONGO_SOCKET_TIMEOUT_MS": "socketTimeoutMS",
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": "serverSelectionTimeoutMS",
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": "waitQueueTimeoutMS",
+}
+
+# 压缩算法 -> 所需的可选包；zlib 为标准库
+_COMPRESSOR_MODULES: Dict[str, Optional[str]] = {"zstd": "zstandard", "snappy": "snappy", "zlib": None}
+
+_READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primarypreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondarypreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
+
+class PoolStats(ConnectionPoolListener):
+    """Connection pool counters, summed over all servers, for /api/health."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.peak_checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        # 计数不能叫 pool_cleared：会遮住同名的监听方法，驱动回调时调用到 int
+        self.clears = 0
+
+    def pool_created(self, event: Any) -> None:
+        pass
+
+    def pool_ready(self, event: Any) -> None:
+        pass
+
+    def pool_cleared(self, event: Any) -> None:
+        with self._lock:
+            self.clears += 1
+
+    def pool_closed(self, event: Any) -> None:
+        pass
+
+    def connection_created(self, event: Any) -> None:
+        with self._lock:
+            self.created += 1
+
+    def connection_ready(self, event: Any) -> None:
+        pass
+
+    def connection_closed(self, event: Any) -> None:
+        with self._lock:
+            self.closed += 1
+
+    def connection_check_out_started(self, event: Any) -> None:
+        pass
+
+    def connection_check_out_failed(self, event: Any) -> None:
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event: Any) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.peak_checked_out = max(self.peak_checked_out, self.checked_out)
+
+    def connection_checked_in(self, event: Any) -> None:
+        with self._lock:
+            self.checked_out -= 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "open": self.created - self.closed,
+                "in_use": self.checked_out,
+                "peak_in_use": self.peak_checked_out,
+                "created": self.created,
+                "closed": self.closed,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "clears": self.clears,
+            }
+
+
+pool_stats = PoolStats()
+
+
+def available_compressors() -> list[str]:
+    return [
+        name
+        for name, module in _COMPRESSOR_MODULES.items()
+        if module is None or importlib.util.find_spec(module) is not None
+    ]
+
+
+def _compressors() -> list[str]:
+    """MONGO_COMPRESSORS（逗号分隔，none 关闭）；默认使用已安装的 zstd/snappy。"""
+    raw = os.getenv("MONGO_COMPRESSORS")
+    available = available_compressors()
+    if raw is None:
+        return [c for c in ("zstd", "snappy") if c in available]
+    wanted = [c.strip().lower() for c in raw.split(",") if c.strip()]
+    return [c for c in wanted if c in available]
+
+
+def client_options() -> Dict[str, Any]:
+    opts: Dict[str, Any] = {"event_listeners": [pool_stats], "appname": os.getenv("MONGO_APPNAME", "ozon-report")}
+    for env_name, option in _INT_OPTIONS.items():
+        value = os.getenv(env_name)
+        if value:
+            opts[option] = int(value)
+    compressors = _compressors()
+    if compressors:
+        opts["compressors"] = ",".join(compressors)
+    return opts
+
 
 def get_mongo_client() -> AsyncIOMotorClient:
     global _client
     if _client is None:
         uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
-        _client = AsyncIOMotorClient(uri)
+        _client = AsyncIOMotorClient(uri, **client_options())
     return _client
 
 
+async def warm_up() -> Dict[str, Any]:
+    """启动时建立连接并完成握手，避免部署后的首个请求承担连接开销。"""
+    client = get_mongo_client()
+    await client.admin.command("ping")
+    return {"ping": "ok", "pool": pool_stats.snapshot()}
+
+
+def close_client() -> None:
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+
+
+def warm_up_on_startup() -> bool:
+    return os.getenv("MONGO_WARMUP", "1") == "1"
+
+
+def report_read_preference() -> Any:
+    """报表查询的读偏好（MONGO_REPORT_READ_PREFERENCE，默认 secondaryPreferred）。"""
+    name = os.getenv("MONGO_REPORT_READ_PREFERENCE", "secondaryPreferred").strip().lower()
+    return _READ_PREFERENCES.get(name, ReadPreference.SECONDARY_PREFERRED)
+
+
+# 写入后的缓存回填与预热：从节点可能还没复制到刚写入的数据，缓存旧结果会持续整个 TTL
+_primary_reads: ContextVar[bool] = ContextVar("primary_reads", default=False)
+
+
+def primary_after_write() -> float:
+    """写入失效后多少秒内的缓存回填读主节点（MONGO_PRIMARY_AFTER_WRITE，默认 60）。"""
+    return max(0.0, float(os.getenv("MONGO_PRIMARY_AFTER_WRITE", "60")))
+
+
+@contextmanager
+def primary_reads(enabled: bool = True) -> Iterator[None]:
+    """在当前上下文（任务）内让 for_reports 读主节点。"""
+    token = _primary_reads.set(enabled or _primary_reads.get())
+    try:
+        yield
+    finally:
+        _primary_reads.reset(token)
+
+
+def for_reports(coll: AsyncIOMotorCollection) -> AsyncIOMotorCollection:
+    """只读报表查询使用的集合句柄：按报表读偏好路由（写入与刷新仍读主节点）。"""
+    if _primary_reads.get():
+        return coll.with_options(read_preference=ReadPreference.PRIMARY)
+    return coll.with_options(read_preference=report_read_preference())
+
+
 def get_db(db_name: str | None = None) -> AsyncIOMotorDatabase:
     if db_name is None:
         db_name = os.getenv("MONGODB_DB", "ozondatas")
@@ -29,3 +213,25 @@ def get_collection(
     if collection_name is None:
         collection_name = os.getenv("MONGODB_COLL", os.getenv("MONGODB_COLLECTION", "operation_report"))
     return get_db(db_name)[collection_name]
+
+
+def get_daily_collection(db_name: str | None = None) -> AsyncIOMotorCollection:
+    """规范化后的日数据集合（见 app.normalize）。"""
+    return get_collection(db_name, os.getenv("MONGODB_DAILY_COLL", "operation_report_daily"))
+
+
+def get_report_source() -> str:
+    """报表数据源：raw = 原始 operation_report；daily = 规范化日数据集合。"""
+    source = os.getenv("REPORT_SOURCE", "raw").strip().lower()
+    return source if source in ("raw", "daily") else "raw"
+
+
+def get_rollup_collection(granularity: str, db_name: str | None = None) -> AsyncIOMotorCollection:
+    """预聚合集合：granularity = week（ISO 周）| month（自然月），见 app.rollups。"""
+    env_name = {"week": "MONGODB_WEEKLY_COLL", "month": "MONGODB_MONTHLY_COLL"}[granularity]
+    return get_collection(db_name, os.getenv(env_name, f"operation_report_{granularity}ly"))
+
+
+def rollups_enabled() -> bool:
+    """周/月模式是否读取预聚合集合（仅在 REPORT_SOURCE=daily 时生效）。"""
+    return get_report_source() == "daily" and os.getenv("REPORT_ROLLUPS", "0") == "1"
@@ -0,0 +1,244 @@
+"""Bulk import of spreadsheet exports (CSV / XLSX) into the report collections.
+
+Rows are read lazily from the file (header row = raw column names, as in
+operation_report), normalized with :func:`app.normalize.normalize_doc` and
+written in batches:
+
+- the canonical record is upserted into the daily collection keyed on
+  (product key, day) -- only when it is new or its metrics changed, which one
+  indexed read per batch decides;
+- the raw row is upserted into operation_report keyed on ``import_key`` (the
+  same product key and day), so raw-source reports see the import too.
+
+Re-importing a file therefore writes nothing and reports no changed ranges.
+``POST /api/ingest`` (a JSON array of raw documents) goes through the same
+:func:`import_rows`.
+The result carries counts, throughput and the changed (platform, account)
+day ranges, which the API uses to invalidate the report cache, refresh
+rollups and schedule pre-warming. Raw documents written before this path
+existed (or directly to Mongo) carry no ``import_key`` and are not deduplicated against imports; the daily source
+(``REPORT_SOURCE=daily``) is the idempotent view.
+
+    python -m app.importer FILE.csv|FILE.xlsx [--format csv|xlsx] [--batch 1000] [--no-raw]
+
+XLSX needs the optional ``openpyxl`` package.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import codecs
+import csv
+import io
+import json
+import time
+from datetime import datetime
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from pymongo import ReplaceOne
+
+from .db import get_collection, get_daily_collection
+from .normalize import DAILY_PROJECTION, changed_ranges, normalize_doc, upsert_records
+from .schema import KEY_FIELDS, METRIC_FIELDS, RAW_DATE_FIELDS
+
+
+class ImportAborted(ValueError):
+    """A malformed file stopped the import; ``result`` covers the batches already written."""
+
+    def __init__(self, message: str, result: Dict[str, Any]) -> None:
+        super().__init__(message)
+        self.result = result
+
+
+IMPORT_FORMATS: Tuple[str, ...] = ("csv", "xlsx")
+IMPORT_FORMAT_PATTERN = "^(" + "|".join(IMPORT_FORMATS) + ")$"
+
+
+def detect_format(filename: str = "", content_type: str = "") -> str:
+    """csv | xlsx from a file name or content type (default csv)."""
+    name = filename.lower()
+    if name.endswith((".xlsx", ".xlsm")) or "spreadsheetml" in content_type:
+        return "xlsx"
+    return "csv"
+
+
+def _header(row: Iterable[Any]) -> List[str]:
+    return ["" if h is None else str(h).strip() for h in row]
+
+
+def iter_csv(fp: IO[bytes], encoding: str = "utf-8-sig") -> Iterator[Dict[str, Any]]:
+    """Rows of a CSV file as raw documents; every row keeps all header columns (blank = missing)."""
+    text = io.TextIOWrapper(fp, encoding=encoding, newline="")
+    try:
+        reader = csv.reader(text)
+        header: Optional[List[str]] = None
+        for row in reader:
+            if not any(cell.strip() for cell in row):
+                continue
+            if header is None:
+                header = _header(row)
+                continue
+            yield {h: v.strip() for h, v in zip(header, row) if h}
+    except csv.Error as exc:
+        raise ValueError(f"malformed CSV: {exc}") from exc
+    finally:
+        text.detach()
+
+
+def iter_xlsx(fp: IO[bytes], sheet: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Rows of an XLSX sheet (default: the active one), read in streaming mode."""
+    try:
+        from openpyxl import load_workbook  # 可选依赖
+    except ImportError as exc:  # pragma: no cover - 取决于部署环境
+        raise RuntimeError("XLSX import requires the 'openpyxl' package") from exc
+    try:
+        wb = load_workbook(fp, read_only=True, data_only=True)
+    except Exception as exc:  # noqa: BLE001 - zip/xml 错误统一报为格式错误
+        raise ValueError(f"not a readable XLSX file: {exc}") from exc
+    try:
+        if sheet is not None and sheet not in wb.sheetnames:
+            raise ValueError(f"sheet not found: {sheet!r}")
+        ws = wb[sheet] if sheet is not None else wb.active
+        header: Optional[List[str]] = None
+        for row in ws.iter_rows(values_only=True):
+            if all(v is None or (isinstance(v, str) and not v.strip()) for v in row):
+                continue
+            if header is None:
+                header = _header(row)
+                continue
+            yield {h: (v.strip() if isinstance(v, str) else v) for h, v in zip(header, row) if h}
+    finally:
+        wb.close()
+
+
+def open_rows(fp: IO[bytes], fmt: str, encoding: str = "utf-8-sig", sheet: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    if fmt == "xlsx":
+        return iter_xlsx(fp, sheet)
+    if fmt == "csv":
+        try:
+            codecs.lookup(encoding)
+        except LookupError as exc:
+            raise ValueError(f"unknown encoding: {encoding}") from exc
+        return iter_csv(fp, encoding)
+    raise ValueError(f"format must be one of {', '.join(IMPORT_FORMATS)}")
+
+
+def import_key(rec: Dict[str, Any]) -> str:
+    """Raw-document upsert key: the canonical product key and day."""
+    return json.dumps([rec[k] for k in KEY_FIELDS] + [rec["day"].date().isoformat()], ensure_ascii=False, separators=(",", ":"))
+
+
+def _record_key(rec: Dict[str, Any]) -> tuple:
+    return tuple(rec[k] for k in KEY_FIELDS) + (rec["day"],)
+
+
+async def _existing(records: List[Dict[str, Any]]) -> Dict[tuple, Dict[str, Any]]:
+    """Stored daily records for the batch: one range read per (platform, account) on the unique index."""
+    spans: Dict[Tuple[str, str], Tuple[datetime, datetime, Set[str]]] = {}
+    for rec in records:
+        k = (rec["platform"], rec["account"])
+        lo, hi, ids = spans.get(k, (rec["day"], rec["day"], set()))
+        ids.add(rec["ozon_id"])
+        spans[k] = (min(lo, rec["day"]), max(hi, rec["day"]), ids)
+    coll = get_daily_collection()
+    found: Dict[tuple, Dict[str, Any]] = {}
+    for (platform, account), (lo, hi, ids) in spans.items():
+        flt = {"platform": platform, "account": account, "day": {"$gte": lo, "$lte": hi}, "ozon_id": {"$in": sorted(ids)}}
+        async for doc in coll.find(flt, DAILY_PROJECTION):
+            found[_record_key(doc)] = doc
+    return found
+
+
+async def _write_batch(batch: List[Tuple[Dict[str, Any], Dict[str, Any]]], raw: bool, stats: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Upsert the new/changed records of one batch; returns them."""
+    # 同一批内同一商品同一天以最后一行为准
+    latest: Dict[tuple, Tuple[Dict[str, Any], Dict[str, Any]]] = {}
+    for doc, rec in batch:
+        latest[_record_key(rec)] = (doc, rec)
+    existing = await _existing([rec for _doc, rec in latest.values()])
+    changed: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+    for key, (doc, rec) in latest.items():
+        old = existing.get(key)
+        if old is None:
+            stats["inserted"] += 1
+        elif any(old.get(f) != rec[f] for f in METRIC_FIELDS):
+            stats["updated"] += 1
+        else:
+            stats["unchanged"] += 1
+            continue
+        changed.append((doc, rec))
+    if not changed:
+        return []
+    records = [rec for _doc, rec in changed]
+    await upsert_records(records, len(records))
+    if raw:
+        ops = []
+        for doc, rec in changed:
+            k = import_key(rec)
+            # 日期列存为 Date 类型：表格里的“2025-03-01 00:00:00”等写法原始过滤匹配不到
+            dates = {f: rec["day"] for f in RAW_DATE_FIELDS if f in doc}
+            body = {f: v for f, v in doc.items() if f != "_id"}  # _id 不可改，覆盖写入时由已有文档保留
+            ops.append(ReplaceOne({"import_key": k}, {**body, **dates, "import_key": k}, upsert=True))
+        await get_collection().bulk_write(ops, ordered=False)
+    return records
+
+
+async def import_rows(rows: Iterable[Dict[str, Any]], batch_size: int = 1000, raw: bool = True) -> Dict[str, Any]:
+    """Normalize and upsert raw rows in batches; counts, throughput and changed day ranges."""
+    started = time.perf_counter()
+    stats: Dict[str, Any] = {"rows": 0, "skipped": 0, "inserted": 0, "updated": 0, "unchanged": 0, "batches": 0}
+    # 只保留变更记录的 (平台, 账号, 日)，用于计算变更范围
+    touched: Set[Tuple[str, str, datetime]] = set()
+    batch: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+
+    async def flush() -> None:
+        for rec in await _write_batch(batch, raw, stats):
+            touched.add((rec["platform"], rec["account"], rec["day"]))
+        stats["batches"] += 1
+        batch.clear()
+
+    def finish() -> Dict[str, Any]:
+        elapsed = time.perf_counter() - started
+        stats["elapsed_s"] = round(elapsed, 3)
+        stats["rows_per_sec"] = round(stats["rows"] / elapsed, 1) if elapsed > 0 else 0.0
+        stats["ranges"] = changed_ranges({"platform": p, "account": a, "day": d} for p, a, d in touched)
+        return stats
+
+    try:
+        for doc in rows:
+            stats["rows"] += 1
+            rec = normalize_doc(doc)
+            if rec is None:
+                stats["skipped"] += 1
+                continue
+            batch.append((doc, rec))
+            if len(batch) >= batch_size:
+                await flush()
+        if batch:
+            await flush()
+    except ValueError as exc:
+        # 出错前已写入的批次保留，带上它们的变更范围，调用方据此刷新预聚合与缓存
+        raise ImportAborted(str(exc), finish()) from exc
+    return finish()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.importer")
+    parser.add_argument("file", help="CSV 或 XLSX 导出文件")
+    parser.add_argument("--format", choices=IMPORT_FORMATS, help="默认按扩展名判断")
+    parser.add_argument("--encoding", default="utf-8-sig", help="CSV 编码（如 gbk）")
+    parser.add_argument("--sheet", default=None, help="XLSX 工作表名，默认当前活动表")
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--no-raw", action="store_true", help="只写规范化日数据集合，不写原始集合")
+    args = parser.parse_args(argv)
+
+    async def _run() -> Dict[str, Any]:
+        with open(args.file, "rb") as fp:
+            rows = open_rows(fp, args.format or detect_format(args.file), args.encoding, args.sheet)
+            return await import_rows(rows, args.batch, raw=not args.no_raw)
+
+    print(json.dumps(asyncio.run(_run()), ensure_ascii=False, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Index management and query-plan checks for the report collections.
+
+The daily collection stores ``platform``/``account`` already trimmed and
+lowercased (see app.normalize), so plain simple-collation indexes give the
+case-insensitive matching the raw collection needs regexes for, and report
+queries can use them without passing a collation.
+
+    python -m app.indexes              # ensure indexes, then explain the report filter
+    python -m app.indexes --check-only --strict
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import os
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo import ASCENDING, IndexModel
+
+from .db import get_collection, get_daily_collection, get_report_source, get_rollup_collection
+from .normalize import daily_filter, raw_filter
+
+
+logger = logging.getLogger(__name__)
+
+
+DAILY_INDEXES: List[IndexModel] = [
+    # 报表主查询：平台/账号等值 + day 范围；同时作为 upsert 的唯一键
+    IndexModel(
+        [
+            ("platform", ASCENDING),
+            ("account", ASCENDING),
+            ("day", ASCENDING),
+            ("ozon_id", ASCENDING),
+            ("name_cn", ASCENDING),
+            ("category", ASCENDING),
+            ("sku", ASCENDING),
+        ],
+        name="platform_account_day_key",
+        unique=True,
+    ),
+    # 导出按商品键顺序流式读取：等值 + 排序 + 范围
+    IndexModel(
+        [
+            ("platform", ASCENDING),
+            ("account", ASCENDING),
+            ("ozon_id", ASCENDING),
+            ("name_cn", ASCENDING),
+            ("category", ASCENDING),
+            ("sku", ASCENDING),
+            ("day", ASCENDING),
+        ],
+        name="platform_account_key_day",
+    ),
+    # 不带平台/账号过滤时的日期范围查询
+    IndexModel([("day", ASCENDING)], name="day"),
+    # 预聚合增量刷新按 updated_at 水位线扫描
+    IndexModel([("updated_at", ASCENDING)], name="updated_at"),
+]
+
+# 周/月预聚合集合：与日数据同形，day 为桶起始日
+ROLLUP_INDEXES: List[IndexModel] = DAILY_INDEXES[:3]
+
+# 原始集合：日期的三种字段名各建稀疏索引，使 $or 的每个分支都能走索引
+RAW_INDEXES: List[IndexModel] = [
+    IndexModel([(f, ASCENDING)], name=f"{f}_1", sparse=True) for f in ("日期", "date", "Date")
+] + [
+    # 批量导入的原始行按 (商品键, 日) 覆盖写入，重复导入不产生重复文档
+    IndexModel([("import_key", ASCENDING)], name="import_key", unique=True, sparse=True),
+]
+
+
+class QueryPlanError(RuntimeError):
+    """Raised in strict mode when the report filter is served by a collection scan."""
+
+
+def _plan_stages(plan: Any) -> List[str]:
+    stages: List[str] = []
+    if isinstance(plan, dict):
+        stage = plan.get("stage")
+        if isinstance(stage, str):
+            stages.append(stage)
+        for v in plan.values():
+            stages.extend(_plan_stages(v))
+    elif isinstance(plan, list):
+        for v in plan:
+            stages.extend(_plan_stages(v))
+    return stages
+
+
+async def ensure_indexes() -> Dict[str, List[str]]:
+    daily = await get_daily_collection().create_indexes(DAILY_INDEXES)
+    raw = await get_collection().create_indexes(RAW_INDEXES)
+    result = {"daily": daily, "raw": raw}
+    for g in ("week", "month"):
+        result[g] = await get_rollup_collection(g).create_indexes(ROLLUP_INDEXES)
+    return result
+
+
+async def verify_report_plan(
+    strict: bool = False,
+    platform: Optional[str] = "ozon",
+    account: Optional[str] = None,
+) -> List[str]:
+    """Explain the canonical report filter and flag a COLLSCAN winning plan."""
+    end_d = date.today()
+    start_d = end_d - timedelta(days=30)
+    if get_report_source() == "daily":
+        coll, flt = get_daily_collection(), daily_filter(start_d, end_d, platform, account)
+    else:
+        coll, flt = get_collection(), raw_filter(start_d, end_d, platform, account)
+    explain = await coll.find(flt).explain()
+    winning = (explain.get("queryPlanner") or {}).get("winningPlan") or {}
+    stages = _plan_stages(winning)
+    if "COLLSCAN" in stages:
+        msg = f"report filter on {coll.name} uses COLLSCAN (stages={stages}, filter={flt})"
+        if strict:
+            raise QueryPlanError(msg)
+        logger.warning(msg)
+    else:
+        logger.info("report filter on %s plan stages: %s", coll.name, stages)
+    return stages
+
+
+def plan_strict() -> bool:
+    return os.getenv("MONGO_PLAN_STRICT", "0") == "1"
+
+
+def ensure_on_startup() -> bool:
+    return os.getenv("MONGO_ENSURE_INDEXES", "1") == "1"
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.indexes")
+    parser.add_argument("--check-only", action="store_true", help="只检查查询计划，不创建索引")
+    parser.add_argument("--strict", action="store_true", help="命中 COLLSCAN 时以非零状态退出")
+    parser.add_argument("--platform", default="ozon")
+    parser.add_argument("--account", default=None)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    async def _run() -> None:
+        if not args.check_only:
+            print(await ensure_indexes())
+        print(await verify_report_plan(args.strict or plan_strict(), args.platform, args.account))
+
+    asyncio.run(_run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Inventory cover and stock-out projection from the daily series.
+
+For every product of a query -- typically a whole account in one call --
+over the ``window`` days ending at ``as_of``:
+
+- ``inventory``: stock on the latest day with a record (``inventory_date``),
+- ``sold`` / ``velocity``: units sold in the window and per day,
+- ``days_of_cover``: inventory / velocity (``None`` when nothing sold; 0 when
+  out of stock),
+- ``sell_through``: sold / (sold + inventory),
+- ``stockout_date``: ``inventory_date`` + whole days of cover.
+
+All products are computed together on the arrays of
+:func:`app.columnar.pack_records`; several records of one product on one day
+count once (the last one, as in the day report). A product is at risk when
+it sold in the window and its cover is below ``cover_days``; rows are
+ordered by urgency -- projected stock-out date, then velocity descending.
+"""
+from __future__ import annotations
+
+from datetime import date, timedelta
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from .columnar import RECORD_FIELDS, latest_records, pack_records
+
+
+_QTY = RECORD_FIELDS.index("total_sales_qty")
+_INV = RECORD_FIELDS.index("inventory")
+_MAX_ORDINAL = date.max.toordinal()
+
+
+def inventory_rows(
+    groups: Sequence[Tuple[tuple, List[Dict[str, Any]]]],
+    as_of: date,
+    window: int,
+    cover_days: float,
+    include_all: bool = False,
+) -> Tuple[int, List[Dict[str, Any]]]:
+    """(products with records, rows ordered by urgency); only at-risk rows unless ``include_all``."""
+    n = len(groups)
+    if n == 0:
+        return 0, []
+    gid, day_ord, values = pack_records(groups)
+    gid = gid.astype(np.int64)
+    day_ord = day_ord.astype(np.int64)
+    end_ord = as_of.toordinal()
+    keep = day_ord <= end_ord
+    gid, day_ord, values = gid[keep], day_ord[keep], values[:, keep]
+
+    # 同一商品同一天多条只算最后一条（与日报表一致）
+    daily = latest_records(gid * (end_ord + 1) + day_ord, day_ord)
+    gid, day_ord = gid[daily], day_ord[daily]
+    qty, inv = values[_QTY][daily], values[_INV][daily]
+
+    in_window = day_ord > end_ord - window
+    sold = np.bincount(gid[in_window], weights=qty[in_window], minlength=n)
+
+    latest = latest_records(gid, day_ord)
+    has = np.zeros(n, dtype=bool)
+    has[gid[latest]] = True
+    inventory = np.zeros(n)
+    inventory[gid[latest]] = inv[latest]
+    inv_day = np.zeros(n, dtype=np.int64)
+    inv_day[gid[latest]] = day_ord[latest]
+
+    velocity = sold / window
+    cover = np.full(n, np.inf)
+    np.divide(inventory, velocity, out=cover, where=velocity > 0)
+    cover[inventory <= 0] = 0.0
+    stockout = np.full(n, np.inf)
+    finite = np.isfinite(cover)
+    stockout[finite] = inv_day[finite] + np.floor(cover[finite])
+    sell_through = np.zeros(n)
+    np.divide(sold, sold + inventory, out=sell_through, where=(sold + inventory) > 0)
+    at_risk = has & (sold > 0) & (cover < cover_days)
+
+    selected = has if include_all else at_risk
+    # lexsort 以最后一个键为主键：先按预计断货日，再按日销量降序；同分保持商品键顺序
+    order = np.lexsort((-velocity, stockout))
+    order = order[selected[order]]
+
+    rows: List[Dict[str, Any]] = []
+    for gi in order.tolist():
+        ozon_id, name_cn, category, sku, platform, account = groups[gi][0]
+        c = float(cover[gi])
+        so = float(stockout[gi])
+        rows.append(
+            {
+                "category": category or None,
+                "name_cn": name_cn or None,
+                "sku": sku or None,
+                "ozon_id": ozon_id or None,
+                "platform": platform or None,
+                "account": account or None,
+                "inventory": int(inventory[gi]),
+                "inventory_date": date.fromordinal(int(inv_day[gi])),
+                "sold": int(sold[gi]),
+                "velocity": round(float(velocity[gi]), 4),
+                "days_of_cover": round(c, 1) if np.isfinite(c) else None,
+                "sell_through": round(float(sell_through[gi]), 4),
+                "stockout_date": date.fromordinal(int(so)) if so <= _MAX_ORDINAL else None,
+                "at_risk": bool(at_risk[gi]),
+            }
+        )
+    return int(has.sum()), rows
+
+
+def window_start(as_of: date, window: int) -> date:
+    return as_of - timedelta(days=window - 1)
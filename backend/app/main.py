@@ -1,19 +1,132 @@
 from __future__ import annotations
 
-from collections import defaultdict
+import asyncio
+import csv
+import io
+import logging
+import os
+import tempfile
+import time
+from contextlib import asynccontextmanager
 from datetime import date, datetime, timedelta
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, AsyncIterator, ContextManager, Dict, List, Optional, Sequence, Tuple
 
-from fastapi import FastAPI, Query
-import re
+from fastapi import Body, Depends, FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-
-from .db import get_collection
-from .models import DayMetrics, ReportResponse, ReportRow, Summary12D
-from .utils import date_range, month_start, parse_any_date, build_weeks, build_months
-
-
-app = FastAPI(title="Ozon Operation Report API")
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.errors import PyMongoError
+
+from . import columnar
+from .cache import report_cache, report_flights
+from .compare import COMPARE_PATTERN, compare_block, comparison_spec, merge_ranges
+from .dates import date_stats
+from .db import (
+    close_client,
+    for_reports,
+    get_collection,
+    get_daily_collection,
+    get_report_source,
+    get_rollup_collection,
+    pool_stats,
+    primary_after_write,
+    primary_reads,
+    rollups_enabled,
+    warm_up,
+    warm_up_on_startup,
+)
+from .metrics import (
+    Profile,
+    count,
+    log_request,
+    observe_request,
+    profiling_enabled,
+    render as render_metrics,
+    setup_request_log,
+    stage,
+    start_request,
+)
+from .importer import IMPORT_FORMAT_PATTERN, ImportAborted, detect_format, import_rows, open_rows
+from .indexes import ensure_indexes, ensure_on_startup, plan_strict, verify_report_plan
+from .inventory import inventory_rows, window_start
+from .models import BatchReportRequest, InventoryResponse, ReportResponse
+from .offload import (
+    build_rows_in_processes,
+    offload_mode,
+    run_in_thread,
+    should_offload,
+    shutdown as shutdown_offload,
+    start as start_offload,
+)
+from .normalize import (
+    DAILY_PROJECTION,
+    RAW_PROJECTION,
+    daily_filter,
+    date_strings,
+    norm_label,
+    normalize_doc,
+    product_filter,
+    raw_filter,
+)
+from .periods import PeriodSpec, build_spec
+from .prewarm import EACH_ACCOUNT, PrewarmScheduler, Target, prewarm_delay, prewarm_interval, prewarm_targets
+from .pipeline import (
+    DAILY_KEY_FIELDS,
+    RAW_KEY_FIELDS,
+    doc_group_key,
+    group_key,
+    cursor_scope,
+    decode_cursor,
+    encode_cursor,
+    group_count_pipeline,
+    grouped_after_pipeline,
+    grouped_page_pipeline,
+    grouped_pipeline,
+    key_filter,
+    key_sort,
+    keyed_stream_pipeline,
+    keyset_filter,
+)
+from .ranking import SORT_PATTERN, select_rows
+from .rolling import rolling_summaries, summary_from_sums
+from .rollups import refresh_rollups
+from .serialize import CELL_METRICS, ROW_ID_FIELDS, SUMMARY_FIELDS, FastJSONResponse, columnar_rows, dumps, slim_rows
+from .utils import parse_any_date
+
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    # 启动时预热连接池、确保索引并检查报表查询计划；Mongo 不可用时只记录告警，不阻止服务启动
+    if warm_up_on_startup():
+        try:
+            logger.info("mongo warm-up: %s", await warm_up())
+        except PyMongoError as exc:
+            logger.warning("mongo warm-up failed: %s", exc)
+    if ensure_on_startup():
+        try:
+            await ensure_indexes()
+            await verify_report_plan(strict=plan_strict())
+        except PyMongoError as exc:
+            logger.warning("index setup skipped: %s", exc)
+    # REPORT_OFFLOAD=process 时先拉起进程池，首个大报表不必等待子进程 spawn
+    await start_offload()
+    # 后台预热默认报表（需启用报表缓存）
+    if report_cache.enabled:
+        prewarm.start()
+    elif prewarm.targets:
+        logger.warning("REPORT_PREWARM_TARGETS ignored: report cache is disabled")
+    yield
+    await prewarm.stop()
+    shutdown_offload()
+    # 优雅关闭：归还并关闭池内连接
+    close_client()
+
+
+app = FastAPI(title="Ozon Operation Report API", lifespan=lifespan)
 
 # 允许本地前端访问
 app.add_middleware(
@@ -22,202 +135,660 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Profile"],
 )
 
+setup_request_log()
 
-def _safe_float(v: Any) -> float:
-    try:
-        if v is None:
-            return 0.0
-        if isinstance(v, (int, float)):
-            return float(v)
-        return float(str(v).replace(",", ""))
-    except Exception:  # noqa: BLE001
-        return 0.0
 
-
-def _safe_int(v: Any) -> int:
+@app.middleware("http")
+async def request_metrics(request: Request, call_next: Any) -> Response:
+    # 每个 /api 请求：分阶段计时 -> Server-Timing 头、结构化日志与 /api/metrics 直方图
+    if not request.url.path.startswith("/api/") or request.url.path == "/api/metrics":
+        return await call_next(request)
+    timer = start_request()
+    profile = Profile() if profiling_enabled() and request.query_params.get("profile") == "1" else None
+    if profile is not None:
+        profile.start()
     try:
-        if v is None:
-            return 0
-        if isinstance(v, (int,)):
-            return int(v)
-        return int(float(str(v).replace(",", "")))
-    except Exception:  # noqa: BLE001
-        return 0
+        response = await call_next(request)
+    finally:
+        if profile is not None:
+            profile.stop()
+    total = timer.elapsed()
+    route = getattr(request.scope.get("route"), "path", "other")
+    response.headers["Server-Timing"] = timer.server_timing(total)
+    observe_request(route, response.status_code, timer, total)
+    log_request(request.method, route, response.status_code, timer, total)
+    if profile is not None:
+        path = profile.save(route, total)
+        if path:
+            response.headers["X-Profile"] = path
+    return response
 
 
 def _calc_profit(sales_amount: float, goods_cost: float, sales_cost: float, ad_spend: float) -> float:
     return round(sales_amount - goods_cost - sales_cost - ad_spend, 2)
 
 
+# 报表粒度 -> 可直接读取的预聚合集合
+_ROLLUP_FOR: Dict[str, str] = {"week": "week", "month": "month", "quarter": "month"}
+
+
+def _source_query(
+    start_d: date,
+    end_d: date,
+    platform: Optional[str],
+    account: Optional[str],
+    granularity: str = "day",
+    category: Optional[str] = None,
+    q: Optional[str] = None,
+    compare_range: Optional[Tuple[date, date]] = None,
+) -> Tuple[AsyncIOMotorCollection, Dict[str, Any]]:
+    daily = get_report_source() == "daily"
+    if daily:
+        # 周/月（季度由月汇总）模式直接读预聚合集合：day 为桶起始日，每个商品每个桶一条
+        rollup = _ROLLUP_FOR.get(granularity)
+        coll = get_rollup_collection(rollup) if rollup and rollups_enabled() else get_daily_collection()
+        date_filter = daily_filter
+    else:
+        coll, date_filter = get_collection(), raw_filter
+    # 对比模式：两段日期相接时合并为一段，否则 $or 两段，仍是一次查询
+    ranges = merge_ranges([(start_d, end_d)] + ([compare_range] if compare_range else []))
+    flts = [date_filter(s, e, platform, account) for s, e in ranges]
+    flt = flts[0] if len(flts) == 1 else {"$or": flts}
+    # 类别/关键字过滤放进 $match，分组前就排除不相关商品
+    narrow = product_filter(category, q, daily)
+    if narrow:
+        flt = {"$and": [flt, narrow]}
+    return for_reports(coll), flt
+
+
+def _projection() -> Dict[str, int]:
+    # 只取报表用到的字段（原始集合为各别名列）
+    return DAILY_PROJECTION if get_report_source() == "daily" else RAW_PROJECTION
+
+
 async def _fetch_docs(
     start_d: date,
     end_d: date,
     platform: Optional[str],
     account: Optional[str],
 ) -> List[Dict[str, Any]]:
-    coll = get_collection()
-    # 组合为 AND，内部有 OR 子条件
-    and_filters: List[Dict[str, Any]] = []
-    # 日期字段兼容：同时支持 Date 类型范围过滤与字符串精确匹配
-    def _fmt_v(d: date) -> List[str]:
-        y = d.year
-        m = d.month
-        dd = d.day
-        return [
-            f"{y}/{m}/{dd}",
-            f"{y}/{m:02d}/{dd:02d}",
-            f"{y}-{m:02d}-{dd:02d}",
-            f"{y}-{m}-{dd}",
-        ]
-
-    str_dates: List[str] = []
-    cur = start_d
-    while cur <= end_d:
-        str_dates.extend(_fmt_v(cur))
-        cur = cur + timedelta(days=1)
-    str_dates = list(sorted(set(str_dates)))
-
-    # Date 类型范围：包含 end_d 当天，采用 [start, end+1) 的半开区间更稳妥
-    start_dt = datetime.combine(start_d, datetime.min.time())
-    end_dt_next = datetime.combine(end_d, datetime.min.time()) + timedelta(days=1)
-
-    date_fields = ["日期", "date", "Date"]
-    date_or: List[Dict[str, Any]] = []
-    for f in date_fields:
-        date_or.append({f: {"$gte": start_dt, "$lt": end_dt_next}})
-        date_or.append({f: {"$in": str_dates}})
-    if date_or:
-        and_filters.append({"$or": date_or})
-
-    if platform:
-        plat_regex = re.compile(rf"^\s*{re.escape(platform)}\s*$", re.IGNORECASE)
-        and_filters.append({"$or": [{"平台": plat_regex}, {"platform": plat_regex}]})
-    if account:
-        acc_regex = re.compile(rf"^\s*{re.escape(account)}\s*$", re.IGNORECASE)
-        and_filters.append({"$or": [{"账号": acc_regex}, {"account": acc_regex}]})
-
-    final_filter: Dict[str, Any] = {"$and": and_filters} if and_filters else {}
-    cursor = coll.find(final_filter)
+    coll, flt = _source_query(start_d, end_d, platform, account)
+    cursor = coll.find(flt, _projection())
     return [doc async for doc in cursor]
 
 
-def _doc_date(doc: Dict[str, Any]) -> Optional[date]:
-    d = doc.get("日期")
-    if not d:
-        return None
-    try:
-        if isinstance(d, datetime):
-            return d.date()
-        return parse_any_date(str(d))
-    except Exception:  # noqa: BLE001
-        return None
-
-
-def _row_key(doc: Dict[str, Any]) -> Tuple[str, str, str, str, str, str]:
-    return (
-        str(doc.get("Ozon ID", "")),
-        str(doc.get("中文名称", "")),
-        str(doc.get("类别", "")),
-        str(doc.get("SKU", "")),
-        str(doc.get("平台", "")),
-        str(doc.get("账号", "")),
+async def _fetch_groups(
+    start_d: date,
+    end_d: date,
+    platform: Optional[str],
+    account: Optional[str],
+    page: int = 1,
+    page_size: Optional[int] = None,
+    granularity: str = "day",
+    category: Optional[str] = None,
+    q: Optional[str] = None,
+    compare_range: Optional[Tuple[date, date]] = None,
+) -> Tuple[int, List[Tuple[tuple, List[Dict[str, Any]]]]]:
+    """在 Mongo 端按商品分组并分页，只把当前页的商品记录传回来（规范化后）。
+
+    page_size 为 None 时返回全部分组（供缓存整份结果）。compare_range 为对比列的日期范围。
+    """
+    coll, match = _source_query(start_d, end_d, platform, account, granularity, category, q, compare_range)
+    daily = get_report_source() == "daily"
+    key_fields = DAILY_KEY_FIELDS if daily else RAW_KEY_FIELDS
+    raw_groups: List[Dict[str, Any]] = []
+    total = 0
+    with stage("fetch"):
+        if page_size is None:
+            async for g in coll.aggregate(grouped_pipeline(match, key_fields, _projection()), allowDiskUse=True):
+                raw_groups.append(g)
+            total = len(raw_groups)
+        else:
+            pipeline = grouped_page_pipeline(match, page, page_size, key_fields, _projection())
+            async for doc in coll.aggregate(pipeline, allowDiskUse=True):
+                total_part = doc.get("total") or []
+                total = int(total_part[0]["n"]) if total_part else 0
+                raw_groups = doc.get("rows") or []
+    return total, await _group_records(raw_groups, key_fields, daily)
+
+
+def _normalize_groups(
+    raw_groups: List[Dict[str, Any]],
+    key_fields: Sequence[Tuple[str, str]],
+    daily: bool,
+) -> List[Tuple[tuple, List[Dict[str, Any]]]]:
+    # 原始集合逐条规范化；规范化集合的文档本身就是规范记录
+    return [
+        (group_key(g["_id"], key_fields), g["docs"] if daily else [r for r in map(normalize_doc, g["docs"]) if r is not None])
+        for g in raw_groups
+    ]
+
+
+async def _group_records(
+    raw_groups: List[Dict[str, Any]],
+    key_fields: Sequence[Tuple[str, str]],
+    daily: bool,
+) -> List[Tuple[tuple, List[Dict[str, Any]]]]:
+    """$group 结果转为 (商品键, 规范记录)；原始集合的大结果在线程池中规范化，不阻塞事件循环。"""
+    n_docs = sum(len(g["docs"]) for g in raw_groups)
+    count("docs", n_docs)
+    with stage("group"):
+        if not daily and should_offload(n_docs):
+            return await run_in_thread(_normalize_groups, raw_groups, key_fields, daily)
+        return _normalize_groups(raw_groups, key_fields, daily)
+
+
+async def _fetch_groups_after(
+    start_d: date,
+    end_d: date,
+    platform: Optional[str],
+    account: Optional[str],
+    after: Optional[tuple],
+    limit: int,
+    granularity: str = "day",
+    category: Optional[str] = None,
+    q: Optional[str] = None,
+    compare_range: Optional[Tuple[date, date]] = None,
+) -> Tuple[List[Tuple[tuple, List[Dict[str, Any]]]], bool]:
+    """键集分页：商品键排在 after 之后的前 limit 个分组，以及后面是否还有商品。
+
+    规范化集合的键字段本身就是字符串：按键顺序走索引流式读取，读到第 limit + 1 个商品的
+    第一条记录即停止，只读当前页的文档。原始集合的键需先转成字符串分组，键比较放在 $group 之后。
+    """
+    coll, match = _source_query(start_d, end_d, platform, account, granularity, category, q, compare_range)
+    daily = get_report_source() == "daily"
+    key_fields = DAILY_KEY_FIELDS if daily else RAW_KEY_FIELDS
+    groups: List[Tuple[tuple, List[Dict[str, Any]]]] = []
+    has_more = False
+    if daily:
+        if after is not None:
+            match = {"$and": [match, keyset_filter(after, [field for _alias, field in key_fields])]}
+        with stage("fetch"):
+            # 键序排序可能走不到索引（如带 category/q 或大范围时选了日期索引），允许落盘
+            cursor = coll.find(match, _projection(), sort=key_sort(key_fields), batch_size=1000, allow_disk_use=True)
+            try:
+                async for doc in cursor:
+                    k = doc_group_key(doc, key_fields)
+                    if not groups or groups[-1][0] != k:
+                        if len(groups) == limit:
+                            has_more = True
+                            break
+                        groups.append((k, []))
+                    groups[-1][1].append(doc)
+            finally:
+                await cursor.close()
+        count("docs", sum(len(recs) for _k, recs in groups))
+        return groups, has_more
+    raw_groups: List[Dict[str, Any]] = []
+    with stage("fetch"):
+        pipeline = grouped_after_pipeline(match, after, limit + 1, key_fields, _projection())
+        async for g in coll.aggregate(pipeline, allowDiskUse=True):
+            raw_groups.append(g)
+    if len(raw_groups) > limit:
+        has_more = True
+        raw_groups = raw_groups[:limit]
+    return await _group_records(raw_groups, key_fields, daily), has_more
+
+
+def _fill_reads() -> ContextManager[None]:
+    """缓存回填：本进程刚有写入失效时读主节点，避免把从节点上的旧数据缓存整个 TTL。"""
+    return primary_reads(report_cache.invalidated_within(primary_after_write()))
+
+
+async def _count_groups(
+    start_d: date,
+    end_d: date,
+    platform: Optional[str],
+    account: Optional[str],
+    granularity: str = "day",
+    category: Optional[str] = None,
+    q: Optional[str] = None,
+    compare_range: Optional[Tuple[date, date]] = None,
+) -> int:
+    """商品总数（游标分页按需计算）；启用缓存时与报表结果一同缓存、一同失效。
+
+    与 _fetch_groups_after 统计同一合并范围：只在对比期有数据的商品也会出现在行里。
+    """
+    key = None
+    if report_cache.enabled:
+        key = report_cache.make_key(
+            platform,
+            account,
+            min(start_d, compare_range[0]) if compare_range is not None else start_d,
+            end_d,
+            kind="count",
+            granularity=granularity,
+            source=get_report_source(),
+            rollups=rollups_enabled(),
+            category=category,
+            q=q,
+            compare=compare_range,
+        )
+        with stage("cache"):
+            entry = await report_cache.get(key)
+        if entry is not None:
+            return int(entry["total"])
+
+    async def compute() -> Dict[str, Any]:
+        generation = report_cache.generation
+        with _fill_reads():
+            coll, match = _source_query(start_d, end_d, platform, account, granularity, category, q, compare_range)
+        key_fields = DAILY_KEY_FIELDS if get_report_source() == "daily" else RAW_KEY_FIELDS
+        total = 0
+        with stage("count"):
+            async for doc in coll.aggregate(group_count_pipeline(match, key_fields), allowDiskUse=True):
+                total = int(doc["n"])
+        entry = {"total": total}
+        if key is not None and report_cache.generation == generation:
+            await report_cache.put(key, entry)
+        return entry
+
+    if key is None:
+        return int((await compute())["total"])
+    return int((await report_flights.do(f"{key}#{report_cache.generation}", compute))["total"])
+
+
+async def _iter_groups(
+    start_d: date,
+    end_d: date,
+    platform: Optional[str],
+    account: Optional[str],
+    granularity: str = "day",
+    category: Optional[str] = None,
+    q: Optional[str] = None,
+) -> AsyncIterator[Tuple[tuple, List[Dict[str, Any]]]]:
+    """按商品键排序流式读取，相邻同键文档即为一组；内存只保留当前商品。
+
+    原始集合按与 $group 相同的字符串化键排序（同一商品的 Ozon ID 可能有数字和字符串两种存法，
+    按原字段排序时 Mongo 会把数字排在字符串前，同一商品被拆成两组）。
+    """
+    coll, flt = _source_query(start_d, end_d, platform, account, granularity, category, q)
+    daily = get_report_source() == "daily"
+    key_fields = DAILY_KEY_FIELDS if daily else RAW_KEY_FIELDS
+    if daily:
+        cursor = coll.find(flt, _projection(), sort=key_sort(key_fields), allow_disk_use=True, batch_size=1000)
+    else:
+        cursor = coll.aggregate(keyed_stream_pipeline(flt, key_fields, _projection()), allowDiskUse=True, batchSize=1000)
+    cur_key: Optional[tuple] = None
+    records: List[Dict[str, Any]] = []
+    async for doc in cursor:
+        if daily:
+            k = doc_group_key(doc, key_fields)
+        else:
+            sk = doc.pop("_key")
+            k = tuple(sk[alias] for alias, _field in key_fields)
+        if k != cur_key:
+            if cur_key is not None:
+                yield cur_key, records
+            cur_key, records = k, []
+        rec = doc if daily else normalize_doc(doc)
+        if rec is not None:
+            records.append(rec)
+    if cur_key is not None:
+        yield cur_key, records
+
+
+def _report_engine(engine: Optional[str] = None) -> str:
+    engine = (engine or os.getenv("REPORT_ENGINE", "python")).strip().lower()
+    return engine if engine in ("python", "columnar") else "python"
+
+
+def _build_rows(
+    spec: PeriodSpec,
+    groups: List[Tuple[tuple, List[Dict[str, Any]]]],
+    engine: str,
+    cmp: Optional[PeriodSpec] = None,
+) -> List[Dict[str, Any]]:
+    with stage("build"):
+        if engine == "columnar":
+            return columnar.build_rows(spec, groups, cmp)
+        return [_build_row(spec, k, recs, cmp) for k, recs in groups]
+
+
+async def _build_rows_async(
+    spec: PeriodSpec,
+    groups: List[Tuple[tuple, List[Dict[str, Any]]]],
+    engine: str,
+    cmp: Optional[PeriodSpec] = None,
+) -> List[Dict[str, Any]]:
+    """同 _build_rows；记录数达到 REPORT_OFFLOAD_MIN_RECORDS 时在线程池/进程池中计算（见 app.offload）。"""
+    if not should_offload(sum(len(recs) for _k, recs in groups)):
+        return _build_rows(spec, groups, engine, cmp)
+    with stage("build"):
+        if offload_mode() == "process":
+            return await build_rows_in_processes(spec, groups, cmp)
+        return await run_in_thread(_build_rows, spec, groups, engine, cmp)
+
+
+async def _report_rows(
+    spec: PeriodSpec,
+    platform: Optional[str],
+    account: Optional[str],
+    page: int,
+    page_size: int,
+    engine: str = "python",
+    category: Optional[str] = None,
+    q: Optional[str] = None,
+    sort_by: Optional[str] = None,
+    order: str = "desc",
+    period: int = -1,
+    min_sales: Optional[int] = None,
+    cmp: Optional[PeriodSpec] = None,
+    refresh: bool = False,
+) -> Tuple[int, List[Any]]:
+    """取一页报表行（ReportRow 同形 dict）。
+
+    启用缓存时整份结果按查询缓存，排序/翻页直接在缓存上进行；同一查询的并发未命中
+    共用一次计算（single-flight）。无需排序时分页在 Mongo 端完成、只计算当前页：
+    未启用缓存时总是如此；启用缓存时用于未命中的请求，整份结果同时在后台回填缓存。cmp 为对比列（compare=prev|yoy）；refresh 跳过缓存读取、重新计算并写回（预热用）。
+    """
+    compare_range = (cmp.start, cmp.end) if cmp is not None else None
+    if report_cache.enabled:
+        # 缓存键的日期标签覆盖对比范围，写入对比期数据时同样失效
+        key = report_cache.make_key(
+            platform,
+            account,
+            min(spec.start, cmp.start) if cmp is not None else spec.start,
+            spec.end,
+            mode=spec.granularity,
+            buckets=len(spec),
+            summary_from=spec.summary_from,
+            source=get_report_source(),
+            rollups=rollups_enabled(),
+            category=category,
+            q=q,
+            compare=compare_range,
+        )
+        with stage("cache"):
+            entry = None if refresh else await report_cache.get(key)
+        if entry is None:
+
+            async def compute() -> Dict[str, Any]:
+                generation = report_cache.generation
+                with _fill_reads():
+                    total, groups = await _fetch_groups(
+                        spec.start,
+                        spec.end,
+                        platform,
+                        account,
+                        granularity=spec.granularity,
+                        category=category,
+                        q=q,
+                        compare_range=compare_range,
+                    )
+                computed = {"total": total, "rows": await _build_rows_async(spec, groups, engine, cmp)}
+                # 计算期间有写入（缓存已失效）时不回填，避免缓存旧结果
+                if report_cache.generation == generation:
+                    await report_cache.put(key, computed)
+                return computed
+
+            # 键带上失效代数：写入之后的请求不会加入写入之前开始的计算
+            flight = f"{key}#{report_cache.generation}"
+            page_flight = f"{flight}#page={page}:{page_size}"
+
+            async def page_rows() -> Tuple[int, List[Any]]:
+                return await _pushdown_page(spec, platform, account, page, page_size, engine, category, q, cmp)
+
+            if report_flights.in_flight(page_flight):
+                # 同一页的并发冷请求共用一次 Mongo 端分页
+                return await report_flights.do(page_flight, page_rows)
+            if refresh or sort_by or min_sales is not None or report_flights.in_flight(flight):
+                # 需要排序、预热，或整份计算已在进行（其他页不再各自扫描整个范围）：等整份结果
+                entry = await report_flights.do(flight, compute)
+            else:
+                # 冷缓存且无需排序：当前页在 Mongo 端分页、只算这一页，整份结果在后台算好回填缓存
+                _log_failure(report_flights.start(flight, compute), key)
+                return await report_flights.do(page_flight, page_rows)
+        rows = entry["rows"]
+    elif sort_by or min_sales is not None:
+        # 排序键是计算后的指标，需要先算出全部行
+        _total, groups = await _fetch_groups(
+            spec.start,
+            spec.end,
+            platform,
+            account,
+            granularity=spec.granularity,
+            category=category,
+            q=q,
+            compare_range=compare_range,
+        )
+        rows = await _build_rows_async(spec, groups, engine, cmp)
+    else:
+        return await _pushdown_page(spec, platform, account, page, page_size, engine, category, q, cmp)
+    with stage("select"):
+        return select_rows(rows, page, page_size, sort_by, order, period, min_sales)
+
+
+async def _pushdown_page(
+    spec: PeriodSpec,
+    platform: Optional[str],
+    account: Optional[str],
+    page: int,
+    page_size: int,
+    engine: str,
+    category: Optional[str],
+    q: Optional[str],
+    cmp: Optional[PeriodSpec],
+) -> Tuple[int, List[Any]]:
+    """按商品键排序的一页：$skip/$limit 在 Mongo 端完成，只取、只算当前页的商品。"""
+    total, page_groups = await _fetch_groups(
+        spec.start,
+        spec.end,
+        platform,
+        account,
+        page,
+        page_size,
+        spec.granularity,
+        category,
+        q,
+        (cmp.start, cmp.end) if cmp is not None else None,
     )
+    return total, await _build_rows_async(spec, page_groups, engine, cmp)
+
+
+def _log_failure(task: "asyncio.Task[Any]", key: str) -> None:
+    """后台回填失败只记日志（下次请求重新计算）；任务由 report_flights 持有直到完成。"""
+
+    def done(t: "asyncio.Task[Any]") -> None:
+        if not t.cancelled() and t.exception() is not None:
+            logger.error("background report cache fill failed for %s", key, exc_info=t.exception())
+
+    task.add_done_callback(done)
+
 
+_INT_CELL_FIELDS = frozenset(("total_sales_qty", "ad_sales_qty", "natural_sales_qty", "inventory"))
 
-def _empty_day(d: date) -> DayMetrics:
-    return DayMetrics(
-        date=d,
-        total_sales_qty=0,
-        ad_sales_qty=0,
-        natural_sales_qty=0,
-        avg_price=0.0,
-        goods_cost=0.0,
-        sales_cost=0.0,
-        ad_spend=0.0,
-        sales_amount=0.0,
-        payout=0.0,
-        profit=0.0,
-        inventory=0,
-        ad_ratio=0.0,
+
+def _empty_cell(label: Any) -> Dict[str, Any]:
+    cell: Dict[str, Any] = {"date": label}
+    for f in CELL_METRICS:
+        cell[f] = 0 if f in _INT_CELL_FIELDS else 0.0
+    return cell
+
+
+# 日列直接取值的指标（profit/ad_ratio 为计算字段）
+_ASSIGN_METRICS: Tuple[str, ...] = tuple(f for f in CELL_METRICS if f not in ("profit", "ad_ratio"))
+_SUM_METRICS: Tuple[str, ...] = tuple(f for f in _ASSIGN_METRICS if f not in ("avg_price", "inventory"))
+
+
+def _put_record(
+    cells: List[Dict[str, Any]],
+    spec: PeriodSpec,
+    rec: Dict[str, Any],
+    d: date,
+    inventory_days: List[Optional[date]],
+) -> None:
+    idx = spec.index_of(d)
+    if idx is None:
+        return
+    cell = cells[idx]
+    if spec.cumulative:
+        for f in _SUM_METRICS:
+            cell[f] += rec[f]
+        # 库存取桶内最后一天（同一天多条时取后到的），与记录顺序无关
+        last = inventory_days[idx]
+        if last is None or d >= last:
+            inventory_days[idx] = d
+            cell["inventory"] = rec["inventory"]
+    else:
+        for f in _ASSIGN_METRICS:
+            cell[f] = rec[f]
+
+
+def _finish_cells(spec: PeriodSpec, cells: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """补全计算字段，返回汇总（日模式为最后 summary_days 天，默认 12；其余模式为全部列）。"""
+    for cell in cells:
+        amt = cell["sales_amount"]
+        if spec.cumulative:
+            # 均价按销售额/销量加权
+            qty = cell["total_sales_qty"]
+            cell["avg_price"] = round((amt / qty) if qty > 0 else 0.0, 2)
+        cell["profit"] = _calc_profit(amt, cell["goods_cost"], cell["sales_cost"], cell["ad_spend"])
+        cell["ad_ratio"] = round((cell["ad_spend"] / amt) if amt > 0 else 0.0, 4)
+
+    summary_cells = cells[spec.summary_from:]
+    return summary_from_sums(
+        sum(x["total_sales_qty"] for x in summary_cells),
+        sum(x["sales_amount"] for x in summary_cells),
+        sum(x["ad_sales_qty"] for x in summary_cells),
+        sum(x["ad_spend"] for x in summary_cells),
     )
 
 
-def _build_row(days_order: List[date], docs: List[Dict[str, Any]]) -> ReportRow:
-    # 基础信息取第一条
-    first = docs[0] if docs else {}
-    ozon_id, name_cn, category, sku, platform, account = _row_key(first)
-
-    # 建立每天映射
-    day_map: Dict[date, DayMetrics] = {d: _empty_day(d) for d in days_order}
-
-    for doc in docs:
-        d = _doc_date(doc)
-        if d is None or d not in day_map:
-            continue
-        dm = day_map[d]
-        total_sales_qty = _safe_int(doc.get("总销量") or doc.get("销量") or doc.get("销售量"))
-        tpl_qty = _safe_int(doc.get("模板销量"))
-        search_qty = _safe_int(doc.get("搜索销量"))
-        nat_qty_field = doc.get("自然销量")
-        natural_qty = _safe_int(nat_qty_field) if nat_qty_field is not None else max(total_sales_qty - tpl_qty - search_qty, 0)
-
-        avg_price = _safe_float(doc.get("均价") or doc.get("售价"))
-        sales_amount = _safe_float(doc.get("总销售额") or doc.get("销售额"))
-        goods_cost = _safe_float(doc.get("总货物成本") or doc.get("货物成本") or doc.get("成本|卢布") or doc.get("成本"))
-        sales_cost = _safe_float(doc.get("总销售成本") or doc.get("销售成本"))
-        tpl_spend = _safe_float(doc.get("总模板花费") or doc.get("模板花费"))
-        search_spend = _safe_float(doc.get("总搜索花费") or doc.get("搜索花费"))
-        ad_spend = tpl_spend + search_spend
-        payout = _safe_float(doc.get("总回款") or doc.get("回款"))
-        inventory = _safe_int(doc.get("库存数量") or 0)
-
-        dm.total_sales_qty = total_sales_qty
-        dm.ad_sales_qty = tpl_qty + search_qty
-        dm.natural_sales_qty = natural_qty
-        dm.avg_price = avg_price
-        dm.sales_amount = sales_amount
-        dm.goods_cost = goods_cost
-        dm.sales_cost = sales_cost
-        dm.ad_spend = ad_spend
-        dm.payout = payout
-        dm.inventory = inventory
-        dm.profit = _calc_profit(sales_amount, goods_cost, sales_cost, ad_spend)
-        dm.ad_ratio = round((ad_spend / sales_amount) if sales_amount > 0 else 0.0, 4)
-
-    # 12日汇总按最后一天向前滚12天
-    end_d = days_order[-1]
-    start_12d = end_d - timedelta(days=11)
-    days_12 = [d for d in days_order if start_12d <= d <= end_d]
-    sales_qty_12 = sum(day_map[d].total_sales_qty for d in days_12)
-    sales_amt_12 = sum(day_map[d].sales_amount for d in days_12)
-    ad_qty_12 = sum(day_map[d].ad_sales_qty for d in days_12)
-    ad_spend_12 = sum(day_map[d].ad_spend for d in days_12)
-    summary_12d = Summary12D(
-        sales_qty=sales_qty_12,
-        sales_amount=round(sales_amt_12, 2),
-        ad_sales_qty=ad_qty_12,
-        ad_spend=round(ad_spend_12, 2),
-        ad_ratio=round((ad_spend_12 / sales_amt_12) if sales_amt_12 > 0 else 0.0, 4),
-        ad_sales_ratio=round((ad_qty_12 / sales_qty_12) if sales_qty_12 > 0 else 0.0, 4),
+def _build_row(
+    spec: PeriodSpec,
+    key: tuple,
+    records: List[Dict[str, Any]],
+    cmp: Optional[PeriodSpec] = None,
+) -> Dict[str, Any]:
+    """所有模式共用的单行聚合：按 spec 定位列，日列取值、周/月等列累加。
+
+    cmp 为对比列时，同一遍遍历把记录同时放入报表列与对比列。
+    返回与 ReportRow 同形的普通 dict，直接交给 FastJSONResponse 序列化。
+    """
+    ozon_id, name_cn, category, sku, platform, account = key
+
+    cells = [_empty_cell(label) for _s, _e, label in spec.buckets]
+    cmp_cells = [_empty_cell(label) for _s, _e, label in cmp.buckets] if cmp is not None else None
+    inventory_days: List[Optional[date]] = [None] * len(cells)
+    cmp_inventory_days: List[Optional[date]] = [None] * len(cmp_cells) if cmp_cells is not None else []
+
+    for rec in records:
+        d = rec["day"].date()
+        _put_record(cells, spec, rec, d, inventory_days)
+        if cmp_cells is not None:
+            _put_record(cmp_cells, cmp, rec, d, cmp_inventory_days)
+
+    summary_12d = _finish_cells(spec, cells)
+    row = {
+        "category": category or None,
+        "name_cn": name_cn or None,
+        "sku": sku or None,
+        "ozon_id": ozon_id or None,
+        "platform": platform or None,
+        "account": account or None,
+        "summary_12d": summary_12d,
+        "days": cells,
+    }
+    if cmp_cells is not None:
+        row["compare"] = compare_block(cells, cmp_cells, summary_12d, _finish_cells(cmp, cmp_cells))
+    return row
+
+
+@app.get("/api/health")
+async def health() -> Dict[str, Any]:
+    return {"status": "ok", "mongo_pool": pool_stats.snapshot()}
+
+
+async def _after_write(result: Dict[str, Any]) -> Dict[str, Any]:
+    """写入后：增量刷新周/月预聚合，按变更范围失效报表缓存，并触发后台预热。"""
+    if not result["ranges"]:
+        result["cache_invalidated"] = 0
+        return result
+    if rollups_enabled():
+        result["rollups"] = (await refresh_rollups())["written"]
+    result["cache_invalidated"] = sum(
+        [await report_cache.invalidate(r["platform"], r["account"], r["start"], r["end"]) for r in result["ranges"]]
     )
+    prewarm.notify()
+    return result
 
-    return ReportRow(
-        category=category or None,
-        name_cn=name_cn or None,
-        sku=sku or None,
-        ozon_id=ozon_id or None,
-        platform=platform or None,
-        account=account or None,
-        summary_12d=summary_12d,
-        days=[day_map[d] for d in days_order],
+
+@app.post("/api/ingest")
+async def ingest(docs: List[Dict[str, Any]] = Body(...)) -> Dict[str, Any]:
+    """写入原始文档（JSON 数组）：与 /api/import 同一写入路径，按 (商品键, 日) upsert，重复提交不写入。"""
+    try:
+        result = await import_rows(docs, max(1, len(docs)))
+    except ImportAborted as exc:
+        await _after_write(exc.result)
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+    return await _after_write(result)
+
+
+@app.post("/api/import")
+async def import_file(
+    request: Request,
+    format: Optional[str] = Query(None, pattern=IMPORT_FORMAT_PATTERN, description="默认按 filename / Content-Type 判断"),
+    filename: str = Query("", description="原文件名，用于判断格式"),
+    encoding: str = Query("utf-8-sig", description="CSV 编码（如 gbk）"),
+    sheet: Optional[str] = Query(None, description="XLSX 工作表名，默认当前活动表"),
+    raw: bool = Query(True, description="同时写入原始集合 operation_report"),
+    batch_size: int = Query(1000, ge=1, le=10000),
+):
+    """批量导入 CSV/XLSX 导出文件（请求体为文件本身）：按 (商品键, 日) 分批 upsert，重复导入不写入。
+
+    返回行数、新增/更新/未变化条数、吞吐量和变更的（平台, 账号, 日期范围），
+    只按这些范围失效缓存、刷新预聚合。
+    """
+    fmt = format or detect_format(filename, request.headers.get("content-type", ""))
+    with tempfile.TemporaryFile() as fp:
+        # 请求体先落临时文件：XLSX 需要可随机读取，CSV 也不必整体放进内存
+        with stage("upload"):
+            async for chunk in request.stream():
+                fp.write(chunk)
+            fp.seek(0)
+        try:
+            result = await import_rows(open_rows(fp, fmt, encoding, sheet), batch_size, raw=raw)
+        except RuntimeError as exc:
+            raise HTTPException(status_code=501, detail=str(exc)) from exc
+        except ImportAborted as exc:
+            # 出错前已写入的批次保留：按已写入的范围刷新预聚合、失效缓存，再报错
+            await _after_write(exc.result)
+            raise HTTPException(status_code=422, detail=f"{exc} (written before the error: {exc.result['inserted'] + exc.result['updated']} records)") from exc
+        except ValueError as exc:
+            raise HTTPException(status_code=422, detail=str(exc)) from exc
+    return await _after_write(result)
+
+
+@app.post("/api/prewarm")
+async def trigger_prewarm() -> Dict[str, Any]:
+    """外部任务导入数据后调用：失效全部报表缓存并触发后台预热（防抖后执行）。"""
+    dropped = await report_cache.invalidate()
+    prewarm.notify()
+    return {"cache_invalidated": dropped, "prewarm": prewarm.stats()}
+
+
+@app.get("/api/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    """Prometheus 文本格式：请求/阶段耗时直方图、扫描文档数，以及缓存、连接池与日期解析的当前值。"""
+    body = render_metrics(
+        [
+            ("report_cache", "Report cache statistics", report_cache.stats()),
+            ("mongo_pool", "Mongo connection pool statistics", pool_stats.snapshot()),
+            ("date_parse", "Document date parsing statistics", date_stats.snapshot()),
+            ("report_singleflight", "Shared in-flight report computations", report_flights.stats()),
+            ("report_prewarm", "Background report pre-warming", prewarm.stats()),
+        ]
     )
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4; charset=utf-8")
 
 
-@app.get("/api/health")
-async def health() -> Dict[str, str]:
-    return {"status": "ok"}
+@app.get("/api/cache/stats")
+async def cache_stats() -> Dict[str, Any]:
+    return {**report_cache.stats(), "singleflight": report_flights.stats(), "prewarm": prewarm.stats()}
 
 
 @app.get("/api/debug-report")
@@ -230,328 +801,435 @@ async def debug_report(
     weeks: Optional[int] = None,
     months: Optional[int] = None,
 ):
-    end_d = parse_any_date(date_str)
-    if mode == "week":
-        n_weeks = int(weeks or 12)
-        wk = build_weeks(end_d, n_weeks)
-        start_d = wk[0][0]
-        end_d = wk[-1][1]
-    elif mode == "month":
-        n_months = int(months or 12)
-        mr = build_months(end_d, n_months)
-        start_d = mr[0][0]
-        end_d = mr[-1][1]
-    else:
-        if days is not None:
-            days = max(1, min(62, int(days)))
-            start_d = end_d - timedelta(days=days - 1)
-        else:
-            start_d = month_start(end_d)
+    spec = build_spec(parse_any_date(date_str), mode, days, weeks, months)
+    start_d, end_d = spec.start, spec.end
 
     # 构造与 _fetch_docs 相同的过滤器，附加计数
-    coll = get_collection()
-    # 日期部分
-    def _fmt_v(d: date) -> List[str]:
-        y, m, dd = d.year, d.month, d.day
-        return [f"{y}/{m}/{dd}", f"{y}/{m:02d}/{dd:02d}", f"{y}-{m:02d}-{dd:02d}", f"{y}-{m}-{dd}"]
-    str_dates: List[str] = []
-    cur = start_d
-    while cur <= end_d:
-        str_dates.extend(_fmt_v(cur))
-        cur = cur + timedelta(days=1)
-    str_dates = list(sorted(set(str_dates)))
-    start_dt = datetime.combine(start_d, datetime.min.time())
-    end_dt_next = datetime.combine(end_d, datetime.min.time()) + timedelta(days=1)
-    date_fields = ["日期", "date", "Date"]
-    date_or: List[Dict[str, Any]] = []
-    for f in date_fields:
-        date_or.append({f: {"$gte": start_dt, "$lt": end_dt_next}})
-        date_or.append({f: {"$in": str_dates}})
-    filter_parts: List[Dict[str, Any]] = []
-    if date_or:
-        filter_parts.append({"$or": date_or})
-    if platform:
-        plat_regex = re.compile(rf"^\s*{re.escape(platform)}\s*$", re.IGNORECASE)
-        filter_parts.append({"$or": [{"平台": plat_regex}, {"platform": plat_regex}]})
-    if account:
-        acc_regex = re.compile(rf"^\s*{re.escape(account)}\s*$", re.IGNORECASE)
-        filter_parts.append({"$or": [{"账号": acc_regex}, {"account": acc_regex}]})
-    final_filter: Dict[str, Any] = {"$and": filter_parts} if filter_parts else {}
+    coll, final_filter = _source_query(start_d, end_d, platform, account)
+    str_dates = date_strings(start_d, end_d) if get_report_source() == "raw" else []
 
     total = await coll.count_documents(final_filter)
-    sample = await coll.find_one(final_filter)
+    sample = await coll.find_one(final_filter, _projection())
     return {
         "start": str(start_d),
         "end": str(end_d),
         "mode": mode,
+        "source": get_report_source(),
         "filter": str(final_filter),
         "str_dates": str_dates[:5],
         "total_match": int(total),
         "sample_keys": list(sample.keys()) if sample else [],
+        "projection": list(_projection()),
+        "date_parse": date_stats.snapshot(),
     }
 
 
-@app.get("/api/report", response_model=ReportResponse)
-async def report(
+def _csv_line(values: List[Any]) -> str:
+    buf = io.StringIO()
+    csv.writer(buf).writerow(values)
+    return buf.getvalue()
+
+
+def _period_spec(
     date_str: str = Query(..., alias="date", description="选择的日期，YYYY-MM-DD"),
-    platform: Optional[str] = Query(None),
-    account: Optional[str] = Query(None),
-    mode: str = Query("day", pattern="^(day|week|month)$"),
+    mode: str = Query("day", pattern="^(day|week|month|quarter|window)$"),
     days: Optional[int] = Query(None, ge=1, le=62, description="展示的天数（可选，默认当月起）"),
     weeks: Optional[int] = Query(None, ge=1, le=52, description="周模式下展示的周数"),
     months: Optional[int] = Query(None, ge=1, le=36, description="月模式下展示的月数"),
+    quarters: Optional[int] = Query(None, ge=1, le=12, description="季度模式下展示的季度数"),
+    windows: Optional[int] = Query(None, ge=1, le=52, description="自定义窗口模式下的窗口数"),
+    window_days: Optional[int] = Query(None, ge=1, le=90, description="自定义窗口的天数"),
+    summary_days: Optional[int] = Query(None, ge=1, le=62, description="日模式汇总/滚动窗口天数，默认 REPORT_SUMMARY_DAYS（12）"),
+) -> PeriodSpec:
+    try:
+        end_d = parse_any_date(date_str)
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+    return build_spec(end_d, mode, days, weeks, months, quarters, windows, window_days, summary_days)
+
+
+@app.get("/api/report/export")
+async def export_report(
+    spec: PeriodSpec = Depends(_period_spec),
+    platform: Optional[str] = Query(None),
+    account: Optional[str] = Query(None),
+    category: Optional[str] = Query(None, description="类别（精确匹配，不区分大小写）"),
+    q: Optional[str] = Query(None, description="中文名称/SKU/Ozon ID 包含的关键字"),
+    fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+) -> StreamingResponse:
+    """全量导出（不分页）：边读边算边输出，NDJSON 每行一个 ReportRow，CSV 为宽表。"""
+    groups = _iter_groups(spec.start, spec.end, platform, account, spec.granularity, category, q)
+
+    async def ndjson() -> AsyncIterator[bytes]:
+        async for k, recs in groups:
+            yield dumps(_build_row(spec, k, recs)) + b"\n"
+
+    async def wide_csv() -> AsyncIterator[str]:
+        header = list(ROW_ID_FIELDS) + [f"summary_12d.{f}" for f in SUMMARY_FIELDS]
+        for _s, _e, label in spec.buckets:
+            label = str(label).replace("\n", " ")
+            header.extend(f"{label}.{m}" for m in CELL_METRICS)
+        yield _csv_line(header)
+        async for k, recs in groups:
+            row = _build_row(spec, k, recs)
+            values: List[Any] = [row[f] or "" for f in ROW_ID_FIELDS]
+            summary = row["summary_12d"]
+            values.extend(summary[f] for f in SUMMARY_FIELDS)
+            for cell in row["days"]:
+                values.extend(cell[m] for m in CELL_METRICS)
+            yield _csv_line(values)
+
+    filename = f"report_{spec.granularity}_{spec.start}_{spec.end}.{fmt}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if fmt == "csv":
+        return StreamingResponse(wide_csv(), media_type="text/csv; charset=utf-8", headers=headers)
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson", headers=headers)
+
+
+async def _fetch_product(
+    start_d: date,
+    end_d: date,
+    key: tuple,
+    granularity: str = "day",
+    compare_range: Optional[Tuple[date, date]] = None,
+) -> List[Dict[str, Any]]:
+    """单个商品在日期范围内的规范记录：键字段等值 + 日期范围的点查询。
+
+    规范化/预聚合集合命中 platform_account_key_day 索引；原始集合按原始列取值匹配
+    （数字存储的 Ozon ID 等同样匹配）。
+    """
+    coll, match = _source_query(start_d, end_d, None, None, granularity, compare_range=compare_range)
+    daily = get_report_source() == "daily"
+    key_fields = DAILY_KEY_FIELDS if daily else RAW_KEY_FIELDS
+    match = {"$and": [match, key_filter(key, key_fields, loose=not daily, normalized=daily)]}
+    with stage("fetch"):
+        docs = [doc async for doc in coll.find(match, _projection())]
+    count("docs", len(docs))
+    if daily:
+        return docs
+    with stage("group"):
+        return [r for r in map(normalize_doc, docs) if r is not None]
+
+
+@app.get("/api/report/product")
+async def report_product(
+    spec: PeriodSpec = Depends(_period_spec),
+    ozon_id: str = Query("", description="商品键六个字段取列表行中的值，空值传空串或省略"),
+    name_cn: str = Query(""),
+    category: str = Query(""),
+    sku: str = Query(""),
+    platform: str = Query(""),
+    account: str = Query(""),
+    engine: Optional[str] = Query(None, pattern="^(python|columnar)$"),
+    compare: Optional[str] = Query(None, pattern=COMPARE_PATTERN),
+    rolling: bool = Query(False),
+) -> FastJSONResponse:
+    """单商品明细：按需取一个商品的日/周/月列（配合 /api/report?view=slim 的列表）。"""
+    if rolling and spec.summary_days is None:
+        raise HTTPException(status_code=422, detail="rolling is only available in day mode")
+    key = (ozon_id, name_cn, category, sku, platform, account)
+    cmp = comparison_spec(spec, compare) if compare else None
+    records = await _fetch_product(
+        spec.start, spec.end, key, spec.granularity, (cmp.start, cmp.end) if cmp is not None else None
+    )
+    if not records:
+        raise HTTPException(status_code=404, detail="no records for this product in the selected range")
+    row = _build_rows(spec, [(key, records)], _report_engine(engine), cmp)[0]
+    if rolling:
+        row["rolling"] = rolling_summaries(row["days"], spec.summary_days)
+    payload: Dict[str, Any] = {
+        "start": spec.start,
+        "end": spec.end,
+        "days_count": len(spec),
+        "mode": spec.granularity,
+        "period_labels": spec.period_labels,
+        "row": row,
+    }
+    if cmp is not None:
+        payload.update(compare=compare, compare_start=cmp.start, compare_end=cmp.end, compare_periods=cmp.period_labels)
+    with stage("serialize"):
+        return FastJSONResponse(payload)
+
+
+@app.get("/api/inventory", response_model=InventoryResponse, response_class=FastJSONResponse)
+async def inventory_report(
+    date_str: str = Query(..., alias="date", description="统计截止日期，YYYY-MM-DD"),
+    platform: Optional[str] = Query(None),
+    account: Optional[str] = Query(None),
+    category: Optional[str] = Query(None, description="类别（精确匹配，不区分大小写）"),
+    q: Optional[str] = Query(None, description="中文名称/SKU/Ozon ID 包含的关键字"),
+    window: int = Query(14, ge=1, le=90, description="日均销量的统计天数"),
+    cover_days: float = Query(14, gt=0, le=365, description="可售天数低于此值（且窗口内有销量）视为断货风险"),
+    include_all: bool = Query(False, description="返回全部商品（仍按紧急程度排序），默认只返回有断货风险的"),
+    limit: int = Query(1000, ge=1, le=20000),
+) -> FastJSONResponse:
+    """库存与断货分析：一次返回整个账号按紧急程度排序的断货风险商品（见 app.inventory）。"""
+    try:
+        as_of = parse_any_date(date_str)
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+    start_d = window_start(as_of, window)
+    _total, groups = await _fetch_groups(start_d, as_of, platform, account, category=category, q=q)
+    with stage("build"):
+        args = (groups, as_of, window, cover_days, include_all)
+        if should_offload(sum(len(recs) for _k, recs in groups)):
+            products, rows = await run_in_thread(inventory_rows, *args)
+        else:
+            products, rows = inventory_rows(*args)
+    count("rows", min(len(rows), limit))
+    payload = {
+        "as_of": as_of,
+        "window_start": start_d,
+        "window_days": window,
+        "cover_days": cover_days,
+        "products": products,
+        "at_risk": sum(1 for r in rows if r["at_risk"]),
+        "rows": rows[:limit],
+    }
+    with stage("serialize"):
+        return FastJSONResponse(payload)
+
+
+def _check_period(spec: PeriodSpec, period: int) -> None:
+    if not -len(spec) <= period < len(spec):
+        raise HTTPException(status_code=422, detail=f"period must be within [-{len(spec)}, {len(spec) - 1}]")
+
+
+@app.get("/api/report", response_model=ReportResponse, response_class=FastJSONResponse)
+async def report(
+    spec: PeriodSpec = Depends(_period_spec),
+    platform: Optional[str] = Query(None),
+    account: Optional[str] = Query(None),
     page: int = 1,
     page_size: int = Query(50, ge=1, le=500),
+    engine: Optional[str] = Query(None, pattern="^(python|columnar)$", description="行计算引擎，默认取 REPORT_ENGINE"),
+    layout: str = Query("rows", pattern="^(rows|columnar)$", description="rows: ReportResponse；columnar: 列头 + 每行指标数组"),
+    category: Optional[str] = Query(None, description="类别（精确匹配，不区分大小写）"),
+    q: Optional[str] = Query(None, description="中文名称/SKU/Ozon ID 包含的关键字"),
+    sort_by: Optional[str] = Query(None, pattern=SORT_PATTERN, description="summary_12d 字段，或 days.<指标>（按 period 列）"),
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    period: int = Query(-1, description="days.<指标> 排序所用的列下标，负数从最后一列倒数"),
+    min_sales: Optional[int] = Query(None, ge=0, description="汇总销量下限"),
+    rolling: bool = Query(False, description="日模式：附加每一天结束的 summary_days 滚动汇总"),
+    cursor: Optional[str] = Query(None, description="键集分页：首页传空值，之后传上一页的 next_cursor"),
+    with_total: bool = Query(False, description="游标分页时是否计算 total（按需计算并缓存）"),
+    compare: Optional[str] = Query(None, pattern=COMPARE_PATTERN, description="对比：prev 上一周期，yoy 去年同期"),
+    view: str = Query("full", pattern="^(full|slim)$", description="slim: 只返回商品标识与汇总，日/周/月列按需取 /api/report/product"),
 ):
-    end_d = parse_any_date(date_str)
-    period_labels: List[str] = []
-
-    if mode == "day":
-        if days is not None:
-            days = max(1, min(62, int(days)))
-            start_d = end_d - timedelta(days=days - 1)
-        else:
-            start_d = month_start(end_d)
-        periods = list(date_range(start_d, end_d))
-
-        # 取记录
-        docs = await _fetch_docs(start_d, end_d, platform, account)
-        groups: Dict[tuple, List[dict]] = defaultdict(list)
-        for doc in docs:
-            groups[_row_key(doc)].append(doc)
-        keys = list(groups.keys())
-        total = len(keys)
-        start_idx = (page - 1) * page_size
-        end_idx = min(start_idx + page_size, total)
-        page_keys = keys[start_idx:end_idx]
-        rows: List[ReportRow] = [_build_row(periods, groups[k]) for k in page_keys]
-        return ReportResponse(
-            start=start_d,
-            end=end_d,
-            days_count=len(periods),
-            page=page,
-            page_size=page_size,
-            total=total,
-            rows=rows,
-            mode="day",
-            period_labels=[],
+    _check_period(spec, period)
+    cmp = comparison_spec(spec, compare) if compare else None
+    if rolling and spec.summary_days is None:
+        raise HTTPException(status_code=422, detail="rolling is only available in day mode")
+    next_cursor: Optional[str] = None
+    total: Optional[int]
+    if cursor is not None:
+        # 键集分页：按商品键顺序取 cursor 之后的 page_size 个商品，不计算 skip/total
+        if sort_by or min_sales is not None:
+            raise HTTPException(status_code=422, detail="cursor pagination is ordered by product key; sort_by/min_sales are not supported")
+        scope = cursor_scope(
+            platform=platform,
+            account=account,
+            mode=spec.granularity,
+            start=spec.start,
+            end=spec.end,
+            category=category,
+            q=q,
+            source=get_report_source(),
         )
-
-    if mode == "week":
-        n_weeks = int(weeks or 12)
-        week_ranges = build_weeks(end_d, n_weeks)  # oldest -> latest
-        start_d = week_ranges[0][0]
-        last_end = week_ranges[-1][1]
-        period_labels = [f"{a} ~ {b}" for (a, b) in week_ranges]
-
-        docs = await _fetch_docs(start_d, last_end, platform, account)
-        groups: Dict[tuple, List[dict]] = defaultdict(list)
-        for doc in docs:
-            groups[_row_key(doc)].append(doc)
-
-        def week_index(d: date) -> Optional[int]:
-            for idx, (s, e) in enumerate(week_ranges):
-                if s <= d <= e:
-                    return idx
-            return None
-
-        def build_week_row(docs: List[Dict[str, Any]]) -> ReportRow:
-            weeks_metrics: List[DayMetrics] = []
-            for s, e in week_ranges:
-                label = f"{s} ~ {e}"
-                weeks_metrics.append(_empty_day(s))
-                weeks_metrics[-1].date = label
-
-            for doc in docs:
-                d = _doc_date(doc)
-                if d is None:
-                    continue
-                idx = week_index(d)
-                if idx is None:
-                    continue
-                dm = weeks_metrics[idx]
-                total_sales_qty = _safe_int(doc.get("总销量") or doc.get("销量") or doc.get("销售量"))
-                tpl_qty = _safe_int(doc.get("模板销量"))
-                search_qty = _safe_int(doc.get("搜索销量"))
-                natural_qty = _safe_int(doc.get("自然销量")) if doc.get("自然销量") is not None else max(total_sales_qty - tpl_qty - search_qty, 0)
-
-                sales_amount = _safe_float(doc.get("总销售额") or doc.get("销售额"))
-                goods_cost = _safe_float(doc.get("总货物成本") or doc.get("货物成本") or doc.get("成本|卢布") or doc.get("成本"))
-                sales_cost = _safe_float(doc.get("总销售成本") or doc.get("销售成本"))
-                tpl_spend = _safe_float(doc.get("总模板花费") or doc.get("模板花费"))
-                search_spend = _safe_float(doc.get("总搜索花费") or doc.get("搜索花费"))
-                ad_spend = tpl_spend + search_spend
-                payout = _safe_float(doc.get("总回款") or doc.get("回款"))
-                inventory = _safe_int(doc.get("库存数量") or 0)
-
-                dm.total_sales_qty += total_sales_qty
-                dm.ad_sales_qty += (tpl_qty + search_qty)
-                dm.natural_sales_qty += natural_qty
-                dm.sales_amount += sales_amount
-                dm.goods_cost += goods_cost
-                dm.sales_cost += sales_cost
-                dm.ad_spend += ad_spend
-                dm.payout += payout
-                dm.inventory = inventory
-
-            for dm in weeks_metrics:
-                dm.avg_price = round((dm.sales_amount / dm.total_sales_qty) if dm.total_sales_qty > 0 else 0.0, 2)
-                dm.profit = _calc_profit(dm.sales_amount, dm.goods_cost, dm.sales_cost, dm.ad_spend)
-                dm.ad_ratio = round((dm.ad_spend / dm.sales_amount) if dm.sales_amount > 0 else 0.0, 4)
-
-            first = docs[0] if docs else {}
-            ozon_id, name_cn, category, sku, platform_v, account_v = _row_key(first)
-
-            sales_qty_n = sum(x.total_sales_qty for x in weeks_metrics)
-            sales_amt_n = sum(x.sales_amount for x in weeks_metrics)
-            ad_qty_n = sum(x.ad_sales_qty for x in weeks_metrics)
-            ad_spend_n = sum(x.ad_spend for x in weeks_metrics)
-            summary_12d = Summary12D(
-                sales_qty=sales_qty_n,
-                sales_amount=round(sales_amt_n, 2),
-                ad_sales_qty=ad_qty_n,
-                ad_spend=round(ad_spend_n, 2),
-                ad_ratio=round((ad_spend_n / sales_amt_n) if sales_amt_n > 0 else 0.0, 4),
-                ad_sales_ratio=round((ad_qty_n / sales_qty_n) if sales_qty_n > 0 else 0.0, 4),
-            )
-
-            return ReportRow(
-                category=category or None,
-                name_cn=name_cn or None,
-                sku=sku or None,
-                ozon_id=ozon_id or None,
-                platform=platform_v or None,
-                account=account_v or None,
-                summary_12d=summary_12d,
-                days=weeks_metrics,
-            )
-
-        keys = list(groups.keys())
-        total = len(keys)
-        start_idx = (page - 1) * page_size
-        end_idx = min(start_idx + page_size, total)
-        page_keys = keys[start_idx:end_idx]
-        rows = [build_week_row(groups[k]) for k in page_keys]
-
-        return ReportResponse(
-            start=start_d,
-            end=last_end,
-            days_count=len(week_ranges),
-            page=page,
-            page_size=page_size,
-            total=total,
-            rows=rows,
-            mode="week",
-            period_labels=period_labels,
+        after = None
+        if cursor:
+            try:
+                after = decode_cursor(cursor, scope, len(RAW_KEY_FIELDS))
+            except ValueError as exc:
+                raise HTTPException(status_code=422, detail=str(exc)) from exc
+        compare_range = (cmp.start, cmp.end) if cmp is not None else None
+        groups, has_more = await _fetch_groups_after(
+            spec.start,
+            spec.end,
+            platform,
+            account,
+            after,
+            page_size,
+            spec.granularity,
+            category,
+            q,
+            compare_range,
         )
-
-    # month mode
-    if mode == "month":
-        n_months = int(months or 12)
-        month_ranges = build_months(end_d, n_months)  # [(s, e, ym)]
-        start_d = month_ranges[0][0]
-        last_end = month_ranges[-1][1]
-        period_labels = [f"{ym}（{s} ~ {e}）" for (s, e, ym) in month_ranges]
-
-        docs = await _fetch_docs(start_d, last_end, platform, account)
-        groups: Dict[tuple, List[dict]] = defaultdict(list)
-        for doc in docs:
-            groups[_row_key(doc)].append(doc)
-
-        def month_index(d: date) -> Optional[int]:
-            for idx, (s, e, _ym) in enumerate(month_ranges):
-                if s <= d <= e:
-                    return idx
-            return None
-
-        def build_month_row(docs: List[Dict[str, Any]]) -> ReportRow:
-            months_metrics: List[DayMetrics] = []
-            for s, e, ym in month_ranges:
-                label = f"{ym}\n{s} ~ {e}"
-                months_metrics.append(_empty_day(s))
-                months_metrics[-1].date = label
-
-            for doc in docs:
-                d = _doc_date(doc)
-                if d is None:
-                    continue
-                idx = month_index(d)
-                if idx is None:
-                    continue
-                dm = months_metrics[idx]
-                total_sales_qty = _safe_int(doc.get("总销量") or doc.get("销量") or doc.get("销售量"))
-                tpl_qty = _safe_int(doc.get("模板销量"))
-                search_qty = _safe_int(doc.get("搜索销量"))
-                natural_qty = _safe_int(doc.get("自然销量")) if doc.get("自然销量") is not None else max(total_sales_qty - tpl_qty - search_qty, 0)
-
-                sales_amount = _safe_float(doc.get("总销售额") or doc.get("销售额"))
-                goods_cost = _safe_float(doc.get("总货物成本") or doc.get("货物成本") or doc.get("成本|卢布") or doc.get("成本"))
-                sales_cost = _safe_float(doc.get("总销售成本") or doc.get("销售成本"))
-                tpl_spend = _safe_float(doc.get("总模板花费") or doc.get("模板花费"))
-                search_spend = _safe_float(doc.get("总搜索花费") or doc.get("搜索花费"))
-                ad_spend = tpl_spend + search_spend
-                payout = _safe_float(doc.get("总回款") or doc.get("回款"))
-                inventory = _safe_int(doc.get("库存数量") or 0)
-
-                dm.total_sales_qty += total_sales_qty
-                dm.ad_sales_qty += (tpl_qty + search_qty)
-                dm.natural_sales_qty += natural_qty
-                dm.sales_amount += sales_amount
-                dm.goods_cost += goods_cost
-                dm.sales_cost += sales_cost
-                dm.ad_spend += ad_spend
-                dm.payout += payout
-                dm.inventory = inventory
-
-            for dm in months_metrics:
-                dm.avg_price = round((dm.sales_amount / dm.total_sales_qty) if dm.total_sales_qty > 0 else 0.0, 2)
-                dm.profit = _calc_profit(dm.sales_amount, dm.goods_cost, dm.sales_cost, dm.ad_spend)
-                dm.ad_ratio = round((dm.ad_spend / dm.sales_amount) if dm.sales_amount > 0 else 0.0, 4)
-
-            first = docs[0] if docs else {}
-            ozon_id, name_cn, category, sku, platform_v, account_v = _row_key(first)
-
-            sales_qty_n = sum(x.total_sales_qty for x in months_metrics)
-            sales_amt_n = sum(x.sales_amount for x in months_metrics)
-            ad_qty_n = sum(x.ad_sales_qty for x in months_metrics)
-            ad_spend_n = sum(x.ad_spend for x in months_metrics)
-            summary_12d = Summary12D(
-                sales_qty=sales_qty_n,
-                sales_amount=round(sales_amt_n, 2),
-                ad_sales_qty=ad_qty_n,
-                ad_spend=round(ad_spend_n, 2),
-                ad_ratio=round((ad_spend_n / sales_amt_n) if sales_amt_n > 0 else 0.0, 4),
-                ad_sales_ratio=round((ad_qty_n / sales_qty_n) if sales_qty_n > 0 else 0.0, 4),
-            )
-
-            return ReportRow(
-                category=category or None,
-                name_cn=name_cn or None,
-                sku=sku or None,
-                ozon_id=ozon_id or None,
-                platform=platform_v or None,
-                account=account_v or None,
-                summary_12d=summary_12d,
-                days=months_metrics,
-            )
-
-        keys = list(groups.keys())
-        total = len(keys)
-        start_idx = (page - 1) * page_size
-        end_idx = min(start_idx + page_size, total)
-        page_keys = keys[start_idx:end_idx]
-        rows = [build_month_row(groups[k]) for k in page_keys]
-
-        return ReportResponse(
-            start=start_d,
-            end=last_end,
-            days_count=len(month_ranges),
-            page=page,
-            page_size=page_size,
-            total=total,
-            rows=rows,
-            mode="month",
-            period_labels=period_labels,
+        rows = await _build_rows_async(spec, groups, _report_engine(engine), cmp)
+        if has_more:
+            next_cursor = encode_cursor(groups[-1][0], scope)
+        total = (
+            await _count_groups(spec.start, spec.end, platform, account, spec.granularity, category, q, compare_range)
+            if with_total
+            else None
+        )
+    else:
+        # 无排序/筛选时分组与分页在 Mongo 端完成，只取当前页商品的记录
+        total, rows = await _report_rows(
+            spec,
+            platform,
+            account,
+            page,
+            page_size,
+            _report_engine(engine),
+            category=category,
+            q=q,
+            sort_by=sort_by,
+            order=order,
+            period=period,
+            min_sales=min_sales,
+            cmp=cmp,
         )
+    if rolling:
+        # 行可能来自缓存，复制后再附加，不改动缓存中的对象
+        rows = [{**row, "rolling": rolling_summaries(row["days"], spec.summary_days)} for row in rows]
+    payload: Dict[str, Any] = {
+        "start": spec.start,
+        "end": spec.end,
+        "days_count": len(spec),
+        "page": page,
+        "page_size": page_size,
+        "total": total,
+        "rows": rows,
+        "mode": spec.granularity,
+        "period_labels": spec.period_labels,
+    }
+    if cursor is not None:
+        payload["next_cursor"] = next_cursor
+    if cmp is not None:
+        payload.update(compare=compare, compare_start=cmp.start, compare_end=cmp.end, compare_periods=cmp.period_labels)
+    count("rows", len(rows))
+    with stage("serialize"):
+        if view == "slim":
+            payload["rows"] = slim_rows(rows)
+        elif layout == "columnar":
+            payload["periods"] = [label for _s, _e, label in spec.buckets]
+            payload["metric_fields"] = list(CELL_METRICS)
+            payload["rows"] = columnar_rows(rows)
+        # 行已是 ReportResponse 同形的普通 dict，直接序列化，不再经 response_model 校验
+        return FastJSONResponse(payload)
+
+
+def _batch_concurrency() -> int:
+    return max(1, int(os.getenv("REPORT_BATCH_CONCURRENCY", "4")))
+
+
+async def _list_accounts(start_d: date, end_d: date, platform: Optional[str]) -> List[Tuple[str, str]]:
+    """日期范围内出现过的（平台, 账号），已规范化去重。"""
+    coll, match = _source_query(start_d, end_d, platform, None)
+    if get_report_source() == "daily":
+        plat_expr: Any = "$platform"
+        acc_expr: Any = "$account"
+    else:
+        plat_expr = {"$ifNull": ["$平台", "$platform"]}
+        acc_expr = {"$ifNull": ["$账号", "$account"]}
+    pipeline = [{"$match": match}, {"$group": {"_id": {"platform": plat_expr, "account": acc_expr}}}]
+    pairs = set()
+    async for g in coll.aggregate(pipeline, allowDiskUse=True):
+        pairs.add((norm_label(g["_id"].get("platform")), norm_label(g["_id"].get("account"))))
+    return sorted(pairs)
+
+
+async def _prewarm(target: Target) -> int:
+    """预热一个目标：以今天为选择日期重新计算并写入缓存，返回预热的报表数。"""
+    platform, account, mode, n = target
+    spec = build_spec(date.today(), mode, **{f"{mode}s": n})
+    if account == EACH_ACCOUNT:
+        # 缺少账号的记录不单独预热（不带 account 的请求是全部账号的报表）
+        targets = [(p or None, a) for p, a in await _list_accounts(spec.start, spec.end, platform) if a]
+    else:
+        targets = [(platform, account)]
+    sem = asyncio.Semaphore(_batch_concurrency())
+    engine = _report_engine(None)
+
+    async def run_one(plat: Optional[str], acc: Optional[str]) -> None:
+        async with sem:
+            await _report_rows(spec, plat, acc, 1, 1, engine, refresh=True)
 
-    # unreachable
+    # 预热多在写入之后运行，且结果要缓存整个 TTL：读主节点
+    with primary_reads():
+        await asyncio.gather(*(run_one(p, a) for p, a in targets))
+    return len(targets)
+
+
+prewarm = PrewarmScheduler(_prewarm, prewarm_targets(), prewarm_interval(report_cache.ttl), prewarm_delay())
+
+
+@app.post("/api/report/batch")
+async def report_batch(
+    body: BatchReportRequest,
+    spec: PeriodSpec = Depends(_period_spec),
+    page: int = 1,
+    page_size: int = Query(50, ge=1, le=500),
+    engine: Optional[str] = Query(None, pattern="^(python|columnar)$"),
+    category: Optional[str] = Query(None),
+    q: Optional[str] = Query(None),
+    sort_by: Optional[str] = Query(None, pattern=SORT_PATTERN),
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    period: int = Query(-1),
+    min_sales: Optional[int] = Query(None, ge=0),
+) -> FastJSONResponse:
+    """多账号同一报表：各账号在共享的 Motor 连接池上并发取数（信号量限流），结果按账号分组。"""
+    _check_period(spec, period)
+    started = time.perf_counter()
+    if body.targets:
+        targets = [(t.platform, t.account) for t in body.targets]
+    elif body.all_accounts:
+        targets = list(await _list_accounts(spec.start, spec.end, body.platform))
+    else:
+        raise HTTPException(status_code=422, detail="targets is empty and all_accounts is false")
+
+    sem = asyncio.Semaphore(_batch_concurrency())
+    resolved_engine = _report_engine(engine)
+
+    async def run_one(platform: Optional[str], account: Optional[str]) -> Dict[str, Any]:
+        async with sem:
+            t0 = time.perf_counter()
+            item: Dict[str, Any] = {"platform": platform, "account": account}
+            try:
+                total, rows = await _report_rows(
+                    spec,
+                    platform,
+                    account,
+                    page,
+                    page_size,
+                    resolved_engine,
+                    category=category,
+                    q=q,
+                    sort_by=sort_by,
+                    order=order,
+                    period=period,
+                    min_sales=min_sales,
+                )
+                item.update(total=total, rows=rows)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:  # 单个账号失败（含数据异常、计算进程池故障）不影响其他账号
+                logger.exception("batch report failed for %s/%s", platform, account)
+                item["error"] = str(exc) or type(exc).__name__
+            item["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+            return item
+
+    results = await asyncio.gather(*(run_one(p, a) for p, a in targets))
+    count("rows", sum(len(item.get("rows", [])) for item in results))
+    accounts: Dict[str, Dict[str, Any]] = {}
+    for item in results:
+        # 按账号为键；同名账号出现在多个平台时以 “账号@平台” 区分
+        label = item["account"] or "*"
+        if label in accounts:
+            label = f"{label}@{item['platform'] or '*'}"
+        accounts[label] = item
+    payload = {
+        "start": spec.start,
+        "end": spec.end,
+        "days_count": len(spec),
+        "mode": spec.granularity,
+        "period_labels": spec.period_labels,
+        "page": page,
+        "page_size": page_size,
+        "concurrency": _batch_concurrency(),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+        "accounts": accounts,
+    }
+    with stage("serialize"):
+        return FastJSONResponse(payload)
@@ -0,0 +1,281 @@
+"""Request-level performance instrumentation.
+
+Each API request gets a :class:`RequestTimer` in a context variable; code on
+the request path wraps its phases in :func:`stage` (fetch, group, build,
+select, serialize) and adds counts with :func:`count` (docs scanned, rows
+returned). The middleware in app.main turns the timer into a
+``Server-Timing`` header and one structured log line, and feeds the
+in-process histograms rendered in Prometheus text format by /api/metrics.
+
+Profiling: with ``REPORT_PROFILE=1``, a request carrying ``profile=1`` runs
+under pyinstrument (sampling, if installed) or cProfile; when it takes at
+least ``REPORT_PROFILE_MIN_MS`` the report is written to
+``REPORT_PROFILE_DIR`` and its path returned in ``X-Profile``.
+"""
+from __future__ import annotations
+
+import io
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+logger = logging.getLogger("app.metrics")
+
+STAGE_BUCKETS: Tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROW_BUCKETS: Tuple[float, ...] = (0, 1, 10, 50, 100, 250, 500, 1000, 5000)
+
+
+class RequestTimer:
+    """Stage durations (seconds, summed per stage) and counters of one request."""
+
+    __slots__ = ("started", "stages", "counts")
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total: float) -> str:
+        parts = [f"{name};dur={sec * 1000:.2f}" for name, sec in self.stages.items()]
+        parts.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(parts)
+
+
+_current: ContextVar[Optional[RequestTimer]] = ContextVar("request_timer", default=None)
+
+
+def start_request() -> RequestTimer:
+    timer = RequestTimer()
+    _current.set(timer)
+    return timer
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - t0)
+
+
+def count(name: str, n: int) -> None:
+    timer = _current.get()
+    if timer is not None:
+        timer.counts[name] = timer.counts.get(name, 0) + n
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{k}="{_escape(v)}"' for k, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _value(v: Any) -> str:
+    """Exact sample value: integers without exponent (``{:g}`` rounds past 6 digits)."""
+    if isinstance(v, int):
+        return str(int(v))
+    v = float(v)
+    if v.is_integer():
+        return str(int(v))
+    if v != v:
+        return "NaN"
+    if v in (float("inf"), float("-inf")):
+        return "+Inf" if v > 0 else "-Inf"
+    return repr(v)
+
+
+INF_LABEL = 'le="+Inf"'
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str], buckets: Sequence[float]) -> None:
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # labels -> ([每个桶的计数], sum, count)
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            idx = bisect_left(self.buckets, value)
+            if idx < len(self.buckets):
+                series[0][idx] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, n) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, c in zip(self.buckets, counts):
+                    cumulative += c
+                    le = _labels(self.labelnames, labels, f'le="{bound:g}"')
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, INF_LABEL)} {n}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {n}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str]) -> None:
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, v in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_value(v)}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram("report_request_seconds", "API request latency", ("route", "status"), STAGE_BUCKETS)
+STAGE_SECONDS = Histogram("report_stage_seconds", "Time spent per request stage", ("route", "stage"), STAGE_BUCKETS)
+ROWS_RETURNED = Histogram("report_rows_returned", "Rows returned per request", ("route",), ROW_BUCKETS)
+DOCS_SCANNED = Counter("report_docs_scanned_total", "Documents read from Mongo", ("route",))
+
+
+def observe_request(route: str, status: int, timer: RequestTimer, total: float) -> None:
+    REQUEST_SECONDS.observe(total, route, str(status))
+    for name, sec in timer.stages.items():
+        STAGE_SECONDS.observe(sec, route, name)
+    if "docs" in timer.counts:
+        DOCS_SCANNED.inc(timer.counts["docs"], route)
+    if "rows" in timer.counts:
+        ROWS_RETURNED.observe(timer.counts["rows"], route)
+
+
+def setup_request_log() -> None:
+    """每个请求一行 JSON 日志（REPORT_REQUEST_LOG=0 关闭）；未配置 handler 时输出到 stderr。"""
+    if os.getenv("REPORT_REQUEST_LOG", "1") != "1":
+        logger.disabled = True
+        return
+    logger.setLevel(logging.INFO)
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+        logger.addHandler(handler)
+        logger.propagate = False
+
+
+def log_request(method: str, route: str, status: int, timer: RequestTimer, total: float) -> None:
+    record = {
+        "event": "request",
+        "method": method,
+        "route": route,
+        "status": status,
+        "total_ms": round(total * 1000, 2),
+        "stages_ms": {k: round(v * 1000, 2) for k, v in timer.stages.items()},
+        **timer.counts,
+    }
+    logger.info("%s", json.dumps(record, ensure_ascii=False))
+
+
+def gauge_lines(name: str, help_text: str, values: Dict[str, Any]) -> List[str]:
+    """One gauge family from a flat stats dict (non-numeric values are skipped)."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    for key, v in values.items():
+        if isinstance(v, bool):
+            v = int(v)
+        if isinstance(v, (int, float)):
+            lines.append(f'{name}{{key="{_escape(key)}"}} {_value(v)}')
+    return lines
+
+
+def render(extra_gauges: Sequence[Tuple[str, str, Dict[str, Any]]] = ()) -> str:
+    lines: List[str] = []
+    for metric in (REQUEST_SECONDS, STAGE_SECONDS, ROWS_RETURNED, DOCS_SCANNED):
+        lines.extend(metric.render())
+    for name, help_text, values in extra_gauges:
+        lines.extend(gauge_lines(name, help_text, values))
+    return "\n".join(lines) + "\n"
+
+
+# ---- 采样分析 ----
+
+def profiling_enabled() -> bool:
+    return os.getenv("REPORT_PROFILE", "0") == "1"
+
+
+class Profile:
+    """pyinstrument（采样）优先，未安装时退回 cProfile。"""
+
+    def __init__(self) -> None:
+        try:
+            from pyinstrument import Profiler  # 可选依赖
+
+            self._impl: Any = Profiler(async_mode="enabled")
+            self.kind = "pyinstrument"
+        except ImportError:
+            import cProfile
+
+            self._impl = cProfile.Profile()
+            self.kind = "cprofile"
+
+    def start(self) -> None:
+        if self.kind == "pyinstrument":
+            self._impl.start()
+        else:
+            self._impl.enable()
+
+    def stop(self) -> None:
+        if self.kind == "pyinstrument":
+            self._impl.stop()
+        else:
+            self._impl.disable()
+
+    def save(self, route: str, total: float) -> Optional[str]:
+        if total * 1000 < float(os.getenv("REPORT_PROFILE_MIN_MS", "0")):
+            return None
+        out_dir = os.getenv("REPORT_PROFILE_DIR", "/tmp/ozon-report-profiles")
+        os.makedirs(out_dir, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{route.strip('/').replace('/', '_')}-{int(total * 1000)}ms.txt"
+        path = os.path.join(out_dir, name)
+        if self.kind == "pyinstrument":
+            text = self._impl.output_text(unicode=True)
+        else:
+            import pstats
+
+            buf = io.StringIO()
+            pstats.Stats(self._impl, stream=buf).sort_stats("cumulative").print_stats(60)
+            text = buf.getvalue()
+        with open(path, "w", encoding="utf-8") as fh:
+            fh.write(text)
+        return path
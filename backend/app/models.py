@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from datetime import date
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Union
 
 from pydantic import BaseModel, Field
 
@@ -32,6 +32,21 @@ class Summary12D(BaseModel):
     ad_sales_ratio: float = 0.0  # ad_sales_qty / sales_qty
 
 
+class RollingSummary(Summary12D):
+    # 以该日结束的滚动窗口（rolling=1 时返回）
+    date: Union[date, str]
+
+
+class CompareBlock(BaseModel):
+    # compare=prev|yoy：对比列、逐列变化量与变化率（对比值为 0 时变化率为空）；view=slim 时只有汇总部分
+    days: Optional[List[DayMetrics]] = None
+    delta: Optional[List[Dict[str, float]]] = None
+    pct: Optional[List[Dict[str, Optional[float]]]] = None
+    summary_12d: Summary12D
+    summary_delta: Dict[str, float]
+    summary_pct: Dict[str, Optional[float]]
+
+
 class ReportRow(BaseModel):
     category: Optional[str] = Field(None, description="类别")
     name_cn: Optional[str] = Field(None, description="中文名称")
@@ -40,7 +55,9 @@ class ReportRow(BaseModel):
     platform: Optional[str] = None
     account: Optional[str] = None
     summary_12d: Summary12D
-    days: List[DayMetrics]
+    days: Optional[List[DayMetrics]] = Field(None, description="view=slim 时省略，按需取 /api/report/product")
+    rolling: Optional[List[RollingSummary]] = None
+    compare: Optional[CompareBlock] = None
 
 
 class ReportResponse(BaseModel):
@@ -49,7 +66,52 @@ class ReportResponse(BaseModel):
     days_count: int
     page: int
     page_size: int
-    total: int
+    total: Optional[int] = None  # 游标分页且未要求 with_total 时为空
     rows: List[ReportRow]
     mode: str = "day"  # day | week
     period_labels: List[str] = []  # 周模式时：每列对应的“YYYY-MM-DD ~ YYYY-MM-DD”
+    next_cursor: Optional[str] = None  # 游标分页：下一页的 cursor，没有更多商品时为空
+    compare: Optional[str] = None  # prev | yoy
+    compare_start: Optional[date] = None
+    compare_end: Optional[date] = None
+    compare_periods: List[str] = []
+
+
+class InventoryRow(BaseModel):
+    # /api/inventory：最新一天的库存、窗口内日均销量、可售天数与预计断货日
+    category: Optional[str] = Field(None, description="类别")
+    name_cn: Optional[str] = Field(None, description="中文名称")
+    sku: Optional[str] = None
+    ozon_id: Optional[str] = Field(None, description="Ozon ID")
+    platform: Optional[str] = None
+    account: Optional[str] = None
+    inventory: int
+    inventory_date: date  # 库存取自的日期（最近一条记录）
+    sold: int  # 窗口内销量
+    velocity: float  # 日均销量
+    days_of_cover: Optional[float] = None  # 窗口内无销量时为空
+    sell_through: float  # 售罄率 = 销量 / (销量 + 库存)
+    stockout_date: Optional[date] = None
+    at_risk: bool
+
+
+class InventoryResponse(BaseModel):
+    as_of: date
+    window_start: date
+    window_days: int
+    cover_days: float
+    products: int  # 窗口内有记录的商品数
+    at_risk: int
+    rows: List[InventoryRow]
+
+
+class AccountTarget(BaseModel):
+    platform: Optional[str] = None
+    account: Optional[str] = None
+
+
+class BatchReportRequest(BaseModel):
+    # targets 为空且 all_accounts=True 时取日期范围内出现过的全部（平台, 账号）
+    targets: List[AccountTarget] = []
+    all_accounts: bool = False
+    platform: Optional[str] = Field(None, description="all_accounts 时限定平台")
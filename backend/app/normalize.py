@@ -0,0 +1,305 @@
+"""Canonical document shape for operation_report.
+
+Raw spreadsheet imports use Chinese column names, several spellings of the
+same metric, comma-formatted numbers and mixed date representations. This
+module maps a raw document onto one canonical record::
+
+    {ozon_id, name_cn, category, sku, platform, account,   # identity (str)
+     day,                                                  # BSON Date (00:00)
+     total_sales_qty, ad_sales_qty, natural_sales_qty,     # int
+     avg_price, sales_amount, goods_cost, sales_cost,      # float
+     ad_spend, payout,                                     # float
+     inventory}                                            # int
+
+Raw column aliases are declared in :mod:`app.schema`.
+
+Canonical records live in their own collection (``MONGODB_DAILY_COLL``) and are
+written by :func:`backfill` (CLI) or :func:`app.importer.import_rows` (on write,
+``/api/ingest`` and ``/api/import``).
+
+    python -m app.normalize backfill [--since YYYY-MM-DD] [--batch 1000]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import re
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from .dates import to_day
+from .db import get_collection, get_daily_collection
+from .schema import FLOAT_METRICS, INT_METRICS, KEY_FIELDS, METRIC_FIELDS, RAW_DATE_FIELDS, RAW_FIELD_MAP, resolve
+from .utils import parse_any_date
+
+
+# 原始集合投影（保留 _id 作为 source_id）；规范化/预聚合集合只取规范字段
+RAW_PROJECTION: Dict[str, int] = {f: 1 for aliases in RAW_FIELD_MAP.values() for f in aliases}
+DAILY_PROJECTION: Dict[str, int] = {"_id": 0, "day": 1, **{f: 1 for f in KEY_FIELDS + METRIC_FIELDS}}
+
+
+def safe_float(v: Any) -> float:
+    try:
+        if v is None:
+            return 0.0
+        if isinstance(v, (int, float)):
+            return float(v)
+        return float(str(v).replace(",", ""))
+    except Exception:  # noqa: BLE001
+        return 0.0
+
+
+def safe_int(v: Any) -> int:
+    try:
+        if v is None:
+            return 0
+        if isinstance(v, (int,)):
+            return int(v)
+        return int(float(str(v).replace(",", "")))
+    except Exception:  # noqa: BLE001
+        return 0
+
+
+def _text(v: Any) -> str:
+    return "" if v is None else str(v).strip()
+
+
+def norm_label(v: Any) -> str:
+    """平台/账号：去空白并转小写，便于精确匹配与索引。"""
+    return _text(v).lower()
+
+
+def _metrics(r: Dict[str, Any]) -> Dict[str, Any]:
+    """Canonical metrics from a resolved document (see app.schema.resolve)."""
+    total_sales_qty = safe_int(r["total_sales_qty"])
+    tpl_qty = safe_int(r["tpl_sales_qty"])
+    search_qty = safe_int(r["search_sales_qty"])
+    nat_qty_field = r["natural_sales_qty"]
+    natural_qty = safe_int(nat_qty_field) if nat_qty_field is not None else max(total_sales_qty - tpl_qty - search_qty, 0)
+    return {
+        "total_sales_qty": total_sales_qty,
+        "ad_sales_qty": tpl_qty + search_qty,
+        "natural_sales_qty": natural_qty,
+        "avg_price": safe_float(r["avg_price"]),
+        "sales_amount": safe_float(r["sales_amount"]),
+        "goods_cost": safe_float(r["goods_cost"]),
+        "sales_cost": safe_float(r["sales_cost"]),
+        "ad_spend": safe_float(r["tpl_spend"]) + safe_float(r["search_spend"]),
+        "payout": safe_float(r["payout"]),
+        "inventory": safe_int(r["inventory"]),
+    }
+
+
+def normalize_doc(doc: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Map a raw operation_report document to the canonical record (None if undated)."""
+    r = resolve(doc)
+    d = to_day(r["day"])
+    if d is None:
+        return None
+    rec: Dict[str, Any] = {
+        "ozon_id": _text(r["ozon_id"]),
+        "name_cn": _text(r["name_cn"]),
+        "category": _text(r["category"]),
+        "sku": _text(r["sku"]),
+        "platform": norm_label(r["platform"]),
+        "account": norm_label(r["account"]),
+        "day": datetime.combine(d, datetime.min.time()),
+    }
+    rec.update(_metrics(r))
+    if "_id" in doc:
+        rec["source_id"] = doc["_id"]
+    return rec
+
+
+def date_strings(start_d: date, end_d: date) -> List[str]:
+    # 日期字段兼容：字符串日期的各种写法
+    def _fmt_v(d: date) -> List[str]:
+        y = d.year
+        m = d.month
+        dd = d.day
+        return [
+            f"{y}/{m}/{dd}",
+            f"{y}/{m:02d}/{dd:02d}",
+            f"{y}-{m:02d}-{dd:02d}",
+            f"{y}-{m}-{dd}",
+        ]
+
+    str_dates: List[str] = []
+    cur = start_d
+    while cur <= end_d:
+        str_dates.extend(_fmt_v(cur))
+        cur = cur + timedelta(days=1)
+    return list(sorted(set(str_dates)))
+
+
+def raw_filter(
+    start_d: date,
+    end_d: date,
+    platform: Optional[str],
+    account: Optional[str],
+) -> Dict[str, Any]:
+    """Report query on the raw collection: every date spelling, regex platform/account."""
+    # 组合为 AND，内部有 OR 子条件
+    and_filters: List[Dict[str, Any]] = []
+    # 日期字段兼容：同时支持 Date 类型范围过滤与字符串精确匹配
+    str_dates = date_strings(start_d, end_d)
+
+    # Date 类型范围：包含 end_d 当天，采用 [start, end+1) 的半开区间更稳妥
+    start_dt = datetime.combine(start_d, datetime.min.time())
+    end_dt_next = datetime.combine(end_d, datetime.min.time()) + timedelta(days=1)
+
+    date_or: List[Dict[str, Any]] = []
+    for f in RAW_DATE_FIELDS:
+        date_or.append({f: {"$gte": start_dt, "$lt": end_dt_next}})
+        date_or.append({f: {"$in": str_dates}})
+    if date_or:
+        and_filters.append({"$or": date_or})
+
+    if platform:
+        plat_regex = re.compile(rf"^\s*{re.escape(platform)}\s*$", re.IGNORECASE)
+        and_filters.append({"$or": [{"平台": plat_regex}, {"platform": plat_regex}]})
+    if account:
+        acc_regex = re.compile(rf"^\s*{re.escape(account)}\s*$", re.IGNORECASE)
+        and_filters.append({"$or": [{"账号": acc_regex}, {"account": acc_regex}]})
+
+    return {"$and": and_filters} if and_filters else {}
+
+
+def daily_filter(
+    start_d: date,
+    end_d: date,
+    platform: Optional[str],
+    account: Optional[str],
+) -> Dict[str, Any]:
+    """Report query on the daily collection: one range on ``day`` plus exact platform/account."""
+    start_dt = datetime.combine(start_d, datetime.min.time())
+    end_dt_next = datetime.combine(end_d, datetime.min.time()) + timedelta(days=1)
+    flt: Dict[str, Any] = {}
+    # 平台/账号已在写入时规范化，这里做相同处理后精确匹配，可直接走索引
+    if platform:
+        flt["platform"] = norm_label(platform)
+    if account:
+        flt["account"] = norm_label(account)
+    flt["day"] = {"$gte": start_dt, "$lt": end_dt_next}
+    return flt
+
+
+# 商品过滤字段：(规范化字段, 原始字段)
+_PRODUCT_FIELDS: Dict[str, Tuple[str, str]] = {
+    "category": ("category", "类别"),
+    "name_cn": ("name_cn", "中文名称"),
+    "sku": ("sku", "SKU"),
+    "ozon_id": ("ozon_id", "Ozon ID"),
+}
+
+
+def product_filter(category: Optional[str], q: Optional[str], daily: bool) -> Dict[str, Any]:
+    """Product narrowing for either source: exact category, substring of name/SKU/Ozon ID.
+
+    Both are case-insensitive. Returns ``{}`` when neither is given.
+    """
+    col = 0 if daily else 1
+    clauses: List[Dict[str, Any]] = []
+    if category and category.strip():
+        cat_regex = re.compile(rf"^\s*{re.escape(category.strip())}\s*$", re.IGNORECASE)
+        clauses.append({_PRODUCT_FIELDS["category"][col]: cat_regex})
+    if q and q.strip():
+        q_regex = re.compile(re.escape(q.strip()), re.IGNORECASE)
+        clauses.append({"$or": [{_PRODUCT_FIELDS[f][col]: q_regex} for f in ("name_cn", "sku", "ozon_id")]})
+    if not clauses:
+        return {}
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def upsert_op(rec: Dict[str, Any], now: Optional[datetime] = None) -> UpdateOne:
+    """Upsert keyed on (product key, day): re-importing the same row is idempotent."""
+    flt = {k: rec[k] for k in KEY_FIELDS}
+    flt["day"] = rec["day"]
+    body = {k: v for k, v in rec.items() if k not in flt}
+    body["updated_at"] = now or datetime.now(timezone.utc)
+    return UpdateOne(flt, {"$set": body}, upsert=True)
+
+
+async def upsert_records(records: Iterable[Dict[str, Any]], batch_size: int = 1000) -> int:
+    coll = get_daily_collection()
+    written = 0
+    buf: List[Dict[str, Any]] = []
+
+    async def flush() -> None:
+        nonlocal written
+        # updated_at 按每次 bulk_write 取时间，尽量贴近提交时刻（预聚合水位线依赖它）
+        now = datetime.now(timezone.utc)
+        await coll.bulk_write([upsert_op(rec, now) for rec in buf], ordered=False)
+        written += len(buf)
+        buf.clear()
+
+    for rec in records:
+        buf.append(rec)
+        if len(buf) >= batch_size:
+            await flush()
+    if buf:
+        await flush()
+    return written
+
+
+def changed_ranges(records: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """(platform, account) -> written day ranges (one per run of consecutive days), for cache/rollup invalidation."""
+    days: Dict[Tuple[str, str], Set[date]] = {}
+    for rec in records:
+        days.setdefault((rec["platform"], rec["account"]), set()).add(rec["day"].date())
+    ranges: List[Dict[str, Any]] = []
+    for (p, a), ds in sorted(days.items()):
+        run: List[date] = []
+        for d in sorted(ds):
+            if run and d - run[-1] > timedelta(days=1):
+                ranges.append({"platform": p, "account": a, "start": run[0], "end": run[-1]})
+                run = []
+            run.append(d)
+        ranges.append({"platform": p, "account": a, "start": run[0], "end": run[-1]})
+    return ranges
+
+
+async def backfill(since: Optional[date] = None, batch_size: int = 1000) -> Dict[str, int]:
+    """Normalize raw documents (optionally only those inserted since a date) into the daily collection."""
+    raw = get_collection()
+    flt: Dict[str, Any] = {}
+    if since is not None:
+        since_dt = datetime.combine(since, datetime.min.time(), tzinfo=timezone.utc)
+        flt["_id"] = {"$gte": ObjectId.from_datetime(since_dt)}
+    scanned = 0
+    skipped = 0
+    buf: List[Dict[str, Any]] = []
+    written = 0
+    async for doc in raw.find(flt, RAW_PROJECTION):
+        scanned += 1
+        rec = normalize_doc(doc)
+        if rec is None:
+            skipped += 1
+            continue
+        buf.append(rec)
+        if len(buf) >= batch_size:
+            written += await upsert_records(buf, batch_size)
+            buf = []
+    if buf:
+        written += await upsert_records(buf, batch_size)
+    return {"scanned": scanned, "written": written, "skipped": skipped}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.normalize")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_backfill = sub.add_parser("backfill", help="回填规范化日数据集合")
+    p_backfill.add_argument("--since", help="只处理该日期之后写入的原始文档，YYYY-MM-DD")
+    p_backfill.add_argument("--batch", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    if args.cmd == "backfill":
+        since = parse_any_date(args.since) if args.since else None
+        print(asyncio.run(backfill(since, args.batch)))
+
+
+if __name__ == "__main__":
+    main()
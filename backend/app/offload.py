@@ -0,0 +1,150 @@
+"""Run CPU-heavy report stages off the event loop.
+
+Grouping/normalizing and building rows for a large report is pure Python
+and NumPy work; done inline it blocks every other request on the worker
+(including ``/api/health``) for its whole duration. With offloading enabled,
+requests of at least ``REPORT_OFFLOAD_MIN_RECORDS`` records run those stages
+in a pool:
+
+- ``thread``: the normal builders in a thread pool. The loop keeps serving
+  other requests; the work itself still shares the GIL.
+- ``process``: the records are packed into compact arrays
+  (:func:`app.columnar.pack_records`: int32 ids/days, one float64 block for
+  the metrics), partitioned by product-key hash and built by the columnar
+  kernel in a process pool, one partition per worker, so a large report uses
+  several cores. The columnar kernel matches the Python builder value for
+  value, so the rows are the same whichever engine was requested.
+  Normalizing raw documents stays in a thread (pickling the raw dicts would
+  cost more than it saves), as do packing and partitioning. The workers are
+  spawned at application startup (:func:`start`).
+
+Environment: ``REPORT_OFFLOAD`` (``none`` | ``thread`` | ``process``, default
+``none``), ``REPORT_OFFLOAD_WORKERS`` (default: CPU count),
+``REPORT_OFFLOAD_MIN_RECORDS`` (default 20000; also the records per
+partition).
+"""
+from __future__ import annotations
+
+import asyncio
+import math
+import multiprocessing
+import os
+import zlib
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .columnar import pack_records, rows_from_arrays
+from .periods import PeriodSpec
+
+
+OFFLOAD_MODES = ("none", "thread", "process")
+
+_pools: Dict[str, Executor] = {}
+
+
+def offload_mode() -> str:
+    mode = os.getenv("REPORT_OFFLOAD", "none").strip().lower()
+    return mode if mode in OFFLOAD_MODES else "none"
+
+
+def offload_workers() -> int:
+    return max(1, int(os.getenv("REPORT_OFFLOAD_WORKERS", str(os.cpu_count() or 1))))
+
+
+def offload_min_records() -> int:
+    return max(1, int(os.getenv("REPORT_OFFLOAD_MIN_RECORDS", "20000")))
+
+
+def should_offload(n_records: int) -> bool:
+    return offload_mode() != "none" and n_records >= offload_min_records()
+
+
+def _pool(kind: str) -> Executor:
+    pool = _pools.get(kind)
+    if pool is None:
+        if kind == "process":
+            # spawn：不继承父进程的事件循环与 Mongo 连接线程
+            pool = ProcessPoolExecutor(offload_workers(), mp_context=multiprocessing.get_context("spawn"))
+        else:
+            pool = ThreadPoolExecutor(offload_workers(), thread_name_prefix="report-offload")
+        _pools[kind] = pool
+    return pool
+
+
+def _ready() -> None:
+    """No-op run once per worker at startup: spawns the process and imports this module."""
+
+
+async def start() -> None:
+    """进程模式下启动时创建进程池并拉起全部子进程，首个大报表不必等待 spawn 与导入。"""
+    if offload_mode() != "process":
+        return
+    loop = asyncio.get_running_loop()
+    pool = _pool("process")
+    await asyncio.gather(*(loop.run_in_executor(pool, _ready) for _ in range(offload_workers())))
+
+
+def shutdown() -> None:
+    """关闭已创建的线程池/进程池（应用退出时调用）。"""
+    for pool in _pools.values():
+        pool.shutdown(wait=False, cancel_futures=True)
+    _pools.clear()
+
+
+async def run_in_thread(fn: Callable[..., Any], *args: Any) -> Any:
+    return await asyncio.get_running_loop().run_in_executor(_pool("thread"), partial(fn, *args))
+
+
+def partition_of(key: tuple, parts: int) -> int:
+    # crc32 与进程无关（内置 hash 按进程加盐），同一商品总落在同一分区
+    return zlib.crc32("\x1f".join(key).encode()) % parts
+
+
+def _partitions(keys: Sequence[tuple], n_records: int) -> List[np.ndarray]:
+    """Group indexes per partition, for ``ceil(records / min_records)`` partitions (at most one per worker)."""
+    parts = max(1, min(offload_workers(), math.ceil(n_records / offload_min_records()), len(keys)))
+    owner = np.fromiter((partition_of(k, parts) for k in keys), dtype=np.int32, count=len(keys))
+    return [idx for idx in (np.flatnonzero(owner == p) for p in range(parts)) if len(idx)]
+
+
+def _pack_partitions(
+    groups: Sequence[Tuple[tuple, List[Dict[str, Any]]]],
+    keys: Sequence[tuple],
+) -> List[Tuple[np.ndarray, List[tuple], np.ndarray, np.ndarray, np.ndarray]]:
+    """Packed arrays sliced per partition: (group indexes, keys, gid renumbered 0..k-1, day_ord, values)."""
+    gid, day_ord, values = pack_records(groups)
+    parts = []
+    for idx in _partitions(keys, len(gid)):
+        # 分区内的商品重新编号为 0..k-1，只把该分区的记录切片传给子进程
+        remap = np.full(len(keys), -1, dtype=np.int32)
+        remap[idx] = np.arange(len(idx), dtype=np.int32)
+        mask = remap[gid] >= 0
+        parts.append((idx, [keys[i] for i in idx], remap[gid[mask]], day_ord[mask], values[:, mask]))
+    return parts
+
+
+async def build_rows_in_processes(
+    spec: PeriodSpec,
+    groups: Sequence[Tuple[tuple, List[Dict[str, Any]]]],
+    cmp: Optional[PeriodSpec] = None,
+) -> List[Dict[str, Any]]:
+    """Rows for ``groups`` (in the same order), built by the columnar kernel in the process pool."""
+    if not groups:
+        return []
+    keys = [key for key, _records in groups]
+    # 打包与分区切片都是整份记录上的 O(n) 数组操作，一并放进线程，不占事件循环
+    parts = await run_in_thread(_pack_partitions, groups, keys)
+    loop = asyncio.get_running_loop()
+    pool = _pool("process")
+    futures = [
+        loop.run_in_executor(pool, rows_from_arrays, spec, part_keys, part_gid, part_day, part_values, cmp)
+        for _idx, part_keys, part_gid, part_day, part_values in parts
+    ]
+    rows: List[Any] = [None] * len(keys)
+    for part, part_rows in zip(parts, await asyncio.gather(*futures)):
+        for i, row in zip(part[0].tolist(), part_rows):
+            rows[i] = row
+    return rows
@@ -0,0 +1,147 @@
+"""Period bucketing shared by every report mode.
+
+A :class:`PeriodSpec` is the ordered list of report columns (buckets) for a
+mode. ``index_of`` maps a date to its column in O(1) through a lookup table
+indexed by day offset from the first bucket, so the row builders never scan
+the bucket list. Adding a granularity means adding a constructor here; the
+aggregation path stays the same.
+"""
+from __future__ import annotations
+
+import os
+from datetime import date, timedelta
+from typing import Any, List, Optional, Sequence, Tuple
+
+from .utils import build_months, build_quarters, build_weeks, build_windows, date_range, month_start
+
+
+# (起, 止, 单元格 date 字段)
+Bucket = Tuple[date, date, Any]
+
+# 日模式汇总窗口（天）默认值，可由 REPORT_SUMMARY_DAYS 或 summary_days 参数覆盖
+SUMMARY_DAYS = 12
+
+
+class PeriodSpec:
+    def __init__(
+        self,
+        granularity: str,
+        buckets: Sequence[Bucket],
+        period_labels: Sequence[str],
+        cumulative: bool,
+        summary_start: Optional[date] = None,
+        summary_days: Optional[int] = None,
+    ) -> None:
+        """``cumulative`` False: one record per cell, values assigned (day columns).
+        True: records are summed into the cell. The summary covers buckets
+        starting on or after ``summary_start`` (default: all); ``summary_days``
+        is that window's length for day columns (None for other modes).
+        """
+        self.granularity = granularity
+        self.buckets: List[Bucket] = list(buckets)
+        self.period_labels: List[str] = list(period_labels)
+        self.cumulative = cumulative
+        self.start: date = self.buckets[0][0]
+        self.end: date = self.buckets[-1][1]
+        start = summary_start or self.start
+        self.summary_days = summary_days
+        self.summary_from = next((i for i, b in enumerate(self.buckets) if b[0] >= start), len(self.buckets))
+        self.span = (self.end - self.start).days + 1
+        lookup = [-1] * self.span
+        for idx, (s, e, _label) in enumerate(self.buckets):
+            for off in range((s - self.start).days, (e - self.start).days + 1):
+                lookup[off] = idx
+        self.lookup = lookup
+
+    def __len__(self) -> int:
+        return len(self.buckets)
+
+    def index_of(self, d: date) -> Optional[int]:
+        off = (d - self.start).days
+        if 0 <= off < self.span:
+            idx = self.lookup[off]
+            return idx if idx >= 0 else None
+        return None
+
+    @classmethod
+    def days(cls, start: date, end: date, summary_days: int = SUMMARY_DAYS) -> "PeriodSpec":
+        return cls(
+            "day",
+            [(d, d, d) for d in date_range(start, end)],
+            [],
+            cumulative=False,
+            summary_start=end - timedelta(days=summary_days - 1),
+            summary_days=summary_days,
+        )
+
+    @classmethod
+    def weeks(cls, end: date, n: int) -> "PeriodSpec":
+        week_ranges = build_weeks(end, n)  # oldest -> latest
+        return cls(
+            "week",
+            [(s, e, f"{s} ~ {e}") for (s, e) in week_ranges],
+            [f"{s} ~ {e}" for (s, e) in week_ranges],
+            cumulative=True,
+        )
+
+    @classmethod
+    def months(cls, end: date, n: int) -> "PeriodSpec":
+        month_ranges = build_months(end, n)  # [(s, e, ym)]
+        return cls(
+            "month",
+            [(s, e, f"{ym}\n{s} ~ {e}") for (s, e, ym) in month_ranges],
+            [f"{ym}（{s} ~ {e}）" for (s, e, ym) in month_ranges],
+            cumulative=True,
+        )
+
+    @classmethod
+    def quarters(cls, end: date, n: int) -> "PeriodSpec":
+        quarter_ranges = build_quarters(end, n)  # [(s, e, 'YYYY-Qk')]
+        return cls(
+            "quarter",
+            [(s, e, f"{q}\n{s} ~ {e}") for (s, e, q) in quarter_ranges],
+            [f"{q}（{s} ~ {e}）" for (s, e, q) in quarter_ranges],
+            cumulative=True,
+        )
+
+    @classmethod
+    def windows(cls, end: date, n: int, size: int) -> "PeriodSpec":
+        window_ranges = build_windows(end, n, size)
+        return cls(
+            "window",
+            [(s, e, f"{s} ~ {e}") for (s, e) in window_ranges],
+            [f"{s} ~ {e}" for (s, e) in window_ranges],
+            cumulative=True,
+        )
+
+
+def build_spec(
+    end_d: date,
+    mode: str,
+    days: Optional[int] = None,
+    weeks: Optional[int] = None,
+    months: Optional[int] = None,
+    quarters: Optional[int] = None,
+    windows: Optional[int] = None,
+    window_days: Optional[int] = None,
+    summary_days: Optional[int] = None,
+) -> PeriodSpec:
+    """按模式构造列定义；day 模式默认从当月 1 号到 end_d，汇总取最后 summary_days 天。"""
+    if mode == "week":
+        return PeriodSpec.weeks(end_d, int(weeks or 12))
+    if mode == "month":
+        return PeriodSpec.months(end_d, int(months or 12))
+    if mode == "quarter":
+        return PeriodSpec.quarters(end_d, int(quarters or 4))
+    if mode == "window":
+        return PeriodSpec.windows(end_d, int(windows or 12), int(window_days or 7))
+    if days is not None:
+        days = max(1, min(62, int(days)))
+        start_d = end_d - timedelta(days=days - 1)
+    else:
+        start_d = month_start(end_d)
+    return PeriodSpec.days(start_d, end_d, int(summary_days or default_summary_days()))
+
+
+def default_summary_days() -> int:
+    return max(1, int(os.getenv("REPORT_SUMMARY_DAYS", str(SUMMARY_DAYS))))
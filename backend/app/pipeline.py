@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .normalize import norm_label
+
+
+# 商品分组键：(输出别名, Mongo 字段)，顺序与 main._row_key 一致
+RAW_KEY_FIELDS: Tuple[Tuple[str, str], ...] = (
+    ("ozon_id", "Ozon ID"),
+    ("name_cn", "中文名称"),
+    ("category", "类别"),
+    ("sku", "SKU"),
+    ("platform", "平台"),
+    ("account", "账号"),
+)
+
+# 规范化日数据集合（app.normalize）中的同名字段
+DAILY_KEY_FIELDS: Tuple[Tuple[str, str], ...] = tuple((alias, alias) for alias, _field in RAW_KEY_FIELDS)
+
+# 规范化集合中写入时经 norm_label 处理的键字段
+LABEL_FIELDS: Tuple[str, ...] = ("platform", "account")
+
+
+def group_id_expr(key_fields: Sequence[Tuple[str, str]] = RAW_KEY_FIELDS) -> Dict[str, Any]:
+    """$group _id expression mirroring ``str(doc.get(field, ""))`` in Python."""
+    return {alias: {"$toString": {"$ifNull": [f"${field}", ""]}} for alias, field in key_fields}
+
+
+def doc_group_key(doc: Dict[str, Any], key_fields: Sequence[Tuple[str, str]] = RAW_KEY_FIELDS) -> tuple:
+    """Python-side equivalent of :func:`group_id_expr` for streamed documents."""
+    return tuple("" if doc.get(field) is None else str(doc.get(field)) for _alias, field in key_fields)
+
+
+def key_sort(key_fields: Sequence[Tuple[str, str]] = RAW_KEY_FIELDS) -> List[Tuple[str, int]]:
+    return [(field, 1) for _alias, field in key_fields]
+
+
+def group_sort_stage(key_fields: Sequence[Tuple[str, str]] = RAW_KEY_FIELDS) -> Dict[str, Any]:
+    return {"$sort": {f"_id.{alias}": 1 for alias, _field in key_fields}}
+
+
+def grouped_pipeline(
+    match: Dict[str, Any],
+    key_fields: Sequence[Tuple[str, str]] = RAW_KEY_FIELDS,
+    projection: Optional[Dict[str, int]] = None,
+) -> List[Dict[str, Any]]:
+    """All groups, sorted by key, one result document per product.
+
+    ``projection`` is applied before ``$group`` so the pushed documents carry
+    only the fields the report reads.
+    """
+    stages: List[Dict[str, Any]] = [{"$match": match}]
+    if projection:
+        stages.append({"$project": projection})
+    return stages + [
+        {"$group": {"_id": group_id_expr(key_fields), "docs": {"$push": "$$ROOT"}}},
+        group_sort_stage(key_fields),
+    ]
+
+
+def keyed_stream_pipeline(
+    match: Dict[str, Any],
+    key_fields: Sequence[Tuple[str, str]] = RAW_KEY_FIELDS,
+    projection: Optional[Dict[str, int]] = None,
+) -> List[Dict[str, Any]]:
+    """Matching documents sorted by the same stringified key as :func:`grouped_pipeline`.
+
+    Each document carries the key as ``_key`` ({alias: str}); documents of one
+    product are adjacent even when a key field is stored with mixed types
+    (``123`` and ``"123"``), which a sort on the raw fields would split.
+    """
+    return [
+        {"$match": match},
+        {"$project": {**(projection or {}), "_key": group_id_expr(key_fields)}},
+        {"$sort": {f"_key.{alias}": 1 for alias, _field in key_fields}},
+    ]
+
+
+def grouped_page_pipeline(
+    match: Dict[str, Any],
+    page: int,
+    page_size: int,
+    key_fields: Sequence[Tuple[str, str]] = RAW_KEY_FIELDS,
+    projection: Optional[Dict[str, int]] = None,
+) -> List[Dict[str, Any]]:
+    """Group matching documents by product key and return one page plus the total.
+
+    The pipeline yields a single document ``{"total": [{"n": int}], "rows": [...]}``
+    where each row is ``{"_id": {alias: str}, "docs": [raw docs]}``. Groups are
+    sorted by key so that skip/limit pagination is stable between requests.
+    """
+    skip = max(page - 1, 0) * page_size
+    return grouped_pipeline(match, key_fields, projection) + [
+        {
+            "$facet": {
+                "total": [{"$count": "n"}],
+                "rows": [{"$skip": skip}, {"$limit": page_size}],
+            }
+        },
+    ]
+
+
+def group_key(group_id: Dict[str, Any], key_fields: Sequence[Tuple[str, str]] = RAW_KEY_FIELDS) -> tuple:
+    return tuple(str(group_id.get(alias, "")) for alias, _field in key_fields)
+
+
+_NUMBER = re.compile(r"^-?\d+(\.\d+)?$")
+
+
+def _loose_values(v: str) -> List[Any]:
+    # 原始列可能存成数字（如 Ozon ID），分组键是其字符串形式
+    values: List[Any] = [v]
+    if not _NUMBER.match(v):
+        return values
+    num = float(v)
+    if num.is_integer():
+        values.append(int(num))
+    values.append(num)
+    return values
+
+
+def key_filter(
+    key: Sequence[str],
+    key_fields: Sequence[Tuple[str, str]] = RAW_KEY_FIELDS,
+    loose: bool = False,
+    normalized: bool = False,
+) -> Dict[str, Any]:
+    """Equality match on one product key (inverse of :func:`group_id_expr`).
+
+    An empty component matches a missing, null or empty field. ``loose`` also
+    accepts numeric values whose string form equals the component (raw imports).
+    ``normalized`` applies :func:`app.normalize.norm_label` to platform and
+    account, which the daily collection stores normalized (as ``daily_filter``).
+    """
+    flt: Dict[str, Any] = {}
+    for (alias, field), v in zip(key_fields, key):
+        if normalized and alias in LABEL_FIELDS:
+            v = norm_label(v)
+        if v == "":
+            flt[field] = {"$in": [None, ""]}
+        elif loose:
+            values = _loose_values(v)
+            flt[field] = values[0] if len(values) == 1 else {"$in": values}
+        else:
+            flt[field] = v
+    return flt
+
+
+def keyset_filter(after: Sequence[str], paths: Sequence[str]) -> Dict[str, Any]:
+    """Match keys strictly after ``after`` in lexicographic order over ``paths``.
+
+    ``(a, b, c) > (x, y, z)`` expands to ``a > x or (a = x and b > y) or ...``.
+    """
+    branches: List[Dict[str, Any]] = []
+    for i, path in enumerate(paths):
+        branch: Dict[str, Any] = {p: v for p, v in zip(paths[:i], after[:i])}
+        branch[path] = {"$gt": after[i]}
+        branches.append(branch)
+    return {"$or": branches}
+
+
+def grouped_after_pipeline(
+    match: Dict[str, Any],
+    after: Optional[Sequence[str]],
+    limit: int,
+    key_fields: Sequence[Tuple[str, str]] = RAW_KEY_FIELDS,
+    projection: Optional[Dict[str, int]] = None,
+) -> List[Dict[str, Any]]:
+    """Keyset page: the first ``limit`` groups whose key sorts after ``after``.
+
+    The key comparison runs on the grouped (stringified) ``_id``, so it is
+    exact even when raw key fields mix numbers and strings.
+    """
+    stages = grouped_pipeline(match, key_fields, projection)
+    if after is not None:
+        stages.insert(-1, {"$match": keyset_filter(after, [f"_id.{alias}" for alias, _field in key_fields])})
+    return stages + [{"$limit": limit}]
+
+
+def group_count_pipeline(
+    match: Dict[str, Any],
+    key_fields: Sequence[Tuple[str, str]] = RAW_KEY_FIELDS,
+) -> List[Dict[str, Any]]:
+    """Number of distinct product keys; groups carry no documents."""
+    return [{"$match": match}, {"$group": {"_id": group_id_expr(key_fields)}}, {"$count": "n"}]
+
+
+# 游标：base64url(JSON)，含最后一个商品键与查询指纹；对客户端不透明
+def cursor_scope(**params: Any) -> str:
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+
+def encode_cursor(key: Sequence[str], scope: str) -> str:
+    raw = json.dumps({"k": list(key), "s": scope}, ensure_ascii=False, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str, scope: str, size: int) -> tuple:
+    """Key encoded in ``token``; ValueError if malformed or issued for another query."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        key = tuple(str(v) for v in data["k"])
+        token_scope = data["s"]
+    except (ValueError, TypeError, KeyError) as exc:
+        raise ValueError("malformed cursor") from exc
+    if len(key) != size or token_scope != scope:
+        raise ValueError("cursor does not belong to this query")
+    return key
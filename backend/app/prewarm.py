@@ -0,0 +1,170 @@
+"""Background pre-warming of the default ("today") reports.
+
+Operators open the same few views every morning -- the current month for
+``platform=ozon``, per account -- and would all hit the same cold scan at
+once. :class:`PrewarmScheduler` is an asyncio task started from the app
+lifespan that computes those reports into the report cache:
+
+- at startup,
+- after each data load (``/api/ingest``, ``/api/import`` or ``POST /api/prewarm``), debounced
+  by ``REPORT_PREWARM_DELAY`` seconds so a burst of loads warms once,
+- every ``REPORT_PREWARM_INTERVAL`` seconds (default half the cache TTL), so
+  warmed entries are refreshed before they expire and the date rolls over.
+
+Targets come from ``REPORT_PREWARM_TARGETS``: comma-separated
+``platform/account/mode`` items, where ``mode`` is ``day``, ``week``,
+``month`` or ``quarter`` with an optional ``:N`` column count (``day:12`` is
+the frontend's default 12-day view, plain ``day`` the current month). An
+empty account is the all-accounts report and ``*`` expands to one report per
+account seen in the range. Example: ``ozon//day:12,ozon/*/day:12,ozon/*/week``.
+Pre-warming needs the report cache (``REPORT_CACHE_TTL`` > 0).
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+PREWARM_MODES = ("day", "week", "month", "quarter")
+EACH_ACCOUNT = "*"
+
+# (platform, account, mode, 列数)；platform/account 为 None 表示不限
+Target = Tuple[Optional[str], Optional[str], str, Optional[int]]
+
+
+def parse_targets(spec: str) -> List[Target]:
+    """``platform/account/mode[:N]`` items, comma-separated; raises ValueError on a bad item."""
+    targets: List[Target] = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        parts = item.split("/")
+        if len(parts) != 3:
+            raise ValueError(f"prewarm target must be platform/account/mode: {item!r}")
+        platform, account, mode = (p.strip() for p in parts)
+        n: Optional[int] = None
+        if ":" in mode:
+            mode, _sep, count = mode.partition(":")
+            n = int(count)
+            if n < 1:
+                raise ValueError(f"prewarm column count must be positive: {item!r}")
+        if mode not in PREWARM_MODES:
+            raise ValueError(f"prewarm mode must be one of {', '.join(PREWARM_MODES)}: {item!r}")
+        targets.append((platform or None, account or None, mode, n))
+    return targets
+
+
+def prewarm_targets() -> List[Target]:
+    return parse_targets(os.getenv("REPORT_PREWARM_TARGETS", ""))
+
+
+def prewarm_interval(cache_ttl: float) -> float:
+    default = cache_ttl / 2 if cache_ttl > 0 else 0
+    return max(0.0, float(os.getenv("REPORT_PREWARM_INTERVAL", str(default))))
+
+
+def prewarm_delay() -> float:
+    return max(0.0, float(os.getenv("REPORT_PREWARM_DELAY", "5")))
+
+
+class PrewarmScheduler:
+    """Runs ``warm(target)`` for every target on start, on :meth:`notify` and periodically.
+
+    ``warm`` returns the number of reports it computed; failures of one target
+    are logged and do not stop the others.
+    """
+
+    def __init__(
+        self,
+        warm: Callable[[Target], Awaitable[int]],
+        targets: Sequence[Target],
+        interval: float = 0,
+        delay: float = 0,
+    ) -> None:
+        self.warm = warm
+        self.targets = list(targets)
+        self.interval = interval
+        self.delay = delay
+        self._event: Optional[asyncio.Event] = None
+        self._task: Optional["asyncio.Task[None]"] = None
+        self.runs = 0
+        self.reports = 0
+        self.failures = 0
+        self.last_run_ms = 0.0
+        self.last_run_at: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.running or not self.targets:
+            return
+        # 事件在运行中的事件循环里创建（测试等场景会多次启停）
+        self._event = asyncio.Event()
+        self._event.set()  # 启动后先预热一次
+        self._task = asyncio.create_task(self._loop(), name="report-prewarm")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def notify(self) -> None:
+        """数据写入后调用：防抖 ``delay`` 秒后重新预热。"""
+        if self._event is not None:
+            self._event.set()
+
+    async def _loop(self) -> None:
+        assert self._event is not None
+        while True:
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout=self.interval or None)
+            except asyncio.TimeoutError:
+                pass
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            # 防抖期间的多次写入合并为一轮
+            self._event.clear()
+            await self.run_once()
+
+    async def run_once(self) -> int:
+        started = time.perf_counter()
+        warmed = 0
+        for target in self.targets:
+            try:
+                warmed += await self.warm(target)
+            except asyncio.CancelledError:
+                raise
+            except Exception:  # 单个目标失败不影响其他目标，下轮重试
+                self.failures += 1
+                logger.exception("prewarm failed for %s", "/".join(str(p or "") for p in target))
+        self.runs += 1
+        self.reports += warmed
+        self.last_run_ms = round((time.perf_counter() - started) * 1000, 2)
+        self.last_run_at = time.time()
+        logger.info("prewarmed %d reports in %.0f ms", warmed, self.last_run_ms)
+        return warmed
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.running,
+            "targets": len(self.targets),
+            "interval": self.interval,
+            "runs": self.runs,
+            "reports": self.reports,
+            "failures": self.failures,
+            "last_run_ms": self.last_run_ms,
+            "last_run_at": self.last_run_at,
+        }
@@ -0,0 +1,54 @@
+"""Server-side ordering and filtering of computed report rows.
+
+Sort keys are computed metrics (day cells keep the last record of the day, the
+summary covers the trailing window), so they cannot be evaluated in the Mongo
+pipeline. A sorted or filtered request builds every row of the query once --
+served from the report cache when enabled, so all sort variants share one
+entry -- and keeps only the first ``page * page_size`` rows with a bounded
+heap instead of sorting everything.
+
+``sort_by`` is a ``summary_12d`` field (``sales_qty``, ``ad_ratio``, ...) or
+``days.<metric>`` for one period column, chosen by ``period`` (default ``-1``,
+the latest column).
+"""
+from __future__ import annotations
+
+import heapq
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .serialize import CELL_METRICS, SUMMARY_FIELDS
+
+
+PERIOD_PREFIX = "days."
+SORT_FIELDS: Tuple[str, ...] = SUMMARY_FIELDS + tuple(PERIOD_PREFIX + f for f in CELL_METRICS)
+SORT_PATTERN = "^(" + "|".join(f.replace(".", r"\.") for f in SORT_FIELDS) + ")$"
+
+Row = Dict[str, Any]
+
+
+def row_sort_key(sort_by: str, period: int = -1) -> Callable[[Row], Any]:
+    if sort_by.startswith(PERIOD_PREFIX):
+        metric = sort_by[len(PERIOD_PREFIX):]
+        return lambda row: row["days"][period][metric]
+    return lambda row: row["summary_12d"][sort_by]
+
+
+def select_rows(
+    rows: Sequence[Row],
+    page: int,
+    page_size: int,
+    sort_by: Optional[str] = None,
+    order: str = "desc",
+    period: int = -1,
+    min_sales: Optional[int] = None,
+) -> Tuple[int, List[Row]]:
+    """(total after filtering, rows of the requested page)."""
+    if min_sales is not None:
+        rows = [r for r in rows if r["summary_12d"]["sales_qty"] >= min_sales]
+    total = len(rows)
+    start = max(page - 1, 0) * page_size
+    if sort_by:
+        # 只保留前 page * page_size 行；相同键保持原（商品键）顺序
+        pick = heapq.nlargest if order == "desc" else heapq.nsmallest
+        rows = pick(start + page_size, rows, key=row_sort_key(sort_by, period))
+    return total, list(rows[start:start + page_size])
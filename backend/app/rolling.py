@@ -0,0 +1,60 @@
+"""N-day rolling sums over the day columns of a report row.
+
+``summary_12d`` is the window of the last ``N`` day columns (``N`` defaults
+to 12, see :data:`app.periods.SUMMARY_DAYS`). ``rolling=1`` on /api/report
+adds the same window ending at every column, for trend sparklines. All
+windows of a row come from one prefix-sum pass over its cells -- O(days)
+instead of O(days * N) -- and, like the summary, never reach before the first
+displayed column, so the first ``N - 1`` windows are shorter.
+
+Windows starting at the first column equal the plain sums; later ones are
+differences of prefix sums and can differ from a direct sum in the last bits
+of a float before rounding.
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, List, Sequence, Tuple
+
+
+# 汇总字段 -> 日列指标
+WINDOW_SOURCES: Tuple[Tuple[str, str], ...] = (
+    ("sales_qty", "total_sales_qty"),
+    ("sales_amount", "sales_amount"),
+    ("ad_sales_qty", "ad_sales_qty"),
+    ("ad_spend", "ad_spend"),
+)
+
+
+def summary_from_sums(sales_qty: int, sales_amount: float, ad_sales_qty: int, ad_spend: float) -> Dict[str, Any]:
+    """The ``Summary12D`` dict for one window's sums."""
+    return {
+        "sales_qty": sales_qty,
+        "sales_amount": round(sales_amount, 2),
+        "ad_sales_qty": ad_sales_qty,
+        "ad_spend": round(ad_spend, 2),
+        "ad_ratio": round((ad_spend / sales_amount) if sales_amount > 0 else 0.0, 4),
+        "ad_sales_ratio": round((ad_sales_qty / sales_qty) if sales_qty > 0 else 0.0, 4),
+    }
+
+
+def _prefix(cells: Sequence[Dict[str, Any]], field: str) -> List[Any]:
+    acc = [0]
+    total = 0
+    for cell in cells:
+        total += cell[field]
+        acc.append(total)
+    return acc
+
+
+def rolling_summaries(cells: Sequence[Dict[str, Any]], n: int) -> List[Dict[str, Any]]:
+    """One summary per column: the window of up to ``n`` columns ending there, with its ``date``."""
+    prefix = {name: _prefix(cells, field) for name, field in WINDOW_SOURCES}
+    qty, amt, ad_qty, spend = (prefix[name] for name, _field in WINDOW_SOURCES)
+    out: List[Dict[str, Any]] = []
+    for i, cell in enumerate(cells):
+        end = i + 1
+        lo = max(end - n, 0)
+        point = {"date": cell["date"]}
+        point.update(summary_from_sums(qty[end] - qty[lo], amt[end] - amt[lo], ad_qty[end] - ad_qty[lo], spend[end] - spend[lo]))
+        out.append(point)
+    return out
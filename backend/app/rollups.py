@@ -0,0 +1,205 @@
+"""Materialized weekly/monthly rollups of the daily collection.
+
+Each rollup document has the canonical record shape (see app.normalize) with
+``day`` set to the bucket start: the ISO week's Monday (matching
+``utils.build_weeks``) or the first of the month (``utils.build_months``).
+Metrics are summed over the bucket; ``inventory`` is the value of the latest
+day in the bucket. Week/month reports read these instead of raw days when
+``REPORT_ROLLUPS=1``.
+
+Refresh is incremental: daily records carry ``updated_at``; a watermark in
+the state collection remembers the last refresh, and only the
+(platform, account, bucket) combinations touched since then are recomputed.
+The watermark is the newest ``updated_at`` the refresh saw minus
+``ROLLUP_WATERMARK_LAG`` seconds (default 60): a write stamped before the
+scan but committed after it is picked up by the next refresh; buckets in the
+overlap are simply recomputed twice.
+
+    python -m app.rollups refresh [--full]
+    python -m app.rollups refresh --loop 300   # poll every 5 minutes
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from pymongo import DeleteMany, UpdateOne
+
+from .db import get_collection, get_daily_collection, get_rollup_collection
+from .normalize import DAILY_PROJECTION, FLOAT_METRICS, INT_METRICS, KEY_FIELDS
+from .utils import iso_week_bounds, month_end, month_start
+
+
+GRANULARITIES: Tuple[str, ...] = ("week", "month")
+STATE_ID = "rollups"
+
+# 可累加的指标；inventory 取桶内最后一天，avg_price 由销售额/销量重新计算
+SUM_METRICS: Tuple[str, ...] = tuple(m for m in INT_METRICS + FLOAT_METRICS if m not in ("inventory", "avg_price"))
+
+
+def bucket_bounds(granularity: str, d: date) -> Tuple[date, date]:
+    if granularity == "week":
+        return iso_week_bounds(d)
+    return month_start(d), month_end(d)
+
+
+def _state_collection():
+    return get_collection(collection_name="rollup_state")
+
+
+def _to_dt(d: date) -> datetime:
+    return datetime.combine(d, datetime.min.time())
+
+
+def build_rollups(granularity: str, records: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Sum daily records (any order) into one record per (product key, bucket)."""
+    acc: Dict[tuple, Dict[str, Any]] = {}
+    last_day: Dict[tuple, datetime] = {}
+    for rec in records:
+        start, end = bucket_bounds(granularity, rec["day"].date())
+        k = tuple(rec[f] for f in KEY_FIELDS) + (start,)
+        out = acc.get(k)
+        if out is None:
+            out = {f: rec[f] for f in KEY_FIELDS}
+            out.update({"day": _to_dt(start), "period_end": _to_dt(end), "inventory": 0, "days": 0})
+            out.update({m: 0 for m in SUM_METRICS})
+            acc[k] = out
+        for m in SUM_METRICS:
+            out[m] += rec.get(m, 0)
+        out["days"] += 1
+        if k not in last_day or rec["day"] >= last_day[k]:
+            last_day[k] = rec["day"]
+            out["inventory"] = rec.get("inventory", 0)
+    for out in acc.values():
+        qty = out["total_sales_qty"]
+        out["avg_price"] = round(out["sales_amount"] / qty, 2) if qty > 0 else 0.0
+    return list(acc.values())
+
+
+def watermark_lag() -> timedelta:
+    return timedelta(seconds=max(0.0, float(os.getenv("ROLLUP_WATERMARK_LAG", "60"))))
+
+
+def _aware(dt: datetime) -> datetime:
+    # motor 默认返回不带时区的 UTC 时间
+    return dt if dt.tzinfo is not None else dt.replace(tzinfo=timezone.utc)
+
+
+async def _touched_buckets(
+    since: Optional[datetime],
+) -> Tuple[Dict[str, Set[Tuple[str, str, date]]], Optional[datetime]]:
+    """Buckets with daily records updated after ``since``, and the newest ``updated_at`` seen."""
+    flt: Dict[str, Any] = {"updated_at": {"$gt": since}} if since is not None else {}
+    touched: Dict[str, Set[Tuple[str, str, date]]] = {g: set() for g in GRANULARITIES}
+    newest: Optional[datetime] = None
+    cursor = get_daily_collection().find(flt, {"platform": 1, "account": 1, "day": 1, "updated_at": 1, "_id": 0})
+    async for doc in cursor:
+        d = doc["day"].date()
+        for g in GRANULARITIES:
+            touched[g].add((doc.get("platform", ""), doc.get("account", ""), bucket_bounds(g, d)[0]))
+        stamp = doc.get("updated_at")
+        if stamp is not None:
+            stamp = _aware(stamp)
+            if newest is None or stamp > newest:
+                newest = stamp
+    return touched, newest
+
+
+async def refresh_buckets(granularity: str, buckets: Iterable[Tuple[str, str, date]]) -> int:
+    """Recompute the given (platform, account, bucket_start) buckets from the daily collection."""
+    by_account: Dict[Tuple[str, str], List[date]] = defaultdict(list)
+    for platform, account, start in buckets:
+        by_account[(platform, account)].append(start)
+
+    daily = get_daily_collection()
+    target = get_rollup_collection(granularity)
+    written = 0
+    for (platform, account), starts in by_account.items():
+        ranges = [bucket_bounds(granularity, s) for s in sorted(starts)]
+        day_or = [{"day": {"$gte": _to_dt(s), "$lt": _to_dt(e + timedelta(days=1))}} for s, e in ranges]
+        flt = {"platform": platform, "account": account, "$or": day_or}
+        records = [doc async for doc in daily.find(flt, DAILY_PROJECTION)]
+        now = datetime.now(timezone.utc)
+        ops: List[Any] = []
+        for out in build_rollups(granularity, records):
+            key_flt = {f: out[f] for f in KEY_FIELDS}
+            key_flt["day"] = out["day"]
+            body = {k: v for k, v in out.items() if k not in key_flt}
+            body["updated_at"] = now
+            ops.append(UpdateOne(key_flt, {"$set": body}, upsert=True))
+        # 桶内已不存在的商品：本次未更新的旧文档一并清理
+        for s, _e in ranges:
+            ops.append(DeleteMany({"platform": platform, "account": account, "day": _to_dt(s), "updated_at": {"$lt": now}}))
+        if ops:
+            await target.bulk_write(ops, ordered=False)
+        written += len(ops) - len(ranges)
+    return written
+
+
+_refresh_lock: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Lock]] = None
+
+
+def _lock() -> asyncio.Lock:
+    # 锁绑定事件循环；测试等场景会换循环，按循环重建
+    global _refresh_lock
+    loop = asyncio.get_running_loop()
+    if _refresh_lock is None or _refresh_lock[0] is not loop:
+        _refresh_lock = (loop, asyncio.Lock())
+    return _refresh_lock[1]
+
+
+async def refresh_rollups(full: bool = False) -> Dict[str, Any]:
+    """Refresh every bucket touched since the stored watermark (all buckets when ``full``).
+
+    Refreshes in one process run one at a time: each refresh ends with a
+    ``DeleteMany`` of bucket documents older than its own upserts, which would
+    remove the rows an overlapping refresh had just written.
+    """
+    async with _lock():
+        return await _refresh(full)
+
+
+async def _refresh(full: bool) -> Dict[str, Any]:
+    state = _state_collection()
+    since: Optional[datetime] = None
+    if not full:
+        doc = await state.find_one({"_id": STATE_ID})
+        since = doc.get("watermark") if doc else None
+    touched, newest = await _touched_buckets(since)
+    result: Dict[str, Any] = {"since": since, "buckets": {}, "written": {}}
+    for g in GRANULARITIES:
+        result["buckets"][g] = len(touched[g])
+        result["written"][g] = await refresh_buckets(g, touched[g])
+    # 水位线取本次实际看到的最新 updated_at 再回退 lag，而不是刷新开始时间：
+    # 批量写入在扫描前取的时间戳、扫描后才提交的记录，下一轮仍会被扫到
+    if newest is not None:
+        watermark = newest - watermark_lag()
+        if since is None or watermark > _aware(since):
+            await state.update_one({"_id": STATE_ID}, {"$set": {"watermark": watermark}}, upsert=True)
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.rollups")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_refresh = sub.add_parser("refresh", help="增量刷新周/月预聚合")
+    p_refresh.add_argument("--full", action="store_true", help="忽略水位线，全部重算")
+    p_refresh.add_argument("--loop", type=int, default=0, help="按秒轮询，持续增量刷新")
+    args = parser.parse_args(argv)
+
+    async def _run() -> None:
+        print(await refresh_rollups(full=args.full))
+        while args.loop > 0:
+            await asyncio.sleep(args.loop)
+            print(await refresh_rollups())
+
+    if args.cmd == "refresh":
+        asyncio.run(_run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Declared fields of operation_report documents and a per-shape alias resolver.
+
+Spreadsheet imports name the same column differently from file to file.
+:data:`RAW_FIELD_MAP` lists, for every canonical field, its raw aliases in
+priority order. :func:`resolve` compiles one extractor per distinct document
+key-set -- only the aliases that shape actually has, as straight-line
+lookups -- and caches it, so the per-document work has no fallback chains
+through absent columns.
+
+An alias counts as missing only when it is absent, None or blank; a stored
+``0`` is a real value and wins over lower-priority aliases.
+"""
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, FrozenSet, List, Tuple
+
+
+KEY_FIELDS: Tuple[str, ...] = ("ozon_id", "name_cn", "category", "sku", "platform", "account")
+INT_METRICS: Tuple[str, ...] = ("total_sales_qty", "ad_sales_qty", "natural_sales_qty", "inventory")
+FLOAT_METRICS: Tuple[str, ...] = (
+    "avg_price",
+    "sales_amount",
+    "goods_cost",
+    "sales_cost",
+    "ad_spend",
+    "payout",
+)
+METRIC_FIELDS: Tuple[str, ...] = INT_METRICS + FLOAT_METRICS
+
+# 原始文档字段表：规范字段 -> 原始列名（按读取优先级）。报表只读取这些列，
+# 据此生成查询投影，宽表导入的其他列不再从 Mongo 传回。
+# 广告销量/花费由模板 + 搜索两部分相加，故以 tpl_*/search_* 两项声明。
+RAW_DATE_FIELDS: Tuple[str, ...] = ("日期", "date", "Date")
+RAW_FIELD_MAP: Dict[str, Tuple[str, ...]] = {
+    "ozon_id": ("Ozon ID",),
+    "name_cn": ("中文名称",),
+    "category": ("类别",),
+    "sku": ("SKU",),
+    "platform": ("平台", "platform"),
+    "account": ("账号", "account"),
+    "day": RAW_DATE_FIELDS,
+    "total_sales_qty": ("总销量", "销量", "销售量"),
+    "tpl_sales_qty": ("模板销量",),
+    "search_sales_qty": ("搜索销量",),
+    "natural_sales_qty": ("自然销量",),
+    "tpl_spend": ("总模板花费", "模板花费"),
+    "search_spend": ("总搜索花费", "搜索花费"),
+    "avg_price": ("均价", "售价"),
+    "sales_amount": ("总销售额", "销售额"),
+    "goods_cost": ("总货物成本", "货物成本", "成本|卢布", "成本"),
+    "sales_cost": ("总销售成本", "销售成本"),
+    "payout": ("总回款", "回款"),
+    "inventory": ("库存数量",),
+}
+
+# 形状缓存上限：正常只有少数几种导入模板
+MAX_SHAPES = 1024
+
+
+def is_missing(v: Any) -> bool:
+    return v is None or (isinstance(v, str) and not v.strip())
+
+
+def _present(expr: str) -> str:
+    # 与 is_missing 相反的内联判断，避免函数调用
+    return f"(v := {expr}) is not None and not (v.__class__ is str and not v.strip())"
+
+
+def compile_extractor(keys: FrozenSet[str]) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """Generate ``doc -> {canonical: value}`` for one key-set.
+
+    Aliases the shape lacks are dropped at compile time; the remaining ones
+    become one conditional expression per field, tried in priority order.
+    """
+    items: List[str] = []
+    for canon, aliases in RAW_FIELD_MAP.items():
+        expr = "None"
+        for alias in reversed([a for a in aliases if a in keys]):
+            expr = f"(v if {_present(f'doc[{alias!r}]')} else {expr})"
+        items.append(f"{canon!r}: {expr}")
+    src = "def extract(doc):\n    return {" + ", ".join(items) + "}\n"
+    namespace: Dict[str, Any] = {}
+    exec(src, namespace)  # noqa: S102 - 源码只由 RAW_FIELD_MAP 生成
+    return namespace["extract"]
+
+
+_extractors: Dict[FrozenSet[str], Callable[[Dict[str, Any]], Dict[str, Any]]] = {}
+
+
+def extractor_for(doc: Dict[str, Any]) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    keys = frozenset(doc)
+    ext = _extractors.get(keys)
+    if ext is None:
+        if len(_extractors) >= MAX_SHAPES:
+            _extractors.clear()
+        ext = _extractors[keys] = compile_extractor(keys)
+    return ext
+
+
+def resolve(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """``{canonical field: first non-missing alias value or None}`` for a raw document."""
+    return extractor_for(doc)(doc)
+
+
+def shape_count() -> int:
+    return len(_extractors)
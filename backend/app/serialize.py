@@ -0,0 +1,101 @@
+"""Fast JSON output for report payloads built as plain dicts.
+
+Report rows are produced as dicts in the ``ReportRow`` shape (see
+:data:`CELL_FIELDS`/:data:`SUMMARY_FIELDS` for key order) and written straight
+to bytes, skipping per-cell pydantic models and ``response_model`` validation.
+orjson is used when installed; the stdlib encoder is the fallback.
+
+``layout=columnar`` on /api/report turns the repeated per-cell objects into a
+period header plus one array per metric on each row.
+"""
+from __future__ import annotations
+
+import json
+from datetime import date
+from typing import Any, Dict, List, Sequence, Tuple
+
+from fastapi.responses import Response
+
+try:
+    import orjson  # 可选依赖，未安装时退回标准库
+except ImportError:  # pragma: no cover - 取决于部署环境
+    orjson = None
+
+
+# 与 models.DayMetrics / Summary12D / ReportRow 字段顺序一致
+CELL_FIELDS: Tuple[str, ...] = (
+    "date",
+    "total_sales_qty",
+    "ad_sales_qty",
+    "natural_sales_qty",
+    "avg_price",
+    "goods_cost",
+    "sales_cost",
+    "ad_spend",
+    "sales_amount",
+    "payout",
+    "profit",
+    "inventory",
+    "ad_ratio",
+)
+CELL_METRICS: Tuple[str, ...] = CELL_FIELDS[1:]
+SUMMARY_FIELDS: Tuple[str, ...] = ("sales_qty", "sales_amount", "ad_sales_qty", "ad_spend", "ad_ratio", "ad_sales_ratio")
+ROW_ID_FIELDS: Tuple[str, ...] = ("category", "name_cn", "sku", "ozon_id", "platform", "account")
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, date):
+        return obj.isoformat()
+    if hasattr(obj, "tolist"):  # numpy 标量/数组
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def slim_rows(rows: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Listing rows: identity and summary only; day cells come from /api/report/product."""
+    out: List[Dict[str, Any]] = []
+    for row in rows:
+        item = {f: row[f] for f in ROW_ID_FIELDS}
+        item["summary_12d"] = row["summary_12d"]
+        if "compare" in row:
+            cmp = row["compare"]
+            item["compare"] = {k: cmp[k] for k in ("summary_12d", "summary_delta", "summary_pct")}
+        out.append(item)
+    return out
+
+
+def columnar_rows(rows: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Rows with ``metrics: {field: [value per period]}`` in place of ``days``."""
+    out: List[Dict[str, Any]] = []
+    for row in rows:
+        item = {f: row[f] for f in ROW_ID_FIELDS}
+        item["summary_12d"] = row["summary_12d"]
+        cells = row["days"]
+        item["metrics"] = {f: [cell[f] for cell in cells] for f in CELL_METRICS}
+        if "rolling" in row:
+            item["rolling"] = {f: [point[f] for point in row["rolling"]] for f in SUMMARY_FIELDS}
+        if "compare" in row:
+            cmp = row["compare"]
+            item["compare"] = {
+                "metrics": {f: [cell[f] for cell in cmp["days"]] for f in CELL_METRICS},
+                "delta": {f: [d[f] for d in cmp["delta"]] for f in CELL_METRICS},
+                "pct": {f: [p[f] for p in cmp["pct"]] for f in CELL_METRICS},
+                "summary_12d": cmp["summary_12d"],
+                "summary_delta": cmp["summary_delta"],
+                "summary_pct": cmp["summary_pct"],
+            }
+        out.append(item)
+    return out
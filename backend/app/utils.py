@@ -1,25 +1,17 @@
 from __future__ import annotations
 
-from datetime import date, datetime, timedelta
-from typing import Iterable, Optional
+from datetime import date, timedelta
+from typing import Iterable
 
-
-DATE_FORMATS = [
-    "%Y-%m-%d",
-    "%Y/%m/%d",
-    "%Y/%-m/%-d",
-    "%Y-%m-%dT%H:%M:%S",
-]
+from .dates import parse_date
 
 
 def parse_any_date(value: str) -> date:
-    last_error: Optional[Exception] = None
-    for fmt in DATE_FORMATS:
-        try:
-            return datetime.strptime(value, fmt).date()
-        except Exception as exc:  # noqa: BLE001
-            last_error = exc
-    raise ValueError(f"Unsupported date format: {value}") from last_error
+    """YYYY-MM-DD / YYYY/M/D 等已知写法（见 app.dates），无法解析时抛 ValueError。"""
+    d = parse_date(value)
+    if d is None:
+        raise ValueError(f"Unsupported date format: {value}")
+    return d
 
 
 def month_start(d: date) -> date:
@@ -86,3 +78,39 @@ def build_months(end: date, n: int) -> list[tuple[date, date, str]]:
             cur = ms.replace(month=ms.month - 1, day=15)
     months.reverse()
     return months
+
+
+def quarter_start(d: date) -> date:
+    return d.replace(month=(d.month - 1) // 3 * 3 + 1, day=1)
+
+
+def build_quarters(end: date, n: int) -> list[tuple[date, date, str]]:
+    """Build list of n calendar quarters ending at quarter containing 'end'.
+    Returns list of (start_date, end_date, label 'YYYY-Qk') oldest first.
+    """
+    quarters: list[tuple[date, date, str]] = []
+    qs = quarter_start(end)
+    for _ in range(n):
+        qe = month_end(qs.replace(month=qs.month + 2))
+        quarters.append((qs, qe, f"{qs.year:04d}-Q{(qs.month - 1) // 3 + 1}"))
+        # move to previous quarter
+        if qs.month == 1:
+            qs = qs.replace(year=qs.year - 1, month=10)
+        else:
+            qs = qs.replace(month=qs.month - 3)
+    quarters.reverse()
+    return quarters
+
+
+def build_windows(end: date, n: int, size: int) -> list[tuple[date, date]]:
+    """Build list of n consecutive size-day windows, the last one ending at 'end'.
+    Returns in ascending order (oldest window first).
+    """
+    windows: list[tuple[date, date]] = []
+    cur_end = end
+    for _ in range(n):
+        cur_start = cur_end - timedelta(days=size - 1)
+        windows.append((cur_start, cur_end))
+        cur_end = cur_start - timedelta(days=1)
+    windows.reverse()
+    return windows
@@ -0,0 +1,5 @@
+"""Benchmarks for the report API (synthetic data, not shipped with the app).
+
+    python -m bench.generate --skus 200 --days 180 --out data.ndjson
+    python -m bench.run --skus 200 --days 180 --save bench/baselines/local.json
+"""
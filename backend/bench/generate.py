@@ -0,0 +1,170 @@
+"""Synthetic operation_report documents.
+
+Documents look like real spreadsheet imports: each SKU comes from one of a
+few import templates (different Chinese aliases for the same metric), dates
+are BSON Dates or strings in every supported spelling (optionally with a
+time), large numbers are comma-formatted strings, platform/account labels
+carry stray case and whitespace (fixed per import), and a small share of
+rows is undated or has blank cells. Output is deterministic for a given seed.
+
+    python -m bench.generate --skus 200 --days 180 --out data.ndjson
+    python -m bench.generate --skus 200 --days 180 --mongo   # 写入 MONGODB_URI
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# 导入模板：同一指标在不同表格里的列名（均为 app.schema.RAW_FIELD_MAP 中的别名）
+TEMPLATES: Tuple[Dict[str, str], ...] = (
+    {"qty": "总销量", "amount": "总销售额", "goods_cost": "总货物成本", "sales_cost": "总销售成本",
+     "tpl_spend": "总模板花费", "search_spend": "总搜索花费", "payout": "总回款", "price": "均价"},
+    {"qty": "销量", "amount": "销售额", "goods_cost": "货物成本", "sales_cost": "销售成本",
+     "tpl_spend": "模板花费", "search_spend": "搜索花费", "payout": "回款", "price": "售价"},
+    {"qty": "销售量", "amount": "销售额", "goods_cost": "成本|卢布", "sales_cost": "销售成本",
+     "tpl_spend": "模板花费", "search_spend": "搜索花费", "payout": "回款", "price": "均价"},
+)
+CATEGORIES: Tuple[str, ...] = ("家居", "服装", "数码", "美妆", "母婴", "运动")
+ACCOUNTS: Tuple[str, ...] = ("个人舒适", "Shop B", "Shop C")
+DATE_STYLES: Tuple[str, ...] = ("bson", "iso", "slash", "slash_short", "dash_short", "iso_time")
+WIDE_COLUMNS = 12  # 宽表导入中报表不读取的其他列
+
+
+def _date_value(d: date, style: str, rnd: random.Random) -> Any:
+    if style == "bson":
+        return datetime.combine(d, datetime.min.time())
+    if style == "iso":
+        return d.isoformat()
+    if style == "slash":
+        return f"{d.year}/{d.month:02d}/{d.day:02d}"
+    if style == "slash_short":
+        return f"{d.year}/{d.month}/{d.day}"
+    if style == "dash_short":
+        return f"{d.year}-{d.month}-{d.day}"
+    return f"{d.isoformat()}T{rnd.randint(0, 23):02d}:{rnd.randint(0, 59):02d}:00"
+
+
+def _number(v: float, rnd: random.Random, digits: int = 2) -> Any:
+    # 约一半写成带千分位的字符串
+    if rnd.random() < 0.5:
+        return f"{v:,.{digits}f}" if digits else f"{int(v):,}"
+    return round(v, digits) if digits else int(v)
+
+
+def _label(v: str, rnd: random.Random) -> str:
+    r = rnd.random()
+    if r < 0.2:
+        return f" {v.upper()} "
+    if r < 0.4:
+        return v.title()
+    return v
+
+
+def generate_docs(
+    skus: int,
+    days: int,
+    end: date,
+    seed: int = 1,
+    platforms: Tuple[str, ...] = ("ozon",),
+    missing_rate: float = 0.08,
+    undated_rate: float = 0.002,
+) -> Iterator[Dict[str, Any]]:
+    """Yield ``skus * days`` documents (minus ``missing_rate`` skipped days), SKU by SKU."""
+    rnd = random.Random(seed)
+    for s in range(skus):
+        tpl = TEMPLATES[s % len(TEMPLATES)]
+        # 标签写法按导入文件（SKU）固定，不逐行变化
+        platform = _label(platforms[s % len(platforms)], rnd)
+        account = _label(ACCOUNTS[s % len(ACCOUNTS)], rnd)
+        base_qty = rnd.choice((3, 20, 120, 900))
+        price = round(rnd.uniform(150, 5000), 2)
+        stock = rnd.randint(200, 20000)
+        for i in range(days):
+            if rnd.random() < missing_rate:
+                continue
+            d = end - timedelta(days=i)
+            qty = max(int(rnd.gauss(base_qty, base_qty * 0.3)), 0)
+            tpl_qty = rnd.randint(0, qty // 4 + 1)
+            search_qty = rnd.randint(0, qty // 4 + 1)
+            stock = max(stock - qty + (rnd.randint(0, 4 * base_qty) if rnd.random() < 0.2 else 0), 0)
+            doc: Dict[str, Any] = {
+                "日期": None if rnd.random() < undated_rate else _date_value(d, rnd.choice(DATE_STYLES), rnd),
+                "平台": platform,
+                "账号": account,
+                "Ozon ID": 100000 + s if s % 4 == 0 else str(100000 + s),
+                "中文名称": f"商品{s:05d}",
+                "类别": CATEGORIES[s % len(CATEGORIES)],
+                "SKU": f"SKU-{s:05d}",
+                tpl["qty"]: _number(qty, rnd, 0),
+                "模板销量": tpl_qty,
+                "搜索销量": str(search_qty),
+                tpl["price"]: price,
+                tpl["amount"]: _number(qty * price, rnd),
+                tpl["goods_cost"]: "" if rnd.random() < 0.05 else _number(qty * price * 0.4, rnd),
+                tpl["sales_cost"]: _number(qty * price * 0.15, rnd),
+                tpl["tpl_spend"]: _number(tpl_qty * rnd.uniform(5, 40), rnd, 3),
+                tpl["search_spend"]: f"{search_qty * rnd.uniform(5, 40):.3f}",
+                tpl["payout"]: _number(qty * price * 0.7, rnd),
+                "库存数量": stock,
+            }
+            if rnd.random() < 0.5:
+                doc["自然销量"] = max(qty - tpl_qty - search_qty, 0)
+            for c in range(WIDE_COLUMNS):
+                doc[f"备注{c}"] = "x" * 24
+            yield doc
+
+
+async def insert_docs(coll: Any, docs: Iterator[Dict[str, Any]], batch_size: int = 5000) -> int:
+    written = 0
+    buf: List[Dict[str, Any]] = []
+    for doc in docs:
+        buf.append(doc)
+        if len(buf) >= batch_size:
+            await coll.insert_many(buf, ordered=False)
+            written += len(buf)
+            buf = []
+    if buf:
+        await coll.insert_many(buf, ordered=False)
+        written += len(buf)
+    return written
+
+
+def _json_default(v: Any) -> Any:
+    if isinstance(v, datetime):
+        return {"$date": v.isoformat() + "Z"}
+    raise TypeError(type(v).__name__)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m bench.generate")
+    parser.add_argument("--skus", type=int, default=200)
+    parser.add_argument("--days", type=int, default=180)
+    parser.add_argument("--end", default=date.today().isoformat(), help="最后一天，YYYY-MM-DD")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="写入 NDJSON 文件（Extended JSON 日期），默认输出到 stdout")
+    parser.add_argument("--mongo", action="store_true", help="直接写入 MONGODB_URI / MONGODB_DB / MONGODB_COLL")
+    args = parser.parse_args(argv)
+
+    docs = generate_docs(args.skus, args.days, date.fromisoformat(args.end), args.seed)
+    if args.mongo:
+        from app.db import get_collection
+
+        print(f"inserted {asyncio.run(insert_docs(get_collection(), docs))} into {os.getenv('MONGODB_COLL', 'operation_report')}")
+        return
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    try:
+        for doc in docs:
+            out.write(json.dumps(doc, ensure_ascii=False, default=_json_default) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,462 @@
+"""Benchmark harness for /api/report.
+
+Loads synthetic documents (see bench.generate) into an in-memory Mongo
+(mongomock-motor, ``--mongo mock``) or a scratch database on ``MONGODB_URI``
+(``--mongo uri``), then drives the ASGI app directly -- no server, no HTTP
+client -- through the day/week/month scenarios below. Stage timings and
+counters come from the request metrics (app.metrics) of every call.
+
+Per scenario it reports latency percentiles of the whole request and of each
+stage, docs/sec (documents scanned per second of request and of each stage),
+and peak traced memory per request and per stage from a separate
+tracemalloc pass (tracing slows Python down, so it never overlaps the timed
+runs).
+
+    python -m bench.run --skus 200 --days 180 --repeat 20
+    python -m bench.run --save bench/baselines/local.json
+    python -m bench.run --compare bench/baselines/local.json --threshold 0.15
+
+``--compare`` exits with status 1 when any scenario's p50 is slower than the
+baseline by more than the threshold.
+
+``--check-parity`` skips the benchmark and checks that the columnar engine
+(app.columnar) builds byte-identical rows to the Python builder for the same
+synthetic groups -- day, week, month and quarter columns, with and without
+``compare=prev|yoy``, including duplicate and out-of-range days -- and exits
+with status 1 on the first mismatch:
+
+    python -m bench.run --check-parity --skus 50 --days 400
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform as _platform
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import date
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import urlencode
+
+from .generate import generate_docs, insert_docs
+
+
+# 场景：名称 -> /api/report 查询参数（date 由 --end 填入）
+SCENARIOS: Dict[str, Dict[str, Any]] = {
+    "day": {"mode": "day"},
+    "day-62": {"mode": "day", "days": 62},
+    "week": {"mode": "week", "weeks": 12},
+    "month": {"mode": "month", "months": 6},
+    "day-sorted": {"mode": "day", "sort_by": "sales_qty"},
+}
+PERCENTILES: Tuple[int, ...] = (50, 90, 99)
+THROUGHPUT_STAGES: Tuple[str, ...] = ("fetch", "group", "build")
+
+
+class _Capture(logging.Handler):
+    """Collects the structured request log lines of app.metrics."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.records: List[Dict[str, Any]] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.records.append(json.loads(record.getMessage()))
+
+
+def _configure_env(args: argparse.Namespace) -> None:
+    # 必须在导入 app 之前设置
+    os.environ["REPORT_CACHE_TTL"] = str(args.cache_ttl)
+    os.environ["REPORT_ENGINE"] = args.engine
+    os.environ["REPORT_SOURCE"] = args.source
+    os.environ["REPORT_ROLLUPS"] = "1" if args.rollups else "0"
+    os.environ["REPORT_REQUEST_LOG"] = "1"
+    os.environ.setdefault("MONGO_ENSURE_INDEXES", "0")
+    os.environ.setdefault("MONGO_WARMUP", "0")
+    if args.mongo == "uri":
+        os.environ["MONGODB_DB"] = args.db
+
+
+def _install_mock_client() -> Any:
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+        from mongomock_motor import AsyncMongoMockCollection
+    except ImportError:  # 可选依赖
+        sys.exit("--mongo mock 需要 mongomock-motor：pip install mongomock-motor（或改用 --mongo uri）")
+    import app.db as db
+
+    # mongomock-motor 的 with_options() 返回未包装的同步集合；内存库没有副本集，读偏好无意义
+    AsyncMongoMockCollection.with_options = lambda self, **_kw: self  # type: ignore[method-assign]
+    db._client = AsyncMongoMockClient()
+    return db._client
+
+
+async def _asgi_get(app: Any, path: str, params: Dict[str, Any]) -> Tuple[int, bytes]:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": urlencode(params).encode(),
+        "root_path": "",
+        "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80),
+    }
+    status = 0
+    body: List[bytes] = []
+    sent = False
+
+    async def receive() -> Dict[str, Any]:
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.Event().wait()  # 客户端不会断开
+        return {"type": "http.disconnect"}
+
+    async def send(message: Dict[str, Any]) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            body.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status, b"".join(body)
+
+
+def _percentile(values: Sequence[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def _dist(values: Sequence[float]) -> Dict[str, float]:
+    out = {f"p{p}": round(_percentile(values, p), 3) for p in PERCENTILES}
+    out["max"] = round(max(values), 3) if values else 0.0
+    return out
+
+
+@contextmanager
+def _traced_stages(peaks: Dict[str, int]) -> Iterator[None]:
+    """Record tracemalloc peaks per stage by wrapping app.main's stage()."""
+    import app.main as main
+
+    original = main.stage
+
+    @contextmanager
+    def traced(name: str) -> Iterator[None]:
+        tracemalloc.reset_peak()
+        with original(name):
+            yield
+        peaks[name] = max(peaks.get(name, 0), tracemalloc.get_traced_memory()[1])
+
+    main.stage = traced
+    try:
+        yield
+    finally:
+        main.stage = original
+
+
+async def _run_scenario(
+    app: Any,
+    capture: _Capture,
+    params: Dict[str, Any],
+    repeat: int,
+    warmup: int,
+) -> Dict[str, Any]:
+    async def once() -> Dict[str, Any]:
+        capture.records.clear()
+        status, body = await _asgi_get(app, "/api/report", params)
+        if status != 200:
+            raise RuntimeError(f"/api/report {params} -> {status}: {body[:300]!r}")
+        rec = capture.records[-1]
+        rec["bytes"] = len(body)
+        return rec
+
+    for _ in range(warmup):
+        await once()
+    runs = [await once() for _ in range(repeat)]
+
+    stage_peaks: Dict[str, int] = {}
+    tracemalloc.start()
+    try:
+        with _traced_stages(stage_peaks):
+            tracemalloc.reset_peak()
+            await once()
+            request_peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    totals = [r["total_ms"] for r in runs]
+    docs = runs[-1].get("docs", 0)
+    stage_names = sorted({s for r in runs for s in r["stages_ms"]})
+    stages: Dict[str, Any] = {}
+    for name in stage_names:
+        ms = [r["stages_ms"].get(name, 0.0) for r in runs]
+        entry: Dict[str, Any] = _dist(ms)
+        p50 = entry["p50"]
+        if name in THROUGHPUT_STAGES and docs and p50 > 0:
+            entry["docs_per_sec"] = round(docs / (p50 / 1000))
+        entry["peak_kb"] = round(stage_peaks.get(name, 0) / 1024, 1)
+        stages[name] = entry
+    summary: Dict[str, Any] = _dist(totals)
+    summary.update(
+        {
+            "mean": round(sum(totals) / len(totals), 3),
+            "docs": docs,
+            "rows": runs[-1].get("rows", 0),
+            "bytes": runs[-1]["bytes"],
+            "docs_per_sec": round(docs / (summary["p50"] / 1000)) if docs and summary["p50"] > 0 else 0,
+            "peak_kb": round(request_peak / 1024, 1),
+            "stages": stages,
+        }
+    )
+    return summary
+
+
+async def _load(args: argparse.Namespace, end: date) -> Dict[str, Any]:
+    from app.db import get_collection
+
+    coll = get_collection()
+    await coll.delete_many({})
+    started = time.perf_counter()
+    n = await insert_docs(coll, generate_docs(args.skus, args.days, end, args.seed))
+    info: Dict[str, Any] = {"docs": n, "insert_s": round(time.perf_counter() - started, 2)}
+    if args.source == "daily":
+        from app.db import get_daily_collection, get_rollup_collection
+        from app.normalize import backfill
+        from app.rollups import refresh_rollups
+
+        await get_daily_collection().delete_many({})
+        started = time.perf_counter()
+        info["backfill"] = await backfill()
+        info["backfill_s"] = round(time.perf_counter() - started, 2)
+        if args.rollups:
+            for g in ("week", "month"):
+                await get_rollup_collection(g).delete_many({})
+            info["rollups"] = await refresh_rollups(full=True)
+    return info
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    capture = _Capture()
+    metrics_logger = logging.getLogger("app.metrics")
+    metrics_logger.addHandler(capture)  # 先挂上 handler，setup_request_log 不再输出到 stderr
+    metrics_logger.propagate = False
+
+    if args.mongo == "mock":
+        _install_mock_client()
+    from app.main import app
+
+    end = date.fromisoformat(args.end)
+    load = await _load(args, end)
+    print(f"loaded {json.dumps(load, ensure_ascii=False, default=str)}", file=sys.stderr)
+
+    results: Dict[str, Any] = {}
+    for name in args.scenarios:
+        params = {"date": end.isoformat(), "page": 1, "page_size": args.page_size, **SCENARIOS[name]}
+        results[name] = await _run_scenario(app, capture, params, args.repeat, args.warmup)
+        print(f"  {name}: p50 {results[name]['p50']} ms", file=sys.stderr)
+
+    if args.mongo == "uri":
+        from app.db import get_mongo_client
+
+        await get_mongo_client().drop_database(args.db)
+
+    return {
+        "meta": {
+            "skus": args.skus,
+            "days": args.days,
+            "docs": load["docs"],
+            "seed": args.seed,
+            "end": args.end,
+            "page_size": args.page_size,
+            "repeat": args.repeat,
+            "mongo": args.mongo,
+            "source": args.source,
+            "rollups": args.rollups,
+            "engine": args.engine,
+            "cache_ttl": args.cache_ttl,
+            "python": _platform.python_version(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "scenarios": results,
+    }
+
+
+def print_report(result: Dict[str, Any]) -> None:
+    meta = result["meta"]
+    print(
+        f"{meta['docs']} docs ({meta['skus']} SKU x {meta['days']} days), source={meta['source']}"
+        f"{'+rollups' if meta['rollups'] else ''}, engine={meta['engine']}, mongo={meta['mongo']}"
+    )
+    header = f"{'scenario':<12}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}{'docs/s':>10}{'peak KB':>10}{'rows':>6}"
+    print(header)
+    for name, s in result["scenarios"].items():
+        print(
+            f"{name:<12}{s['p50']:>9.2f}{s['p90']:>9.2f}{s['p99']:>9.2f}{s['max']:>9.2f}"
+            f"{s['docs_per_sec']:>10}{s['peak_kb']:>10.1f}{s['rows']:>6}"
+        )
+        for stage_name, st in s["stages"].items():
+            print(
+                f"  {stage_name:<10}{st['p50']:>9.2f}{st['p90']:>9.2f}{st['p99']:>9.2f}{st['max']:>9.2f}"
+                f"{st.get('docs_per_sec', ''):>10}{st['peak_kb']:>10.1f}"
+            )
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Print p50 deltas against a saved baseline; return the regressed scenarios."""
+    keys = ("skus", "days", "source", "rollups", "engine", "mongo", "page_size")
+    mismatched = [k for k in keys if baseline["meta"].get(k) != result["meta"].get(k)]
+    if mismatched:
+        print(f"warning: baseline differs in {', '.join(mismatched)}; deltas are not like-for-like")
+    regressed: List[str] = []
+    print(f"{'scenario':<12}{'base p50':>10}{'p50':>10}{'delta':>9}")
+    for name, s in result["scenarios"].items():
+        base = baseline["scenarios"].get(name)
+        if base is None:
+            print(f"{name:<12}{'-':>10}{s['p50']:>10.2f}{'new':>9}")
+            continue
+        delta = (s["p50"] - base["p50"]) / base["p50"] if base["p50"] else 0.0
+        flag = ""
+        if delta > threshold:
+            regressed.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<12}{base['p50']:>10.2f}{s['p50']:>10.2f}{delta:>+9.1%}{flag}")
+        for stage_name, st in s["stages"].items():
+            b = base["stages"].get(stage_name)
+            if b and b["p50"]:
+                print(f"  {stage_name:<10}{b['p50']:>10.2f}{st['p50']:>10.2f}{(st['p50'] - b['p50']) / b['p50']:>+9.1%}")
+    return regressed
+
+
+# 一致性检查：(模式, 列数参数)
+PARITY_SPECS: Tuple[Tuple[str, Dict[str, Any]], ...] = (
+    ("day", {}),
+    ("day", {"days": 62, "summary_days": 7}),
+    ("week", {"weeks": 12}),
+    ("month", {"months": 6}),
+    ("quarter", {"quarters": 4}),
+)
+
+
+def _parity_groups(args: argparse.Namespace, end: date) -> List[Tuple[tuple, List[Dict[str, Any]]]]:
+    """Synthetic groups with a duplicate record on some days and records outside every column."""
+    import random
+    from datetime import timedelta
+
+    from app.normalize import normalize_doc
+    from app.schema import KEY_FIELDS
+
+    rnd = random.Random(args.seed)
+    groups: Dict[tuple, List[Dict[str, Any]]] = {}
+    for doc in generate_docs(args.skus, args.days, end, args.seed):
+        rec = normalize_doc(doc)
+        if rec is None:
+            continue
+        recs = groups.setdefault(tuple(rec[k] for k in KEY_FIELDS), [])
+        recs.append(rec)
+        if rnd.random() < 0.05:
+            # 同一天第二条记录：日列取后到的，周/月列累加，库存取后到的
+            recs.append({**rec, "total_sales_qty": rec["total_sales_qty"] + 1, "inventory": rnd.randint(0, 500)})
+    for recs in groups.values():
+        # 报表范围之外（未来日期、早于所有列）的记录应被忽略
+        recs.append({**recs[0], "day": recs[0]["day"] + timedelta(days=args.days + 30)})
+        recs.append({**recs[0], "day": recs[0]["day"] - timedelta(days=3 * 366)})
+        rnd.shuffle(recs)
+    return sorted(groups.items())
+
+
+def check_parity(args: argparse.Namespace) -> List[str]:
+    """Compare columnar.build_rows with the Python builder; return the mismatching cases."""
+    from app import columnar
+    from app.compare import comparison_spec
+    from app.main import _build_row
+    from app.periods import build_spec
+    from app.serialize import dumps
+
+    end = date.fromisoformat(args.end)
+    groups = _parity_groups(args, end)
+    failed: List[str] = []
+    for mode, counts in PARITY_SPECS:
+        spec = build_spec(end, mode, **counts)
+        for compare in (None, "prev", "yoy"):
+            cmp = comparison_spec(spec, compare) if compare else None
+            python_rows = [_build_row(spec, key, recs, cmp) for key, recs in groups]
+            columnar_rows = columnar.build_rows(spec, groups, cmp)
+            name = f"{mode}{counts or ''}{f' compare={compare}' if compare else ''}"
+            if dumps(python_rows) == dumps(columnar_rows):
+                print(f"ok       {name}: {len(python_rows)} rows")
+                continue
+            failed.append(name)
+            for py_row, col_row in zip(python_rows, columnar_rows):
+                if py_row != col_row:
+                    print(f"MISMATCH {name}: {py_row['sku']}\n  python   {dumps(py_row)[:400]!r}\n  columnar {dumps(col_row)[:400]!r}")
+                    break
+    return failed
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m bench.run")
+    parser.add_argument("--skus", type=int, default=200)
+    parser.add_argument("--days", type=int, default=180)
+    parser.add_argument("--end", default="2025-03-20", help="报表日期，也是生成数据的最后一天")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="逗号分隔：" + ",".join(SCENARIOS))
+    parser.add_argument("--mongo", choices=("mock", "uri"), default="mock", help="mock: 内存 mongomock-motor；uri: MONGODB_URI")
+    parser.add_argument("--db", default="ozon_bench", help="--mongo uri 时使用（并在结束时删除）的数据库")
+    parser.add_argument("--source", choices=("raw", "daily"), default="raw")
+    parser.add_argument("--rollups", action="store_true", help="REPORT_ROLLUPS=1（需 --source daily）")
+    parser.add_argument("--engine", choices=("python", "columnar"), default="python")
+    parser.add_argument("--cache-ttl", type=float, default=0, help="REPORT_CACHE_TTL，默认 0（不缓存）")
+    parser.add_argument("--save", help="结果写入该 JSON 文件作为基线")
+    parser.add_argument("--compare", help="与该基线文件比较 p50")
+    parser.add_argument("--threshold", type=float, default=0.15, help="p50 变慢超过该比例视为回归")
+    parser.add_argument("--check-parity", action="store_true", help="只检查列式引擎与 Python 引擎结果一致，不跑基准")
+    args = parser.parse_args(argv)
+    if args.check_parity:
+        os.environ.setdefault("REPORT_CACHE_TTL", "0")
+        os.environ.setdefault("MONGO_ENSURE_INDEXES", "0")
+        os.environ.setdefault("MONGO_WARMUP", "0")
+        if check_parity(args):
+            sys.exit(1)
+        return
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in args.scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario: {', '.join(unknown)}")
+
+    _configure_env(args)
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as fh:
+            json.dump(result, fh, ensure_ascii=False, indent=2)
+        print(f"saved {args.save}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        if compare(result, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()